@@ -1,6 +1,7 @@
 import os
+import asyncio
 from pathlib import Path
-from typing import Generator, List, Dict, Any, Callable, Optional
+from typing import AsyncGenerator, List, Dict, Any, Callable, Optional
 import anthropic
 from anthropic.types import Message
 from dotenv import load_dotenv
@@ -8,16 +9,35 @@ from coordinates_tool import get_area_coordinates
 from regional_interests_tool import get_regional_interests
 from properties_tool import get_properties_in_region
 from conversation_manager import get_conversation_manager
+from websocket_manager import websocket_manager
+from llm_gateway import RETRYABLE_STATUS_CODES, get_llm_gateway
+
+
+def _error_text(error: Exception) -> str:
+    """Text streamed to the user when a run fails."""
+    if isinstance(error, anthropic.APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES:
+        # Still rate limited or overloaded after the gateway's retries
+        return "The assistant is busy right now, please try again in a moment."
+    return f"Agent error: {str(error)}"
+
 
 class UrbanExplorerAgent:
+    """
+    Main chat agent. Holds no per-request state, so one instance (see
+    get_agent) serves every request. API calls go through the shared LLM
+    gateway, which limits and fairly queues them per model.
+    """
+    
     def __init__(self):
         load_dotenv()
-        self.client = anthropic.Anthropic(
-            api_key=os.getenv("ANTHROPIC_API_KEY")
-        )
+        self.llm = get_llm_gateway()
         self.name = "UrbanExplorer"
         self.instructions = self._load_instructions()
         self.model = "claude-sonnet-4-20250514"  # Claude 4.0
+        # Upper bound on tool calls from one step that run at the same time
+        self.tool_concurrency = int(os.getenv("AGENT_TOOL_CONCURRENCY", "4"))
+        # Mark the static system prompt (and the tools ahead of it) as a cacheable prefix
+        self.prompt_caching = os.getenv("AGENT_PROMPT_CACHING", "true").lower() != "false"
         self.conversation_manager = get_conversation_manager()
         
     def _load_instructions(self) -> str:
@@ -128,18 +148,70 @@ class UrbanExplorerAgent:
         }
         return tool_functions.get(tool_name)
     
-    def run_stream(self, user_message: str, conversation_id: str, region_id: Optional[int] = None) -> Generator[str, None, None]:
-        """Run the agent with streaming output and conversation ID. Handles tool calling automatically."""
-        # Load conversation history (user message already added by API)
-        messages = self.conversation_manager.get_conversation_history(conversation_id)
+    def _build_system(self, conversation_id: str, region_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Build the system prompt blocks for a request.
         
-        # Add conversation_id and region_id to system instructions
+        The static instructions come first and carry the cache breakpoint; the
+        cached prefix covers the tool definitions, which precede the system
+        prompt. The per-request conversation and region context goes in a
+        second block after the breakpoint so it never invalidates the cache.
+        """
         context_info = f"CURRENT_CONVERSATION_ID: {conversation_id}"
         if region_id is not None:
             print("INSIDE REGION ID WHICH IS NOT NONE")
             context_info += f"\nCURRENT_REGION_ID: {region_id}"
             context_info += f"\n\nMANDATORY TASKS: You MUST perform the following actions:\n1. Call get_regional_interests_for_area tool with conversation_id='{conversation_id}', region_id={region_id}, and user_interests extracted from the conversation.\n2. Call get_properties_in_region tool with region_id={region_id} and conversation_id='{conversation_id}' to show rental properties in the area.\n   - IMPORTANT: If the user mentions ANY budget/price constraints (e.g., 'under £2000', 'budget of £1500', 'max £2500'), you MUST include the max_price parameter.\n   - Extract the budget amount from the conversation and use it as max_price (convert to integer, e.g., '£2000' becomes 2000).\n\nEXCEPTION: If the user is ONLY asking about specific interests/venues and explicitly NOT interested in housing/properties (e.g., 'just show me coffee shops, I don't care about rentals'), then skip calling get_properties_in_region.\n\nDO NOT call get_coordinates_for_area - only call the two tools above."
-        instructions_with_context = f"{self.instructions}\n\n{context_info}"
+        
+        instructions_block = {"type": "text", "text": self.instructions}
+        if self.prompt_caching:
+            instructions_block["cache_control"] = {"type": "ephemeral"}
+        
+        return [instructions_block, {"type": "text", "text": context_info}]
+    
+    def _log_usage(self, response: Message) -> None:
+        usage = response.usage
+        print(f"[DEBUG] Streaming - Usage: input={usage.input_tokens} output={usage.output_tokens} "
+              f"cache_read={getattr(usage, 'cache_read_input_tokens', 0)} "
+              f"cache_write={getattr(usage, 'cache_creation_input_tokens', 0)}")
+    
+    def _execute_tool(self, tool_call: Any) -> Dict[str, Any]:
+        """Run a tool_use block and build its tool_result block."""
+        print(f"[DEBUG] Streaming - Executing tool: {tool_call.name}")
+        
+        tool_function = self._get_tool_function(tool_call.name)
+        if not tool_function:
+            content = f"Error executing tool: unknown tool {tool_call.name}"
+        else:
+            try:
+                content = str(tool_function(**tool_call.input))
+            except Exception as e:
+                content = f"Error executing tool: {str(e)}"
+        
+        return {
+            "type": "tool_result",
+            "tool_use_id": tool_call.id,
+            "content": content
+        }
+    
+    async def _execute_tools_async(self, tool_calls: List[Any]) -> Dict[str, Any]:
+        """Run a step's tool calls concurrently, each in a worker thread, and return one user message with the results in call order."""
+        semaphore = asyncio.Semaphore(self.tool_concurrency)
+        
+        async def run(tool_call: Any) -> Dict[str, Any]:
+            async with semaphore:
+                return await asyncio.to_thread(self._execute_tool, tool_call)
+        
+        tool_results = await asyncio.gather(*(run(tool_call) for tool_call in tool_calls))
+        return {"role": "user", "content": list(tool_results)}
+    
+    async def run_stream_async(self, user_message: str, conversation_id: str, region_id: Optional[int] = None) -> AsyncGenerator[str, None]:
+        """Run the agent with streaming output for a conversation, handling tool calls. Tools run in worker threads so the event loop stays free."""
+        # Load conversation history (user message already added by API)
+        messages = await self.conversation_manager.get_context_history_async(conversation_id)
+        
+        # Add conversation_id and region_id to system instructions
+        system = self._build_system(conversation_id, region_id)
         
         # Get tools based on whether region_id is provided
         tools = self._define_tools(region_id)
@@ -151,14 +223,28 @@ class UrbanExplorerAgent:
             while True:
                 print(f"[DEBUG] Streaming - Sending to Claude with {len(messages)} messages")
                 
-                # Check if we need to handle tools first (non-streaming)
-                response: Message = self.client.messages.create(
+                # One streaming request per step: text is forwarded as it arrives and
+                # tool_use blocks are collected from the final message
+                async with self.llm.stream_async(
+                    conversation_id,
                     model=self.model,
                     max_tokens=2000,
-                    system=instructions_with_context,
+                    system=system,
                     messages=messages,
                     tools=tools,
-                )
+                ) as stream:
+                    step_text = False
+                    async for text in stream.text_stream:
+                        if not text:
+                            continue
+                        if not step_text and final_response:
+                            # Separate this step's text from the previous step's
+                            text = "\n\n" + text
+                        step_text = True
+                        final_response += text
+                        yield text
+                    response: Message = await stream.get_final_message()
+                self._log_usage(response)
                 
                 # Check if we have tool calls
                 tool_calls = [block for block in response.content if block.type == "tool_use"]
@@ -169,64 +255,34 @@ class UrbanExplorerAgent:
                     # Add assistant message with all content
                     messages.append({"role": "assistant", "content": response.content})
                     
-                    # Execute each tool and add results
-                    for tool_call in tool_calls:
-                        tool_name = tool_call.name
-                        tool_input = tool_call.input
-                        print(f"[DEBUG] Streaming - Executing tool: {tool_name}")
-                        
-                        tool_function = self._get_tool_function(tool_name)
-                        if tool_function:
-                            try:
-                                tool_result = tool_function(**tool_input)
-                                messages.append({
-                                    "role": "user",
-                                    "content": [{
-                                        "type": "tool_result",
-                                        "tool_use_id": tool_call.id,
-                                        "content": str(tool_result)
-                                    }]
-                                })
-                            except Exception as e:
-                                messages.append({
-                                    "role": "user",
-                                    "content": [{
-                                        "type": "tool_result",
-                                        "tool_use_id": tool_call.id,
-                                        "content": f"Error executing tool: {str(e)}"
-                                    }]
-                                })
+                    # Execute the tools concurrently and add their results
+                    messages.append(await self._execute_tools_async(tool_calls))
+                    
+                    # Send the map updates the tools queued as one emit
+                    await websocket_manager.flush_map_updates(conversation_id)
                     
                     # Continue loop to get final response
                     continue
-                else:
-                    # No tool calls, now stream the final response properly
-                    print("[DEBUG] Streaming - No tools needed, streaming final response")
-                    
-                    from anthropic.lib.streaming import MessageStream
-                    
-                    stream: MessageStream = self.client.messages.create(
-                        model=self.model,
-                        max_tokens=2000,
-                        system=instructions_with_context,
-                        messages=messages,
-                        tools=tools,
-
-                        stream=True
-                    )
-                    
-                    for chunk in stream:
-                        if chunk.type == "content_block_delta" and chunk.delta.type == "text_delta":
-                            final_response += chunk.delta.text
-                            yield chunk.delta.text
-                    
-                    # Save the final assistant response to conversation
-                    if final_response:
-                        self.conversation_manager.add_assistant_message(conversation_id, final_response)
-                    
-                    return
+                
+                # No tool calls, the streamed text was the final response
+                print("[DEBUG] Streaming - No tools needed, response complete")
+                
+                # Save the final assistant response to conversation
+                if final_response:
+                    await self.conversation_manager.add_assistant_message_async(conversation_id, final_response)
+                
+                return
                         
         except Exception as e:
             print(f"[DEBUG] Streaming error: {e}")
-            yield f"Agent error: {str(e)}"
-    
\ No newline at end of file
+            yield _error_text(e)
+
+# Global agent instance
+agent: Optional[UrbanExplorerAgent] = None
+
+def get_agent() -> UrbanExplorerAgent:
+    """Get the global agent instance."""
+    global agent
+    if agent is None:
+        agent = UrbanExplorerAgent()
+    return agent
\ No newline at end of file
@@ -1,13 +1,22 @@
+import asyncio
 from typing import List, Dict, Optional
 from fastapi import FastAPI, Response, HTTPException
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import socketio
-from agent import UrbanExplorerAgent
+from agent import get_agent
 from websocket_manager import websocket_manager
 from conversation_manager import get_conversation_manager
 from database import init_database, get_db_manager
+from coordinates_tool import get_area_name_index
+from properties_tool import start_region_properties_build
+from regional_interests_tool import get_poi_cache
+from jobs import Job, get_job_manager
+from llm_gateway import get_llm_gateway
+from singleflight import tool_flights
+from region_pipeline import get_region_pipeline
+from structured_output import structured_output_stats
 
 # Create FastAPI app
 fastapi_app = FastAPI(title="UrbanExplorer API", version="1.0.0")
@@ -36,19 +45,18 @@ async def chat_stream(request: ChatRequest):
     conversation_manager = get_conversation_manager()
     
     # Check if conversation exists, create if not
-    if not conversation_manager.conversation_exists(request.conversation_id):
+    if not await conversation_manager.conversation_exists_async(request.conversation_id):
         # Create new conversation with client-provided ID
-        conversation_manager.create_conversation_with_id(request.conversation_id, request.message)
+        await conversation_manager.create_conversation_with_id_async(request.conversation_id, request.message)
         print(f"[DEBUG] Created new conversation: {request.conversation_id}")
     else:
         # Add user message to existing conversation
-        conversation_manager.add_user_message(request.conversation_id, request.message)
+        await conversation_manager.add_user_message_async(request.conversation_id, request.message)
         print(f"[DEBUG] Using existing conversation: {request.conversation_id}")
     
-    def generate():
-        # Create fresh agent for each request
-        agent = UrbanExplorerAgent()
-        for chunk in agent.run_stream(request.message, request.conversation_id, request.region_id):
+    async def generate():
+        agent = get_agent()
+        async for chunk in agent.run_stream_async(request.message, request.conversation_id, request.region_id):
             yield f"data: {chunk}\n\n"
         yield "data: [DONE]\n\n"
 
@@ -68,24 +76,70 @@ async def get_conversation_map(conversation_id: str):
     
     return {"status": "sent", "conversation_id": conversation_id, "regions_count": result.get('regions_count', 0)}
 
-@fastapi_app.get("/conversations/{conversation_id}/regions/{region_id}")
-async def get_region_map(conversation_id: str, region_id: int):
-    # Create agent and trigger POI population for this region
-    agent = UrbanExplorerAgent()
-    print('inside get_region_map {conversation_id} {region_id}')
-    # Run agent with region_id to automatically populate POIs
-    response_text = ""
-    for chunk in agent.run_stream("INTERNAL SYSTEM: Populate points of interest for this region. CALL ONLY get_regional_interests_for_area AND NOTHING ELSE", conversation_id, region_id):
-        response_text += chunk
+async def populate_region(job: Job) -> Dict:
+    """Background job body: populate POIs and properties for a region and push the map update."""
+    conversation_id = job.conversation_id
+    region_id = job.details["region_id"]
+    pipeline = get_region_pipeline()
     
-    # Send all regions for this conversation via websocket
-    result = await websocket_manager.broadcast_map_update(conversation_id)
+    await get_job_manager().report(job, "preferences")
+    preferences = await pipeline.get_preferences(conversation_id)
     
-    return {"status": "sent", "conversation_id": conversation_id, "region_id": region_id, "regions_count": result.get('regions_count', 0)}
+    await get_job_manager().report(job, "populating")
+    result = await pipeline.populate(conversation_id, region_id, preferences)
+    
+    await get_job_manager().report(job, "publishing")
+    # Send any update the tools left pending, or the full map if there was none
+    update = await websocket_manager.flush_map_updates(conversation_id)
+    if update is None:
+        update = await websocket_manager.broadcast_map_update(conversation_id)
+    
+    return {**result, "regions_count": update.get('regions_count', 0)}
+
+@fastapi_app.get("/conversations/{conversation_id}/regions/{region_id}", status_code=202)
+async def get_region_map(conversation_id: str, region_id: int):
+    # Trigger POI population for this region in the background; progress and
+    # the resulting map update arrive on the conversation's socket room
+    job, created = await get_job_manager().submit(
+        "region_details",
+        (conversation_id, region_id),
+        conversation_id,
+        populate_region,
+        {"region_id": region_id}
+    )
+    
+    return {"status": job.status, "job_id": job.id, "conversation_id": conversation_id, "region_id": region_id, "deduplicated": not created}
+
+@fastapi_app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@fastapi_app.get("/metrics")
+async def get_metrics():
+    return {
+        "poi_cache": get_poi_cache().stats(),
+        "map_updates": websocket_manager.get_update_stats(),
+        "history_cache": get_conversation_manager().history_cache.stats(),
+        "jobs": get_job_manager().stats(),
+        "llm": get_llm_gateway().stats(),
+        "tool_flights": tool_flights.stats(),
+        "region_pipeline": get_region_pipeline().stats(),
+        "structured_output": structured_output_stats.stats()
+    }
 
 # Initialize database on startup
 @fastapi_app.on_event("startup")
 async def startup_event():
     print("🚀 Starting UrbanExplorer API...")
     init_database()
+    websocket_manager.attach_loop(asyncio.get_running_loop())
+    with get_db_manager().get_session() as session:
+        get_area_name_index().ensure_fresh(session)
+    get_agent()
+    get_job_manager().start()
+    # The first region_properties build scans every listing; keep it off the request path
+    start_region_properties_build()
     print("✅ API startup complete")
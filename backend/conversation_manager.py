@@ -1,14 +1,208 @@
-from typing import Optional, List, Dict, Any
-from database import get_db_manager, Conversation, Message
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Set
+from database import get_db_manager, get_async_db_manager, Conversation, Message
+from llm_gateway import get_llm_gateway
+import asyncio
+import json
 import logging
+import os
+import threading
 
 logger = logging.getLogger(__name__)
 
+class HistoryCache:
+    """
+    LRU of conversation histories in Anthropic format, bounded by an estimate
+    of their serialized size in bytes.
+    
+    Only conversations that are already cached are appended to; anything
+    else is loaded from the database on its next read. A load passes the
+    generation() it started at to put, and is dropped if the conversation was
+    appended to in the meantime, so a slow load can't overwrite newer messages.
+    
+    Compaction summaries are kept alongside the histories and evicted with them.
+    """
+    
+    def __init__(self, max_bytes: Optional[int] = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # conversation_id -> (messages, estimated bytes)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # conversation_id -> compaction summary, only for cached conversations
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_loads = 0
+        # conversation_id -> generation of its last append, oldest first. Only
+        # the most recent max_tracked are kept; a load older than the newest
+        # forgotten one is treated as stale
+        self.max_tracked = 4096
+        self._generation = 0
+        self._appended: "OrderedDict[str, int]" = OrderedDict()
+        self._forgotten = 0
+    
+    @staticmethod
+    def _size(message: Dict[str, Any]) -> int:
+        return len(json.dumps(message, default=str))
+    
+    def get(self, conversation_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Return a copy of the cached history, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(conversation_id)
+            self.hits += 1
+            # Callers append the turn's tool messages to the list they get back
+            return list(entry[0])
+    
+    def generation(self) -> int:
+        """Current generation; read it before loading a history to put."""
+        with self._lock:
+            return self._generation
+    
+    def put(self, conversation_id: str, history: List[Dict[str, Any]], loaded_at: Optional[int] = None) -> None:
+        """
+        Cache a full history.
+        
+        Args:
+            conversation_id: The conversation ID
+            history: Every message of the conversation
+            loaded_at: generation() from before the history was read from the
+                database; the history is dropped if an append happened since
+        """
+        size = sum(self._size(message) for message in history)
+        with self._lock:
+            if loaded_at is not None and self._appended.get(conversation_id, self._forgotten) > loaded_at:
+                self.stale_loads += 1
+                return
+            self._remove(conversation_id)
+            self._entries[conversation_id] = (list(history), size)
+            self.total_bytes += size
+            self._evict()
+    
+    def append(self, conversation_id: str, message: Dict[str, Any]) -> None:
+        """Append a stored message to a cached history."""
+        size = self._size(message)
+        with self._lock:
+            self._generation += 1
+            self._appended[conversation_id] = self._generation
+            self._appended.move_to_end(conversation_id)
+            if len(self._appended) > self.max_tracked:
+                _, self._forgotten = self._appended.popitem(last=False)
+            
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return
+            entry[0].append(message)
+            self._entries[conversation_id] = (entry[0], entry[1] + size)
+            self._entries.move_to_end(conversation_id)
+            self.total_bytes += size
+            self._evict()
+    
+    def get_summary(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Return the cached compaction summary, or None."""
+        with self._lock:
+            return self._summaries.get(conversation_id)
+    
+    def set_summary(self, conversation_id: str, summary: Dict[str, Any]) -> None:
+        """Cache a compaction summary; ignored unless the history is cached too."""
+        with self._lock:
+            if conversation_id in self._entries:
+                self._summaries[conversation_id] = summary
+    
+    def _remove(self, conversation_id: str) -> None:
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+    
+    def _evict(self) -> None:
+        # Always keep the most recent entry, even if it alone exceeds the limit
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            conversation_id, (_, size) = self._entries.popitem(last=False)
+            self._summaries.pop(conversation_id, None)
+            self.total_bytes -= size
+            self.evictions += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Counters for the metrics endpoint."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "conversations": len(self._entries),
+                "summaries": len(self._summaries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stale_loads": self.stale_loads,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Rough token count for messages: about four characters of JSON per token."""
+    return sum(len(json.dumps(message, default=str)) for message in messages) // 4
+
+def format_transcript(messages: List[Dict[str, Any]]) -> str:
+    """Plain-text rendering of Anthropic-format messages for small-model prompts."""
+    lines = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            text = content
+        else:
+            parts = []
+            for block in content:
+                if block.get("type") == "text":
+                    parts.append(block["text"])
+                elif block.get("type") == "tool_use":
+                    parts.append(f"[called {block['name']} with {json.dumps(block['input'])}]")
+            text = "\n".join(parts)
+        lines.append(f"{message['role'].upper()}: {text}")
+    return "\n\n".join(lines)
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user looking for somewhere to live in London and an assistant that shows areas, points of interest and rental properties on a map.
+
+Update the summary with the new messages. Keep every fact the assistant needs to continue: areas discussed and their region ids, the user's interests, budget, household, commute and other preferences, what was already shown on the map, and anything the user liked or rejected. Drop small talk. Write plain prose, at most 300 words, and return only the summary."""
+
+def _anthropic_message(role: str, content: str, tool_calls: Optional[List[Dict]] = None) -> Dict[str, Any]:
+    """Anthropic-format message for a row as add_message stores it."""
+    return Message(
+        role=role,
+        content=content,
+        tool_calls=json.dumps(tool_calls) if tool_calls else None
+    ).to_anthropic_format()
+
 class ConversationManager:
-    """Manages conversation state and database operations."""
+    """
+    Manages conversation state and database operations.
+    
+    The *_async methods go through the async engine and are the ones to use on
+    the event loop (API handlers, agent loop); the sync methods are for threads.
+    """
     
     def __init__(self):
         self.db = get_db_manager()
+        self.async_db = get_async_db_manager()
+        self.history_cache = HistoryCache()
+        
+        # Compaction: once a history exceeds the token budget, everything before
+        # the last keep_turns user turns is replaced by a rolling summary stored
+        # in the conversation metadata and recomputed in the background
+        self.compaction = os.getenv("HISTORY_COMPACTION", "1").lower() not in ("0", "false", "no")
+        self.token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", "12000"))
+        self.keep_turns = int(os.getenv("HISTORY_KEEP_TURNS", "6"))
+        self.summary_model = os.getenv("HISTORY_SUMMARY_MODEL", "claude-3-5-haiku-20241022")
+        self._summarizing: Set[str] = set()
+        self._summary_lock = threading.Lock()
+        self._summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
     
     def create_conversation(self, first_message: str, title: Optional[str] = None) -> str:
         """
@@ -23,6 +217,7 @@ class ConversationManager:
         """
         try:
             conversation = self.db.create_conversation(first_message, title)
+            self.history_cache.put(conversation.id, [_anthropic_message("user", first_message)])
             logger.info(f"Created new conversation: {conversation.id}")
             return conversation.id
         except Exception as e:
@@ -43,6 +238,7 @@ class ConversationManager:
         """
         try:
             conversation = self.db.create_conversation_with_id(conversation_id, first_message, title)
+            self.history_cache.put(conversation_id, [_anthropic_message("user", first_message)])
             logger.info(f"Created new conversation with ID: {conversation_id}")
             return True
         except Exception as e:
@@ -79,6 +275,7 @@ class ConversationManager:
         """
         try:
             self.db.add_message(conversation_id, "user", message)
+            self.history_cache.append(conversation_id, _anthropic_message("user", message))
             logger.info(f"Added user message to conversation {conversation_id}")
             return True
         except Exception as e:
@@ -99,6 +296,7 @@ class ConversationManager:
         """
         try:
             self.db.add_message(conversation_id, "assistant", content, tool_calls)
+            self.history_cache.append(conversation_id, _anthropic_message("assistant", content, tool_calls))
             logger.info(f"Added assistant message to conversation {conversation_id}")
             return True
         except Exception as e:
@@ -107,7 +305,8 @@ class ConversationManager:
     
     def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
         """
-        Get conversation history in Anthropic API format.
+        Get conversation history in Anthropic API format. Served from the
+        history cache; the database is only read on a miss.
         
         Args:
             conversation_id: The conversation ID
@@ -115,14 +314,135 @@ class ConversationManager:
         Returns:
             List of messages in Anthropic format
         """
+        cached = self.history_cache.get(conversation_id)
+        if cached is not None:
+            return cached
+        
         try:
+            loaded_at = self.history_cache.generation()
             history = self.db.get_conversation_history(conversation_id)
+            self.history_cache.put(conversation_id, history, loaded_at)
             logger.info(f"Retrieved {len(history)} messages for conversation {conversation_id}")
             return history
         except Exception as e:
             logger.error(f"Error getting conversation history for {conversation_id}: {e}")
             return []
     
+    def get_context_history(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """
+        Get the history to send to the model.
+        
+        Short histories are returned as is. Past the token budget, messages
+        already covered by the stored summary are dropped and the summary is
+        prepended to the first remaining user message. Summarizing newer turns
+        is queued in the background, never done on the request path.
+        
+        Args:
+            conversation_id: The conversation ID
+            
+        Returns:
+            List of messages in Anthropic format
+        """
+        history = self.get_conversation_history(conversation_id)
+        cut = self._compaction_cut(history)
+        if cut is None:
+            return history
+        return self._apply_summary(conversation_id, history, cut, self._get_summary(conversation_id))
+    
+    async def get_context_history_async(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Async variant of get_context_history."""
+        history = await self.get_conversation_history_async(conversation_id)
+        cut = self._compaction_cut(history)
+        if cut is None:
+            return history
+        summary = self.history_cache.get_summary(conversation_id)
+        if summary is None:
+            summary = await asyncio.to_thread(self._get_summary, conversation_id)
+        return self._apply_summary(conversation_id, history, cut, summary)
+    
+    def _compaction_cut(self, history: List[Dict[str, Any]]) -> Optional[int]:
+        """Index where the last keep_turns user turns start, or None when no compaction is needed."""
+        if not self.compaction or estimate_tokens(history) <= self.token_budget:
+            return None
+        user_turns = [
+            i for i, message in enumerate(history)
+            if message["role"] == "user" and isinstance(message["content"], str)
+        ]
+        if len(user_turns) <= self.keep_turns:
+            return None
+        return user_turns[-self.keep_turns]
+    
+    def _get_summary(self, conversation_id: str) -> Dict[str, Any]:
+        summary = self.history_cache.get_summary(conversation_id)
+        if summary is None:
+            try:
+                summary = self.db.get_conversation_metadata(conversation_id).get("summary") or {}
+            except Exception as e:
+                logger.error(f"Error loading summary for {conversation_id}: {e}")
+                summary = {}
+            self.history_cache.set_summary(conversation_id, summary)
+        return summary
+    
+    def _apply_summary(self, conversation_id: str, history: List[Dict[str, Any]], cut: int, summary: Dict[str, Any]) -> List[Dict[str, Any]]:
+        through = summary.get("through", 0)
+        if through < cut:
+            self._schedule_summary(conversation_id, history, cut)
+        if not summary.get("text") or through > len(history):
+            # Nothing usable yet; send the full history until the summary lands
+            return history
+        
+        # Summaries always end at a user turn, so the remaining history starts with one
+        first = dict(history[through])
+        prefix = f"[Summary of the earlier conversation]\n{summary['text']}\n[End of summary]\n\n"
+        if isinstance(first["content"], str):
+            first["content"] = prefix + first["content"]
+        else:
+            first["content"] = [{"type": "text", "text": prefix}] + list(first["content"])
+        
+        logger.info(f"Compacted history for {conversation_id}: {through} messages summarized, {len(history) - through} kept")
+        return [first] + history[through + 1:]
+    
+    def _schedule_summary(self, conversation_id: str, history: List[Dict[str, Any]], cut: int) -> None:
+        with self._summary_lock:
+            if conversation_id in self._summarizing:
+                return
+            self._summarizing.add(conversation_id)
+        self._summary_executor.submit(self._update_summary, conversation_id, history, cut)
+    
+    def _update_summary(self, conversation_id: str, history: List[Dict[str, Any]], cut: int) -> None:
+        """Fold history[through:cut] into the stored summary. Runs in a background thread."""
+        try:
+            summary = self._get_summary(conversation_id)
+            through = summary.get("through", 0)
+            if through >= cut:
+                return
+            
+            previous = summary.get("text") or "(none yet)"
+            response = get_llm_gateway().create(
+                conversation_id,
+                model=self.summary_model,
+                max_tokens=600,
+                temperature=0,
+                system=SUMMARY_PROMPT,
+                messages=[{
+                    "role": "user",
+                    "content": f"CURRENT SUMMARY:\n{previous}\n\nNEW MESSAGES:\n{format_transcript(history[through:cut])}"
+                }]
+            )
+            text = "".join(block.text for block in response.content if block.type == "text").strip()
+            if not text:
+                return
+            
+            summary = {"text": text, "through": cut}
+            self.db.update_conversation_metadata(conversation_id, {"summary": summary})
+            self.history_cache.set_summary(conversation_id, summary)
+            logger.info(f"Updated summary for {conversation_id} through message {cut}")
+        except Exception as e:
+            logger.error(f"Error summarizing conversation {conversation_id}: {e}")
+        finally:
+            with self._summary_lock:
+                self._summarizing.discard(conversation_id)
+    
     def conversation_exists(self, conversation_id: str) -> bool:
         """
         Check if a conversation exists.
@@ -140,6 +460,64 @@ class ConversationManager:
             logger.error(f"Error checking if conversation {conversation_id} exists: {e}")
             return False
     
+    async def create_conversation_with_id_async(self, conversation_id: str, first_message: str, title: Optional[str] = None) -> bool:
+        """Async variant of create_conversation_with_id."""
+        try:
+            await self.async_db.create_conversation_with_id(conversation_id, first_message, title)
+            self.history_cache.put(conversation_id, [_anthropic_message("user", first_message)])
+            logger.info(f"Created new conversation with ID: {conversation_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error creating conversation with ID {conversation_id}: {e}")
+            raise
+    
+    async def add_user_message_async(self, conversation_id: str, message: str) -> bool:
+        """Async variant of add_user_message."""
+        try:
+            await self.async_db.add_message(conversation_id, "user", message)
+            self.history_cache.append(conversation_id, _anthropic_message("user", message))
+            logger.info(f"Added user message to conversation {conversation_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error adding user message to {conversation_id}: {e}")
+            return False
+    
+    async def add_assistant_message_async(self, conversation_id: str, content: str, tool_calls: Optional[List[Dict]] = None) -> bool:
+        """Async variant of add_assistant_message."""
+        try:
+            await self.async_db.add_message(conversation_id, "assistant", content, tool_calls)
+            self.history_cache.append(conversation_id, _anthropic_message("assistant", content, tool_calls))
+            logger.info(f"Added assistant message to conversation {conversation_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error adding assistant message to {conversation_id}: {e}")
+            return False
+    
+    async def get_conversation_history_async(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Async variant of get_conversation_history."""
+        cached = self.history_cache.get(conversation_id)
+        if cached is not None:
+            return cached
+        
+        try:
+            loaded_at = self.history_cache.generation()
+            history = await self.async_db.get_conversation_history(conversation_id)
+            self.history_cache.put(conversation_id, history, loaded_at)
+            logger.info(f"Retrieved {len(history)} messages for conversation {conversation_id}")
+            return history
+        except Exception as e:
+            logger.error(f"Error getting conversation history for {conversation_id}: {e}")
+            return []
+    
+    async def conversation_exists_async(self, conversation_id: str) -> bool:
+        """Async variant of conversation_exists."""
+        try:
+            conversation = await self.async_db.get_conversation(conversation_id)
+            return conversation is not None
+        except Exception as e:
+            logger.error(f"Error checking if conversation {conversation_id} exists: {e}")
+            return False
+    
     def get_message_count(self, conversation_id: str) -> int:
         """
         Get the number of messages in a conversation.
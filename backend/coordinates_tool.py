@@ -1,12 +1,237 @@
 import os
-import anthropic
+import re
+import time
+import threading
 import json
-import asyncio
-from typing import List
+import bisect
+from typing import Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv
-from database import RegionBorder, get_db_manager
+from pydantic import BaseModel, Field, field_validator
+from shapely.geometry import Polygon
 from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database import ConversationRegion, RegionAlias, RegionBorder, get_db_manager
+from regional_interests_tool import get_poi_cache
 from websocket_manager import websocket_manager
+from singleflight import single_flight
+from structured_output import StructuredOutputError, call_tool, tool_definition
+
+# Generous Greater London bounds for validating generated polygons
+LONDON_BOUNDS = {"min_lon": -0.6, "max_lon": 0.4, "min_lat": 51.2, "max_lat": 51.8}
+
+
+# Minimum trigram similarity for a fuzzy name match
+TRIGRAM_THRESHOLD = 0.5
+
+
+def normalize_area_name(area_name: str) -> str:
+    """
+    Normalize an area name for lookups: lowercase, no punctuation, "&" as "and",
+    single spaces and no trailing "london" ("King's Cross, London" -> "kings cross").
+    """
+    name = area_name.lower().replace("'", "").replace("’", "").replace("&", " and ")
+    name = re.sub(r"[^a-z0-9]+", " ", name)
+    words = name.split()
+    if len(words) > 1 and words[-1] == "london":
+        words = words[:-1]
+    return " ".join(words)
+
+
+def _trigrams(name: str) -> Set[str]:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AreaNameIndex:
+    """
+    Process-wide lookup of region_borders by normalized name and alias.
+    
+    Matching is deterministic: exact name, then alias, then the shortest name
+    starting with the query at a word boundary, then the best trigram match.
+    Ties go to imported borders before generated ones, then the lowest id.
+    The index is rebuilt when the region_borders/region_aliases signature
+    changes, checked at most once per refresh interval.
+    """
+    
+    def __init__(self, refresh_interval: Optional[float] = None):
+        if refresh_interval is None:
+            refresh_interval = float(os.getenv("AREA_INDEX_REFRESH_SECONDS", "30"))
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._names: Dict[str, int] = {}
+        self._aliases: Dict[str, int] = {}
+        self._sorted_names: List[str] = []
+        self._trigram_postings: Dict[str, Set[str]] = {}
+        self._signature: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self._loaded = False
+    
+    def _table_signature(self, session: Session) -> Tuple:
+        # max(updated_at) catches a border renamed or an alias repointed in place
+        borders = session.query(func.count(RegionBorder.id), func.max(RegionBorder.id), func.max(RegionBorder.updated_at)).one()
+        aliases = session.query(func.count(RegionAlias.id), func.max(RegionAlias.id), func.max(RegionAlias.updated_at)).one()
+        return tuple(borders) + tuple(aliases)
+    
+    def _load(self, session: Session) -> None:
+        names: Dict[str, int] = {}
+        rows = session.query(RegionBorder.id, RegionBorder.region_name, RegionBorder.source).filter(
+            RegionBorder.coordinates.isnot(None)
+        ).all()
+        # Imported borders first, then by id, so the first border seen for a name wins
+        for region_id, region_name, _ in sorted(rows, key=lambda row: (row[2] == "generated", row[0])):
+            names.setdefault(normalize_area_name(region_name), region_id)
+        
+        # Aliases of evicted borders miss until the border is regenerated
+        loaded_ids = {row[0] for row in rows}
+        aliases = {
+            alias: region_id for alias, region_id in session.query(RegionAlias.alias, RegionAlias.region_id)
+            if region_id in loaded_ids
+        }
+        
+        postings: Dict[str, Set[str]] = {}
+        for name in names:
+            for trigram in _trigrams(name):
+                postings.setdefault(trigram, set()).add(name)
+        
+        self._names = names
+        self._aliases = aliases
+        self._sorted_names = sorted(names)
+        self._trigram_postings = postings
+        self._loaded = True
+        print(f"Built area name index with {len(names)} names and {len(aliases)} aliases")
+    
+    def ensure_fresh(self, session: Session) -> None:
+        """Build the index, or rebuild it if the tables changed since the last check."""
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded and now - self._checked_at < self.refresh_interval:
+                return
+            
+            signature = self._table_signature(session)
+            if not self._loaded or signature != self._signature:
+                self._load(session)
+                self._signature = signature
+            self._checked_at = now
+    
+    def invalidate(self) -> None:
+        """Force a signature check on the next lookup."""
+        with self._lock:
+            self._checked_at = 0.0
+            self._signature = None
+    
+    def lookup(self, area_name: str) -> Optional[int]:
+        """Return the region_borders id that best matches the area name, or None."""
+        key = normalize_area_name(area_name)
+        if not key:
+            return None
+        
+        with self._lock:
+            names, aliases = self._names, self._aliases
+            sorted_names, postings = self._sorted_names, self._trigram_postings
+        
+        if key in names:
+            return names[key]
+        if key in aliases:
+            return aliases[key]
+        
+        # Names that start with the query as whole words, e.g. "kings cross" -> "kings cross st pancras"
+        prefix_matches = []
+        start = bisect.bisect_left(sorted_names, key)
+        for name in sorted_names[start:]:
+            if not name.startswith(key):
+                break
+            if name[len(key)] == " ":
+                prefix_matches.append(name)
+        if prefix_matches:
+            best = min(prefix_matches, key=lambda name: (len(name), names[name]))
+            return names[best]
+        
+        # Fuzzy fallback on trigram (Jaccard) similarity
+        key_trigrams = _trigrams(key)
+        candidates: Set[str] = set()
+        for trigram in key_trigrams:
+            candidates |= postings.get(trigram, set())
+        
+        best_name, best_rank = None, None
+        for name in candidates:
+            name_trigrams = _trigrams(name)
+            score = len(key_trigrams & name_trigrams) / len(key_trigrams | name_trigrams)
+            if score < TRIGRAM_THRESHOLD:
+                continue
+            rank = (-score, abs(len(name) - len(key)), names[name])
+            if best_rank is None or rank < best_rank:
+                best_name, best_rank = name, rank
+        
+        return names[best_name] if best_name else None
+
+
+# Global area name index instance
+area_name_index: Optional[AreaNameIndex] = None
+
+def get_area_name_index() -> AreaNameIndex:
+    """Get the global area name index instance."""
+    global area_name_index
+    if area_name_index is None:
+        area_name_index = AreaNameIndex()
+    return area_name_index
+
+
+def validate_area_polygon(coordinates: List) -> Optional[List]:
+    """
+    Check a generated [longitude, latitude] ring before it is shared.
+    
+    Returns:
+        The closed ring if it is a valid polygon inside London, otherwise None
+    """
+    try:
+        ring = [[float(point[0]), float(point[1])] for point in coordinates]
+    except (TypeError, ValueError, IndexError):
+        return None
+    
+    if len(ring) >= 3 and ring[0] != ring[-1]:
+        ring.append(ring[0])
+    if len(ring) < 4:
+        return None
+    
+    for lon, lat in ring:
+        if not (LONDON_BOUNDS["min_lon"] <= lon <= LONDON_BOUNDS["max_lon"]
+                and LONDON_BOUNDS["min_lat"] <= lat <= LONDON_BOUNDS["max_lat"]):
+            return None
+    
+    polygon = Polygon(ring)
+    if not polygon.is_valid or polygon.area == 0:
+        return None
+    return ring
+
+
+class AreaPolygon(BaseModel):
+    """The polygon sub-agent's answer."""
+    coordinates: List[Tuple[float, float]] = Field(
+        min_length=3,
+        description="Boundary as [longitude, latitude] pairs in order, last point equal to the first"
+    )
+    
+    @field_validator("coordinates")
+    @classmethod
+    def _inside_london(cls, coordinates: List[Tuple[float, float]]) -> List[List[float]]:
+        ring = validate_area_polygon(coordinates)
+        if ring is None:
+            raise ValueError("not a valid polygon inside London")
+        return ring
+
+
+AREA_POLYGON_TOOL = tool_definition(
+    "record_area_polygon",
+    "Record the street-based boundary polygon for the area.",
+    AreaPolygon
+)
+
+
+def _region_added(conversation_region: ConversationRegion) -> Dict:
+    """map_delta change for a region newly added to a conversation."""
+    region = conversation_region.to_dict()
+    region["points_of_interest"] = []
+    return {"type": "region_added", "region": region}
 
 
 def get_area_quick(area_name: str, conversation_id: str) -> str:
@@ -25,12 +250,17 @@ International")
         db_manager = get_db_manager()
         
         with db_manager.get_session() as session:
-            # Query the region_borders table for the area
-            region_border = session.query(RegionBorder).filter(
-                func.lower(RegionBorder.region_name).ilike(f"%{area_name.lower()}%")
-            ).first()
+            # Resolve the name against the in-memory index of region_borders
+            index = get_area_name_index()
+            index.ensure_fresh(session)
+            region_id = index.lookup(area_name)
+            if region_id is None:
+                return None
             
-            if not region_border:
+            region_border = session.query(RegionBorder).filter(RegionBorder.id == region_id).first()
+            if not region_border or not region_border.coordinates:
+                # Border was removed or evicted since the index was built
+                index.invalidate()
                 return None
             
             # Parse coordinates from the stored JSON
@@ -44,15 +274,16 @@ International")
             # If conversation_id provided, save to conversation_regions
             if conversation_id and coordinates:
                 try:
-                    db_manager.add_conversation_region(
+                    conversation_region = db_manager.add_conversation_region(
                         conversation_id=conversation_id,
                         region_name=region_border.region_name,
-                        coordinates=coordinates
+                        coordinates=coordinates,
+                        region_id=region_border.id
                     )
                     
                     # Update websocket
-                    try:                    
-                        asyncio.run(websocket_manager.broadcast_map_update(conversation_id))
+                    try:
+                        websocket_manager.schedule_map_update(conversation_id, change=_region_added(conversation_region))
                     except Exception as ws_error:
                         print(f"Error updating websocket: {ws_error}")
                         
@@ -70,6 +301,7 @@ International")
         return None            
        
 
+@single_flight("get_coordinates_for_area", lambda area_name, conversation_id: (conversation_id, normalize_area_name(area_name)))
 def get_area_coordinates(area_name: str, conversation_id: str) -> str:
     """
     Use a small LLM to get coordinates for a London area.
@@ -78,19 +310,15 @@ def get_area_coordinates(area_name: str, conversation_id: str) -> str:
         area_name: Name of the London area (e.g., "Shoreditch", "Stratford International")
     
     Returns:
-        Raw agent output with coordinates
+        JSON with the validated coordinates, or an error message
     """
     quick_response = get_area_quick(area_name, conversation_id)
-
+    
     if quick_response:
         print(f"got quick response for {area_name} {conversation_id}")
         return quick_response
-
-    load_dotenv()
     
-    client = anthropic.Anthropic(
-        api_key=os.getenv("ANTHROPIC_API_KEY")
-    )
+    load_dotenv()
     
     system_prompt = """You are a London geography expert. Generate precise coordinates for [AREA NAME] by following the major streets that form its recognized boundaries.
 
@@ -119,15 +347,15 @@ VALIDATION CHECKS:
 - Check that major landmarks within the area fall inside the polygon
 
 OUTPUT FORMAT:
-Return ONLY a valid JSON object with coordinates array. NO comments, NO additional text, NO explanations:
-{"coordinates": [[-0.0781, 51.5265], [-0.0745, 51.5285], [-0.0725, 51.5245], [-0.0781, 51.5265]]}
-
-CRITICAL: Your response must be valid JSON. Do not include any comments (// or /* */) or explanations.
+Record the polygon with the record_area_polygon tool, e.g. coordinates [[-0.0781, 51.5265], [-0.0745, 51.5285], [-0.0725, 51.5245], [-0.0781, 51.5265]]
 
 AREA TO MAP: [INSERT SPECIFIC AREA NAME HERE]"""
 
     try:
-        response = client.messages.create(
+        polygon = call_tool(
+            conversation_id,
+            AreaPolygon,
+            AREA_POLYGON_TOOL,
             model="claude-3-5-haiku-20241022",
             max_tokens=1000,
             system=system_prompt,
@@ -135,50 +363,45 @@ AREA TO MAP: [INSERT SPECIFIC AREA NAME HERE]"""
                 {
                     "role": "user", 
                     "content": f"Build a street-based polygon for {area_name} in London using major boundary streets and intersections."
-                },
-                {
-                    "role": "assistant",
-                    "content": "{"  # Prefill to start JSON object
                 }
             ]
         )
+    except StructuredOutputError as e:
+        print(f"Discarding invalid generated polygon for {area_name}: {e}")
+        return f"Error: {e}"
+    except Exception as e:
+        return f"Error: {e}"
+    
+    coordinates = polygon.coordinates
+    try:
+        db_manager = get_db_manager()
+        
+        # Share the polygon so later lookups for this area skip the LLM
+        region_border = db_manager.add_generated_region_border(
+            region_name=area_name,
+            normalized_name=normalize_area_name(area_name),
+            coordinates=coordinates
+        )
+        print(f"Stored generated border for {area_name} as region {region_border.id}")
+        get_area_name_index().invalidate()
+        # An evicted border is regenerated under its old id; POIs this process
+        # still holds in memory were found for the old polygon
+        get_poi_cache().invalidate_region(region_border.id)
         
-        coordinates_json = "{" + response.content[0].text.strip()
-
         # If conversation_id provided, save to database
         if conversation_id:
+            conversation_region = db_manager.add_conversation_region(
+                conversation_id=conversation_id,
+                region_name=region_border.region_name,
+                coordinates=coordinates,
+                region_id=region_border.id
+            )
+            # Queue websocket update
             try:
-                print("MAX COORDINATES")
-                print(coordinates_json)
-                
-                # Clean JSON by removing comments
-                import re
-                # Remove // comments
-                coordinates_json = re.sub(r'//.*', '', coordinates_json)
-                # Remove /* */ comments
-                coordinates_json = re.sub(r'/\*.*?\*/', '', coordinates_json, flags=re.DOTALL)
-                # Remove extra whitespace
-                coordinates_json = re.sub(r'\s+', ' ', coordinates_json).strip()
-                
-                coordinates_data = json.loads(coordinates_json)
-                coordinates = coordinates_data.get("coordinates", [])
-                
-                if coordinates:
-                    db_manager = get_db_manager()
-                    db_manager.add_conversation_region(
-                        conversation_id=conversation_id,
-                        region_name=area_name,
-                        coordinates=coordinates
-                    )
-                    # Run async websocket update
-                    try:
-                        asyncio.run(websocket_manager.broadcast_map_update(conversation_id))
-                    except Exception as ws_error:
-                        print(f"Error updating websocket: {ws_error}")
-            except Exception as save_error:
-                print(f"Error saving to database: {save_error}")
-        
-        return coordinates_json
-            
-    except Exception as e:
-        return f"Error: {e}"
\ No newline at end of file
+                websocket_manager.schedule_map_update(conversation_id, change=_region_added(conversation_region))
+            except Exception as ws_error:
+                print(f"Error updating websocket: {ws_error}")
+    except Exception as save_error:
+        print(f"Error saving to database: {save_error}")
+    
+    return json.dumps({"coordinates": coordinates})
@@ -1,11 +1,17 @@
 import uuid
 from datetime import datetime
 from typing import Optional, List, Dict, Any
-from sqlalchemy import create_engine, Column, String, Text, DateTime, Integer, ForeignKey
+from sqlalchemy import create_engine, event, Column, String, Text, DateTime, Float, Integer, ForeignKey, Index, inspect
+from sqlalchemy import Select, select, update
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, Session
 import json
 import os
+import threading
+from migrations import run_migrations
 
 Base = declarative_base()
 
@@ -37,6 +43,9 @@ class Conversation(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_conversation_timestamp", "conversation_id", "timestamp"),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False)
@@ -80,6 +89,9 @@ class Message(Base):
 
 class ConversationRegion(Base):
     __tablename__ = "conversation_regions"
+    __table_args__ = (
+        Index("ux_conversation_regions_conversation_region", "conversation_id", "region_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     region_id=Column(Integer, ForeignKey("region_borders.id"), nullable=False)
@@ -105,6 +117,9 @@ class ConversationRegion(Base):
 
 class RegionInterest(Base):
     __tablename__ = "region_interests"
+    __table_args__ = (
+        Index("ux_region_interests_region_conversation_type", "region_id", "conversation_id", "interest_type", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     region_id = Column(Integer, ForeignKey("region_borders.id"), nullable=False)
@@ -128,34 +143,236 @@ class RegionInterest(Base):
 
 class RegionBorder(Base):
     __tablename__ = "region_borders"
+    __table_args__ = (
+        Index("ix_region_borders_region_name", "region_name"),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     region_name = Column(String, nullable=False)
     borough_name = Column(String, nullable=False)
     coordinates = Column(Text)  # Polygon coordinates
+    source = Column(String(20), nullable=False, default="imported")  # 'imported', 'generated' (LLM polygon)
+    status = Column(String(20), nullable=False, default="approved")  # 'approved', 'pending' (awaiting review)
+    normalized_name = Column(String)  # Lookup key for generated borders
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def to_dict(self) -> Dict[str, Any]:
         return {
             "id": self.id,
             "region_name": self.region_name,
             "borough_name": self.borough_name,
-            "coordinates": self.coordinates
+            "coordinates": self.coordinates,
+            "source": self.source,
+            "status": self.status,
+            "created_at": self.created_at.isoformat() if self.created_at else None
         }
 
+class RegionAlias(Base):
+    """Alternative name for a region border, e.g. "Kings X" for "King's Cross"."""
+    __tablename__ = "region_aliases"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    alias = Column(String, nullable=False, unique=True)  # Stored normalized
+    region_id = Column(Integer, ForeignKey("region_borders.id"), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PoiCacheEntry(Base):
+    """Points of interest for a region and interest category, shared across conversations."""
+    __tablename__ = "poi_cache"
+    __table_args__ = (
+        Index("ix_poi_cache_region_category", "region_id", "category", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    region_id = Column(Integer, ForeignKey("region_borders.id"), nullable=False)
+    category = Column(String, nullable=False)  # Normalized interest category
+    points_of_interest = Column(Text)  # JSON blob with POI data
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class RegionProperty(Base):
+    """Materialized membership of properties_with_coordinates rows in region borders."""
+    __tablename__ = "region_properties"
+    __table_args__ = (
+        Index("ix_region_properties_region_price", "region_id", "price"),
+        Index("ix_region_properties_property", "property_id"),
+    )
+    
+    region_id = Column(Integer, ForeignKey("region_borders.id"), primary_key=True)
+    property_id = Column(Integer, primary_key=True)  # properties_with_coordinates.id
+    price = Column(Float)  # Denormalized so max_price filters stay on the index
+
+class RegionPropertyChange(Base):
+    """Change log filled by triggers and drained when region_properties is synced."""
+    __tablename__ = "region_property_changes"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(20), nullable=False)  # 'property', 'region' or 'rebuild'
+    ref_id = Column(Integer, nullable=False)
+
+# Applied to every SQLite connection. WAL lets readers run alongside the single
+# writer and busy_timeout makes writers wait for the lock instead of failing
+# with "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-65536"),  # Negative means KiB, so 64 MiB
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+}
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+def default_database_url() -> str:
+    """DATABASE_URL selects a server database, otherwise default to local SQLite."""
+    database_url = os.getenv("DATABASE_URL")
+    if database_url is None:
+        db_path = os.getenv("DATABASE_PATH", "conversations.db")
+        database_url = f"sqlite:///{db_path}"
+    return database_url
+
+def _pool_settings() -> Dict[str, Any]:
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True,
+    }
+
+def create_database_engine(database_url: str) -> Engine:
+    """
+    Create an engine with the settings for its backend.
+    
+    SQLite gets the SQLITE_PRAGMAS profile on connect. Server databases get a
+    connection pool sized by DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT and
+    DB_POOL_RECYCLE, with pre-ping so dropped connections are replaced.
+    """
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite":
+        engine = create_engine(
+            url,
+            echo=False,
+            # Sessions are used from tool threads as well as the server thread
+            connect_args={"check_same_thread": False, "timeout": int(SQLITE_PRAGMAS["busy_timeout"]) / 1000},
+        )
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        return engine
+    
+    return create_engine(url, echo=False, **_pool_settings())
+
+# Async drivers for the sync URLs accepted in DATABASE_URL. Only aiosqlite is a
+# dependency; other backends need ASYNC_DATABASE_URL with their driver installed.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def default_async_database_url() -> str:
+    """ASYNC_DATABASE_URL, otherwise the async form of the default database URL."""
+    return os.getenv("ASYNC_DATABASE_URL") or default_database_url()
+
+def create_async_database_engine(database_url: str) -> AsyncEngine:
+    """Async counterpart of create_database_engine with the same SQLite profile and pool settings."""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if not url.get_dialect().is_async:
+        if backend not in ASYNC_DRIVERS:
+            raise ValueError(
+                f"No async driver for {url.drivername} URLs. Set ASYNC_DATABASE_URL to an async URL "
+                f"(e.g. postgresql+asyncpg://...) and install its driver."
+            )
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    
+    if backend == "sqlite":
+        engine = create_async_engine(
+            url,
+            echo=False,
+            connect_args={"timeout": int(SQLITE_PRAGMAS["busy_timeout"]) / 1000},
+        )
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return engine
+    
+    return create_async_engine(url, echo=False, **_pool_settings())
+
+def _map_snapshot_query(conversation_id: str) -> Select:
+    """Regions of a conversation outer-joined with that conversation's interests in them."""
+    return select(
+        ConversationRegion.id,
+        ConversationRegion.region_id,
+        ConversationRegion.region_name,
+        ConversationRegion.coordinates,
+        ConversationRegion.created_at,
+        RegionInterest.id,
+        RegionInterest.interest_type,
+        RegionInterest.points_of_interest,
+        RegionInterest.created_at
+    ).outerjoin(
+        RegionInterest,
+        (RegionInterest.region_id == ConversationRegion.region_id)
+        & (RegionInterest.conversation_id == conversation_id)
+    ).where(
+        ConversationRegion.conversation_id == conversation_id
+    ).order_by(ConversationRegion.id, RegionInterest.id)
+
+def _map_snapshot_from_rows(conversation_id: str, rows: List[Any]) -> List[Dict[str, Any]]:
+    regions: Dict[int, Dict[str, Any]] = {}
+    for (row_id, region_id, region_name, coordinates, created_at,
+         interest_id, interest_type, points_of_interest, interest_created_at) in rows:
+        region = regions.get(row_id)
+        if region is None:
+            region = regions[row_id] = {
+                "id": row_id,
+                "region_id": region_id,
+                "conversation_id": conversation_id,
+                "region_name": region_name,
+                "coordinates": json.loads(coordinates) if coordinates else None,
+                "created_at": created_at.isoformat() if created_at else None,
+                "points_of_interest": []
+            }
+        if interest_id is not None:
+            region["points_of_interest"].append({
+                "id": interest_id,
+                "region_id": region_id,
+                "conversation_id": conversation_id,
+                "interest_type": interest_type,
+                "points_of_interest": json.loads(points_of_interest) if points_of_interest else None,
+                "created_at": interest_created_at.isoformat() if interest_created_at else None
+            })
+    return list(regions.values())
+
 class DatabaseManager:
     """Manages database connection and operations."""
     
     def __init__(self, database_url: Optional[str] = None):
-        if database_url is None:
-            # Default to local SQLite database
-            db_path = os.getenv("DATABASE_PATH", "conversations.db")
-            database_url = f"sqlite:///{db_path}"
-        
-        self.engine = create_engine(database_url, echo=False)
+        self.engine = create_database_engine(database_url or default_database_url())
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
         
         # Create tables
         Base.metadata.create_all(bind=self.engine)
+        # Bring existing tables up to date; create_all never alters them
+        run_migrations(self.engine)
+        self._listings_migrated = inspect(self.engine).has_table("properties_with_coordinates")
+        self._listings_migration_lock = threading.Lock()
+    
+    def ensure_listings_migrated(self) -> bool:
+        """
+        Apply the migrations deferred until properties_with_coordinates exists.
+        The listings importer may create that table after startup.
+        
+        Returns:
+            Whether the table exists, so its membership triggers are installed
+        """
+        if not self._listings_migrated:
+            # Lookups and the background region_properties build both call this
+            with self._listings_migration_lock:
+                if not self._listings_migrated:
+                    run_migrations(self.engine)
+                    self._listings_migrated = inspect(self.engine).has_table("properties_with_coordinates")
+        return self._listings_migrated
     
     def get_session(self) -> Session:
         """Get a database session."""
@@ -219,6 +436,24 @@ class DatabaseManager:
         with self.get_session() as session:
             return session.query(Conversation).filter(Conversation.id == conversation_id).first()
     
+    def get_conversation_metadata(self, conversation_id: str) -> Dict[str, Any]:
+        """Get a conversation's metadata dict, empty if it has none or does not exist."""
+        with self.get_session() as session:
+            meta_data = session.query(Conversation.meta_data).filter(Conversation.id == conversation_id).scalar()
+            return json.loads(meta_data) if meta_data else {}
+    
+    def update_conversation_metadata(self, conversation_id: str, updates: Dict[str, Any]) -> bool:
+        """Merge keys into a conversation's metadata. Returns False if the conversation does not exist."""
+        with self.get_session() as session:
+            conversation = session.query(Conversation).filter(Conversation.id == conversation_id).first()
+            if not conversation:
+                return False
+            meta_data = json.loads(conversation.meta_data) if conversation.meta_data else {}
+            meta_data.update(updates)
+            conversation.meta_data = json.dumps(meta_data)
+            session.commit()
+            return True
+    
     def add_message(self, conversation_id: str, role: str, content: str, tool_calls: Optional[List[Dict]] = None) -> Message:
         """Add a message to a conversation."""
         with self.get_session() as session:
@@ -259,23 +494,44 @@ class DatabaseManager:
                 ConversationRegion.conversation_id == conversation_id
             ).all()
     
-    def add_conversation_region(self, conversation_id: str, region_name: str, coordinates: Optional[List] = None) -> ConversationRegion:
-        """Add a region to a conversation."""
+    def add_conversation_region(self, conversation_id: str, region_name: str, coordinates: Optional[List] = None, region_id: Optional[int] = None) -> ConversationRegion:
+        """
+        Add a region to a conversation. The border is looked up by region_id when
+        given, otherwise by name. If the conversation already has the region, the
+        existing row is returned instead of adding a duplicate.
+        """
         with self.get_session() as session:
-            region_border = session.query(RegionBorder).filter(
-                RegionBorder.region_name == region_name
-            ).first()
+            if region_id is not None:
+                region_border = session.query(RegionBorder).filter(RegionBorder.id == region_id).first()
+            else:
+                region_border = session.query(RegionBorder).filter(
+                    RegionBorder.region_name == region_name
+                ).first()
             if region_border and region_border.coordinates:
                 coordinates = json.loads(region_border.coordinates)
+            
+            border_id = region_border.id if region_border else None
+            existing_query = session.query(ConversationRegion).filter(
+                ConversationRegion.conversation_id == conversation_id,
+                ConversationRegion.region_id == border_id
+            )
+            existing = existing_query.first()
+            if existing:
+                return existing
         
             region = ConversationRegion(
-                region_id=region_border.id if region_border else None,
+                region_id=border_id,
                 conversation_id=conversation_id,
                 region_name=region_name,
                 coordinates=json.dumps(coordinates) if coordinates else None
             )
             session.add(region)
-            session.commit()
+            try:
+                session.commit()
+            except IntegrityError:
+                # A concurrent call added the region first
+                session.rollback()
+                return existing_query.one()
             session.refresh(region)
             return region
     
@@ -287,8 +543,23 @@ class DatabaseManager:
                 RegionInterest.conversation_id == conversation_id
             ).all()
     
+    def get_conversation_map_snapshot(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """
+        Get all regions of a conversation with their points of interest in one query.
+        
+        Returns:
+            Region dicts in the shape of ConversationRegion.to_dict(), each with a
+            points_of_interest list of RegionInterest.to_dict() shaped dicts
+        """
+        with self.get_session() as session:
+            rows = session.execute(_map_snapshot_query(conversation_id)).all()
+        return _map_snapshot_from_rows(conversation_id, rows)
+    
     def add_region_interest(self, region_id: int, conversation_id: str, interest_type: str, points_of_interest: List[Dict[str, Any]]) -> RegionInterest:
-        """Add points of interest for a region and conversation."""
+        """
+        Store points of interest for a region and conversation. An existing row
+        for the same interest type is updated in place rather than duplicated.
+        """
         with self.get_session() as session:
             region_interest = RegionInterest(
                 region_id=region_id,
@@ -297,16 +568,219 @@ class DatabaseManager:
                 points_of_interest=json.dumps(points_of_interest)
             )
             session.add(region_interest)
-            session.commit()
+            try:
+                session.commit()
+            except IntegrityError:
+                # Already stored for this conversation; insert first since that is the common case
+                session.rollback()
+                region_interest = session.query(RegionInterest).filter(
+                    RegionInterest.region_id == region_id,
+                    RegionInterest.conversation_id == conversation_id,
+                    RegionInterest.interest_type == interest_type
+                ).one()
+                region_interest.points_of_interest = json.dumps(points_of_interest)
+                session.commit()
             session.refresh(region_interest)
             return region_interest
     
+    def add_region_interests(self, region_id: int, conversation_id: str, interests: Dict[str, List[Dict[str, Any]]]) -> List[RegionInterest]:
+        """
+        Store points of interest for several interest types in one transaction.
+        Existing rows for the same interest types are updated in place.
+        
+        Args:
+            region_id: The region the points of interest are in
+            conversation_id: The conversation they belong to
+            interests: Interest type -> its points of interest
+        
+        Returns:
+            The stored rows, in the order of interests
+        """
+        if not interests:
+            return []
+        
+        with self.get_session() as session:
+            existing = {
+                region_interest.interest_type: region_interest
+                for region_interest in session.query(RegionInterest).filter(
+                    RegionInterest.region_id == region_id,
+                    RegionInterest.conversation_id == conversation_id,
+                    RegionInterest.interest_type.in_(list(interests))
+                )
+            }
+            rows = []
+            for interest_type, points_of_interest in interests.items():
+                region_interest = existing.get(interest_type)
+                if region_interest is None:
+                    region_interest = RegionInterest(
+                        region_id=region_id,
+                        conversation_id=conversation_id,
+                        interest_type=interest_type
+                    )
+                    session.add(region_interest)
+                region_interest.points_of_interest = json.dumps(points_of_interest)
+                rows.append(region_interest)
+            try:
+                session.flush()
+                ids = [region_interest.id for region_interest in rows]
+                session.commit()
+            except IntegrityError:
+                # A concurrent write added one of the types first; fall back to one upsert each
+                session.rollback()
+                return [
+                    self.add_region_interest(region_id, conversation_id, interest_type, points_of_interest)
+                    for interest_type, points_of_interest in interests.items()
+                ]
+            stored = {
+                region_interest.id: region_interest
+                for region_interest in session.query(RegionInterest).filter(RegionInterest.id.in_(ids))
+            }
+            return [stored[interest_id] for interest_id in ids]
+    
+    def update_region_border(self, region_id: int, coordinates: List) -> Optional[RegionBorder]:
+        """Replace a region border polygon. Its region_properties are recomputed on the next sync."""
+        with self.get_session() as session:
+            region_border = session.query(RegionBorder).filter(RegionBorder.id == region_id).first()
+            if not region_border:
+                return None
+            region_border.coordinates = json.dumps(coordinates)
+            session.commit()
+            session.refresh(region_border)
+            return region_border
+    
+    def add_generated_region_border(self, region_name: str, normalized_name: str, coordinates: List) -> RegionBorder:
+        """
+        Store an LLM-generated polygon as a pending region border so later lookups
+        hit the fast path. Returns the existing border if one was already
+        generated under the same normalized name; an evicted one gets the new
+        polygon and keeps its id.
+        """
+        with self.get_session() as session:
+            region_border = session.query(RegionBorder).filter(
+                RegionBorder.source == "generated",
+                RegionBorder.normalized_name == normalized_name
+            ).first()
+            if region_border:
+                if region_border.coordinates is None:
+                    region_border.coordinates = json.dumps(coordinates)
+                    session.commit()
+                    session.refresh(region_border)
+                return region_border
+            
+            region_border = RegionBorder(
+                region_name=region_name,
+                borough_name="",
+                coordinates=json.dumps(coordinates),
+                source="generated",
+                status="pending",
+                normalized_name=normalized_name
+            )
+            session.add(region_border)
+            session.commit()
+            session.refresh(region_border)
+            return region_border
+    
+    def get_generated_region_borders(self, status: Optional[str] = None) -> List[RegionBorder]:
+        """Get LLM-generated region borders, optionally filtered by review status."""
+        with self.get_session() as session:
+            query = session.query(RegionBorder).filter(RegionBorder.source == "generated")
+            if status is not None:
+                query = query.filter(RegionBorder.status == status)
+            return query.order_by(RegionBorder.created_at).all()
+    
+    def approve_generated_region_borders(self, region_ids: List[int]) -> int:
+        """Mark generated region borders as reviewed. Returns the number updated."""
+        with self.get_session() as session:
+            updated = session.query(RegionBorder).filter(
+                RegionBorder.source == "generated",
+                RegionBorder.id.in_(region_ids)
+            ).update({RegionBorder.status: "approved"}, synchronize_session=False)
+            session.commit()
+            return updated
+    
+    def evict_generated_region_borders(self, region_ids: List[int]) -> int:
+        """
+        Clear generated region borders so the next lookup asks the LLM again.
+        
+        The rows are kept with their coordinates emptied and status back to
+        pending, and the regenerated polygon is stored into the same row, so ids
+        are never reused and aliases keep working. Conversations keep their
+        regions and interests, which hold their own copy of the old polygon.
+        Cached POIs and property membership for the old polygon are deleted in
+        the same transaction. Returns the number of borders evicted.
+        """
+        with self.get_session() as session:
+            evicted = [region_id for (region_id,) in session.query(RegionBorder.id).filter(
+                RegionBorder.source == "generated",
+                RegionBorder.id.in_(region_ids),
+                RegionBorder.coordinates.isnot(None)
+            )]
+            if not evicted:
+                return 0
+            
+            for model in (PoiCacheEntry, RegionProperty):
+                session.query(model).filter(model.region_id.in_(evicted)).delete(synchronize_session=False)
+            session.query(RegionBorder).filter(RegionBorder.id.in_(evicted)).update({
+                RegionBorder.coordinates: None,
+                RegionBorder.status: "pending",
+                RegionBorder.updated_at: datetime.utcnow()
+            }, synchronize_session=False)
+            session.commit()
+            return len(evicted)
+    
+    def add_region_alias(self, alias: str, region_id: int) -> RegionAlias:
+        """Add or repoint an alias (already normalized) for a region border."""
+        with self.get_session() as session:
+            region_alias = session.query(RegionAlias).filter(RegionAlias.alias == alias).first()
+            if region_alias:
+                region_alias.region_id = region_id
+            else:
+                region_alias = RegionAlias(alias=alias, region_id=region_id)
+                session.add(region_alias)
+            session.commit()
+            session.refresh(region_alias)
+            return region_alias
+    
+    def get_poi_cache_entry(self, region_id: int, category: str) -> Optional[PoiCacheEntry]:
+        """Get the cached points of interest for a region and normalized category."""
+        with self.get_session() as session:
+            return session.query(PoiCacheEntry).filter(
+                PoiCacheEntry.region_id == region_id,
+                PoiCacheEntry.category == category
+            ).first()
+    
+    def set_poi_cache_entry(self, region_id: int, category: str, points_of_interest: List[Dict[str, Any]]) -> PoiCacheEntry:
+        """Insert or replace the cached points of interest for a region and normalized category."""
+        with self.get_session() as session:
+            entry = session.query(PoiCacheEntry).filter(
+                PoiCacheEntry.region_id == region_id,
+                PoiCacheEntry.category == category
+            ).first()
+            if entry is None:
+                entry = PoiCacheEntry(region_id=region_id, category=category)
+                session.add(entry)
+            entry.points_of_interest = json.dumps(points_of_interest)
+            entry.created_at = datetime.utcnow()
+            session.commit()
+            session.refresh(entry)
+            return entry
+    
+    def delete_poi_cache_entry(self, region_id: int, category: str) -> None:
+        """Remove a cached points of interest entry."""
+        with self.get_session() as session:
+            session.query(PoiCacheEntry).filter(
+                PoiCacheEntry.region_id == region_id,
+                PoiCacheEntry.category == category
+            ).delete(synchronize_session=False)
+            session.commit()
+    
     def get_region(self, region_id: int) -> Optional[ConversationRegion]:
         """Get a specific region by ID."""
         with self.get_session() as session:
             return session.query(ConversationRegion).filter(ConversationRegion.region_id == region_id).first()
     
-    def _generate_title(self, first_message: str, max_length: int = 50) -> str:
+    @staticmethod
+    def _generate_title(first_message: str, max_length: int = 50) -> str:
         """Generate a conversation title from the first message."""
         # Clean and truncate the message
         title = first_message.strip()
@@ -324,6 +798,89 @@ def get_db_manager() -> DatabaseManager:
         db_manager = DatabaseManager()
     return db_manager
 
+class AsyncDatabaseManager:
+    """
+    Async access to the same database for code running on the event loop.
+    
+    Covers the queries made by the API handlers, the agent loop and the map
+    broadcasts. Tools run in worker threads and keep using DatabaseManager,
+    which also owns schema creation and migrations.
+    """
+    
+    def __init__(self, database_url: Optional[str] = None):
+        self.engine = create_async_database_engine(database_url or default_async_database_url())
+        self.SessionLocal = async_sessionmaker(bind=self.engine, autoflush=False, expire_on_commit=False)
+    
+    def get_session(self) -> AsyncSession:
+        """Get an async database session."""
+        return self.SessionLocal()
+    
+    async def get_conversation(self, conversation_id: str) -> Optional[Conversation]:
+        """Get a conversation by ID."""
+        async with self.get_session() as session:
+            return await session.get(Conversation, conversation_id)
+    
+    async def create_conversation_with_id(self, conversation_id: str, first_message: str, title: Optional[str] = None) -> Conversation:
+        """Create a new conversation with a specific ID and first user message."""
+        async with self.get_session() as session:
+            conversation = Conversation(
+                id=conversation_id,
+                title=title if title is not None else DatabaseManager._generate_title(first_message),
+                meta_data=json.dumps({})
+            )
+            session.add(conversation)
+            session.add(Message(conversation_id=conversation_id, role="user", content=first_message))
+            await session.commit()
+            return conversation
+    
+    async def add_message(self, conversation_id: str, role: str, content: str, tool_calls: Optional[List[Dict]] = None) -> Message:
+        """Add a message to a conversation."""
+        async with self.get_session() as session:
+            message = Message(
+                conversation_id=conversation_id,
+                role=role,
+                content=content,
+                tool_calls=json.dumps(tool_calls) if tool_calls else None
+            )
+            session.add(message)
+            
+            # Update conversation updated_at in the same transaction
+            await session.execute(
+                update(Conversation).where(Conversation.id == conversation_id).values(updated_at=datetime.utcnow())
+            )
+            
+            await session.commit()
+            return message
+    
+    async def get_messages(self, conversation_id: str) -> List[Message]:
+        """Get all messages for a conversation, ordered by timestamp."""
+        async with self.get_session() as session:
+            result = await session.execute(
+                select(Message).where(Message.conversation_id == conversation_id).order_by(Message.timestamp)
+            )
+            return list(result.scalars().all())
+    
+    async def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Get conversation history in Anthropic API format."""
+        messages = await self.get_messages(conversation_id)
+        return [msg.to_anthropic_format() for msg in messages]
+    
+    async def get_conversation_map_snapshot(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Async variant of DatabaseManager.get_conversation_map_snapshot."""
+        async with self.get_session() as session:
+            rows = (await session.execute(_map_snapshot_query(conversation_id))).all()
+        return _map_snapshot_from_rows(conversation_id, rows)
+
+# Global async database manager instance
+async_db_manager: Optional[AsyncDatabaseManager] = None
+
+def get_async_db_manager() -> AsyncDatabaseManager:
+    """Get the global async database manager instance."""
+    global async_db_manager
+    if async_db_manager is None:
+        async_db_manager = AsyncDatabaseManager()
+    return async_db_manager
+
 def init_database():
     """Initialize the database on startup."""
     global db_manager
@@ -0,0 +1,170 @@
+"""
+In-process background jobs for work that is too slow for a request handler.
+
+Jobs run on the server event loop in a fixed number of worker tasks, so at
+most REGION_JOB_WORKERS of them run at once and the rest wait in a queue.
+Submitting work for a key that already has a queued or running job returns
+that job instead of starting another one. Progress is reported to the
+conversation's Socket.IO room as job_progress events.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from websocket_manager import websocket_manager
+
+# Finished jobs kept for GET /jobs/{job_id}
+MAX_FINISHED_JOBS = 1000
+
+
+class Job:
+    """One unit of background work and its state."""
+    
+    def __init__(self, kind: str, key: Hashable, conversation_id: str, run: Callable[["Job"], Awaitable[Dict[str, Any]]], details: Dict[str, Any]):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.key = key
+        self.conversation_id = conversation_id
+        self.run = run
+        self.details = details
+        self.status = "queued"  # queued, running, done, failed
+        self.step: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "conversation_id": self.conversation_id,
+            **self.details,
+            "status": self.status,
+            "step": self.step,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobManager:
+    """Bounded worker pool with de-duplication of in-flight jobs by key."""
+    
+    def __init__(self, workers: Optional[int] = None):
+        if workers is None:
+            workers = int(os.getenv("REGION_JOB_WORKERS", "4"))
+        self.worker_count = workers
+        self.queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self.jobs: Dict[str, Job] = {}
+        self._active: Dict[Hashable, Job] = {}
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self.submitted = 0
+        self.deduplicated = 0
+    
+    def start(self) -> None:
+        """Start the worker tasks on the running event loop."""
+        if self._workers:
+            return
+        self.queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{n}")
+            for n in range(self.worker_count)
+        ]
+    
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+    
+    async def submit(self, kind: str, key: Hashable, conversation_id: str, run: Callable[[Job], Awaitable[Dict[str, Any]]], details: Optional[Dict[str, Any]] = None) -> Tuple[Job, bool]:
+        """
+        Queue a job unless one with the same key is already queued or running.
+        
+        Args:
+            kind: Job type, e.g. "region_details"
+            key: De-duplication key
+            conversation_id: Conversation whose room receives progress events
+            run: Coroutine function doing the work; returns the job result
+            details: Extra fields reported with the job
+        
+        Returns:
+            (job, created) where created is False if an existing job was returned
+        """
+        self.start()
+        existing = self._active.get(key)
+        if existing is not None:
+            self.deduplicated += 1
+            return existing, False
+        
+        job = Job(kind, key, conversation_id, run, details or {})
+        self.jobs[job.id] = job
+        self._active[key] = job
+        self.submitted += 1
+        await self.queue.put(job)
+        await self.report(job)
+        return job, True
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+    
+    async def report(self, job: Job, step: Optional[str] = None) -> None:
+        """Send the job's state to its conversation's room."""
+        if step is not None:
+            job.step = step
+        await websocket_manager.emit_job_progress(job.conversation_id, job.to_dict())
+    
+    async def _worker(self) -> None:
+        while True:
+            job = await self.queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            await self.report(job, "started")
+            try:
+                job.result = await job.run(job)
+                job.status = "done"
+            except Exception as e:
+                print(f"[DEBUG] Job {job.id} ({job.kind}) failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                self._active.pop(job.key, None)
+                self._remember_finished(job)
+                self.queue.task_done()
+            await self.report(job, job.status)
+    
+    def _remember_finished(self, job: Job) -> None:
+        self._finished[job.id] = None
+        while len(self._finished) > MAX_FINISHED_JOBS:
+            old_id, _ = self._finished.popitem(last=False)
+            self.jobs.pop(old_id, None)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Counters for the metrics endpoint."""
+        return {
+            "workers": self.worker_count,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "running": sum(1 for job in self._active.values() if job.status == "running"),
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated
+        }
+
+
+# Global job manager instance
+job_manager: Optional[JobManager] = None
+
+def get_job_manager() -> JobManager:
+    """Get the global job manager instance."""
+    global job_manager
+    if job_manager is None:
+        job_manager = JobManager()
+    return job_manager
@@ -0,0 +1,327 @@
+"""
+Shared gateway for every Anthropic API call the backend makes.
+
+All callers (the agent loop, the coordinates and POI tools and the history
+summarizer) go through one LLMGateway, which owns one sync and one async
+client and adds:
+
+- Per-model concurrency limits. A model has a fixed number of slots; a call
+  waits for a free one before it is sent.
+- Per-conversation fair queuing. Waiting calls are queued by conversation
+  and slots are handed out round-robin across conversations, so one busy
+  conversation can't starve the others.
+- Retries for 429 (rate limited) and 529 (overloaded) responses with full
+  jitter exponential backoff, honouring retry-after when the API sends it.
+
+Both threads (tools, the summarizer) and the event loop share the same
+limiters, so the limits hold across sync and async callers.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+import anthropic
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 529}
+
+# Slots per model unless overridden by LLM_MODEL_CONCURRENCY
+DEFAULT_MODEL_CONCURRENCY = {
+    "claude-sonnet-4-20250514": 8,
+    "claude-3-5-sonnet-20241022": 8,
+    "claude-3-5-haiku-20241022": 16,
+}
+
+
+def _parse_model_concurrency(value: str) -> Dict[str, int]:
+    """Parse "model=limit,model=limit" into a dict."""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            model, limit = item.split("=", 1)
+            limits[model.strip()] = int(limit)
+    return limits
+
+
+class _Waiter:
+    """A call waiting for a slot, woken from whichever thread releases one."""
+    
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.future: Optional[asyncio.Future] = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.granted = False
+    
+    def grant(self) -> None:
+        self.granted = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+    
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class FairLimiter:
+    """
+    Concurrency limit for one model with round-robin queuing by conversation.
+    """
+    
+    def __init__(self, model: str, limit: int):
+        self.model = model
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        # conversation_id -> its waiting calls, in the order they will be served
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    def _try_acquire(self, conversation_id: str, waiter_factory: Callable[[], _Waiter]) -> Optional[_Waiter]:
+        """Take a slot if one is free and nobody is queued, otherwise enqueue a waiter."""
+        with self._lock:
+            if self.in_flight < self.limit and not self._queues:
+                self.in_flight += 1
+                self.acquired += 1
+                return None
+            waiter = waiter_factory()
+            self._queues.setdefault(conversation_id, deque()).append(waiter)
+            return waiter
+    
+    def _record_wait(self, started: float) -> None:
+        wait = time.perf_counter() - started
+        with self._lock:
+            self.acquired += 1
+            self.waited += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+    
+    def _abandon(self, conversation_id: str, waiter: _Waiter) -> None:
+        """Drop a waiter that gave up, passing its slot on if it was already granted."""
+        with self._lock:
+            if not waiter.granted:
+                queue = self._queues.get(conversation_id)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[conversation_id]
+                return
+        self.release()
+    
+    def acquire(self, conversation_id: str) -> None:
+        started = time.perf_counter()
+        waiter = self._try_acquire(conversation_id, _Waiter)
+        if waiter is None:
+            return
+        waiter.event.wait()
+        self._record_wait(started)
+    
+    async def acquire_async(self, conversation_id: str) -> None:
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        waiter = self._try_acquire(conversation_id, lambda: _Waiter(loop))
+        if waiter is None:
+            return
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._abandon(conversation_id, waiter)
+            raise
+        self._record_wait(started)
+    
+    def release(self) -> None:
+        """Free a slot, handing it straight to the next conversation in turn."""
+        with self._lock:
+            if not self._queues:
+                self.in_flight -= 1
+                return
+            conversation_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            # Rotate so the next slot goes to a different conversation
+            del self._queues[conversation_id]
+            if queue:
+                self._queues[conversation_id] = queue
+            waiter.grant()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "queue_depth": sum(len(queue) for queue in self._queues.values()),
+                "waiting_conversations": len(self._queues),
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "avg_wait_ms": round(1000 * self.total_wait / self.waited, 1) if self.waited else 0.0,
+                "max_wait_ms": round(1000 * self.max_wait, 1)
+            }
+
+
+class LLMGateway:
+    """Shared Anthropic clients behind per-model fair limiters and a retry policy."""
+    
+    def __init__(self):
+        load_dotenv()
+        # Retries are done here, inside the concurrency slot, not by the SDK
+        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        self.async_client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        
+        self.default_concurrency = int(os.getenv("LLM_CONCURRENCY", "8"))
+        self.model_concurrency = {
+            **DEFAULT_MODEL_CONCURRENCY,
+            **_parse_model_concurrency(os.getenv("LLM_MODEL_CONCURRENCY", ""))
+        }
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "4"))
+        self.retry_base = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1.0"))
+        self.retry_max = float(os.getenv("LLM_RETRY_MAX_SECONDS", "30"))
+        
+        self._limiters: Dict[str, FairLimiter] = {}
+        self._limiters_lock = threading.Lock()
+        self.retries = 0
+        self.retry_exhausted = 0
+    
+    def limiter(self, model: str) -> FairLimiter:
+        with self._limiters_lock:
+            limiter = self._limiters.get(model)
+            if limiter is None:
+                limit = self.model_concurrency.get(model, self.default_concurrency)
+                limiter = self._limiters[model] = FairLimiter(model, limit)
+            return limiter
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying error, or None if it should not be retried."""
+        if not isinstance(error, anthropic.APIStatusError) or error.status_code not in RETRYABLE_STATUS_CODES:
+            return None
+        if attempt >= self.max_retries:
+            self.retry_exhausted += 1
+            return None
+        
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        self.retries += 1
+        logger.warning(f"LLM call got {error.status_code}, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+    
+    @contextlib.contextmanager
+    def _slot(self, model: str, conversation_id: str) -> Iterator[None]:
+        limiter = self.limiter(model)
+        limiter.acquire(conversation_id)
+        try:
+            yield
+        finally:
+            limiter.release()
+    
+    @contextlib.asynccontextmanager
+    async def _slot_async(self, model: str, conversation_id: str) -> AsyncIterator[None]:
+        limiter = self.limiter(model)
+        await limiter.acquire_async(conversation_id)
+        try:
+            yield
+        finally:
+            limiter.release()
+    
+    def create(self, conversation_id: str, **kwargs: Any) -> anthropic.types.Message:
+        """client.messages.create with fair queuing and retries."""
+        with self._slot(kwargs["model"], conversation_id):
+            attempt = 0
+            while True:
+                try:
+                    return self.client.messages.create(**kwargs)
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+    
+    async def create_async(self, conversation_id: str, **kwargs: Any) -> anthropic.types.Message:
+        """async_client.messages.create with fair queuing and retries."""
+        async with self._slot_async(kwargs["model"], conversation_id):
+            attempt = 0
+            while True:
+                try:
+                    return await self.async_client.messages.create(**kwargs)
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+    
+    @contextlib.contextmanager
+    def stream(self, conversation_id: str, **kwargs: Any) -> Iterator[Any]:
+        """
+        client.messages.stream with fair queuing. The request is retried only
+        while opening the stream, before any output has been consumed.
+        """
+        with self._slot(kwargs["model"], conversation_id), contextlib.ExitStack() as stack:
+            attempt = 0
+            while True:
+                try:
+                    stream = stack.enter_context(self.client.messages.stream(**kwargs))
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+            yield stream
+    
+    @contextlib.asynccontextmanager
+    async def stream_async(self, conversation_id: str, **kwargs: Any) -> AsyncIterator[Any]:
+        """Async variant of stream."""
+        async with self._slot_async(kwargs["model"], conversation_id), contextlib.AsyncExitStack() as stack:
+            attempt = 0
+            while True:
+                try:
+                    stream = await stack.enter_async_context(self.async_client.messages.stream(**kwargs))
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+            yield stream
+    
+    def stats(self) -> Dict[str, Any]:
+        """Per-model queue depth and wait times for the metrics endpoint."""
+        with self._limiters_lock:
+            limiters = list(self._limiters.values())
+        return {
+            "models": {limiter.model: limiter.stats() for limiter in limiters},
+            "retries": self.retries,
+            "retry_exhausted": self.retry_exhausted
+        }
+
+
+# Global LLM gateway instance
+llm_gateway: Optional[LLMGateway] = None
+_llm_gateway_lock = threading.Lock()
+
+def get_llm_gateway() -> LLMGateway:
+    """Get the global LLM gateway instance."""
+    global llm_gateway
+    if llm_gateway is None:
+        with _llm_gateway_lock:
+            if llm_gateway is None:
+                llm_gateway = LLMGateway()
+    return llm_gateway
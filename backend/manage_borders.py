@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Admin command for LLM-generated region borders.
+
+When get_area_coordinates has to ask the LLM for a polygon, the validated
+result is stored in region_borders with source='generated' and
+status='pending' so later lookups hit the fast path. Use this command to
+review those borders. Aliases map alternative names onto any border.
+
+Usage:
+    uv run python manage_borders.py list [--status pending|approved]
+    uv run python manage_borders.py approve ID [ID ...]
+    uv run python manage_borders.py evict ID [ID ...]
+    uv run python manage_borders.py alias "Kings X" ID
+"""
+
+import argparse
+import json
+from database import get_db_manager
+from coordinates_tool import normalize_area_name
+
+
+def list_borders(status: str = None) -> None:
+    borders = get_db_manager().get_generated_region_borders(status)
+    if not borders:
+        print("No generated region borders")
+        return
+
+    print(f"{'ID':>6}  {'STATUS':<9} {'POINTS':>6}  {'CREATED':<19}  NAME")
+    for border in borders:
+        points = len(json.loads(border.coordinates)) if border.coordinates else 0
+        created_at = border.created_at.strftime("%Y-%m-%d %H:%M:%S") if border.created_at else "-"
+        print(f"{border.id:>6}  {border.status:<9} {points:>6}  {created_at:<19}  {border.region_name}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Review LLM-generated region borders")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="List generated borders")
+    list_parser.add_argument("--status", choices=["pending", "approved"], help="Only show borders with this status")
+
+    approve_parser = subparsers.add_parser("approve", help="Mark generated borders as reviewed")
+    approve_parser.add_argument("ids", nargs="+", type=int)
+
+    evict_parser = subparsers.add_parser("evict", help="Clear generated borders so they are regenerated on next lookup")
+    evict_parser.add_argument("ids", nargs="+", type=int)
+
+    alias_parser = subparsers.add_parser("alias", help="Add an alternative name for a border")
+    alias_parser.add_argument("alias")
+    alias_parser.add_argument("id", type=int)
+
+    args = parser.parse_args()
+    db_manager = get_db_manager()
+
+    if args.command == "list":
+        list_borders(args.status)
+    elif args.command == "approve":
+        count = db_manager.approve_generated_region_borders(args.ids)
+        print(f"Approved {count} generated border(s)")
+    elif args.command == "evict":
+        count = db_manager.evict_generated_region_borders(args.ids)
+        print(f"Evicted {count} generated border(s)")
+    elif args.command == "alias":
+        region_alias = db_manager.add_region_alias(normalize_area_name(args.alias), args.id)
+        print(f"Alias '{region_alias.alias}' now points to region {region_alias.region_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Schema migrations for existing databases.
+
+Base.metadata.create_all creates missing tables (with their declared indexes)
+but never alters a table that already exists. Each migration below brings an
+older database up to date and is recorded in schema_migrations once applied,
+so it runs exactly once per database. Steps are written to be harmless on a
+fresh database where create_all already did the work.
+
+To change the schema, declare the change on the model in database.py and
+append a migration here with the next version number.
+"""
+
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+
+# Triggers that record which properties and region borders need their
+# region_properties membership recomputed
+MEMBERSHIP_TRIGGERS = {
+    "region_borders": [
+        "AFTER INSERT ON region_borders BEGIN INSERT INTO region_property_changes (kind, ref_id) VALUES ('region', NEW.id); END",
+        "AFTER UPDATE OF coordinates ON region_borders BEGIN INSERT INTO region_property_changes (kind, ref_id) VALUES ('region', NEW.id); END",
+        "AFTER DELETE ON region_borders BEGIN INSERT INTO region_property_changes (kind, ref_id) VALUES ('region', OLD.id); END",
+    ],
+    "properties_with_coordinates": [
+        "AFTER INSERT ON properties_with_coordinates BEGIN INSERT INTO region_property_changes (kind, ref_id) VALUES ('property', NEW.id); END",
+        "AFTER UPDATE OF price, coordinates ON properties_with_coordinates BEGIN INSERT INTO region_property_changes (kind, ref_id) VALUES ('property', NEW.id); END",
+        "AFTER DELETE ON properties_with_coordinates BEGIN INSERT INTO region_property_changes (kind, ref_id) VALUES ('property', OLD.id); END",
+    ],
+}
+
+
+class Migration(NamedTuple):
+    version: str
+    description: str
+    apply: Callable[[Connection], None]
+    # Tables created outside this app (e.g. by the listings importer); the
+    # migration is deferred until they exist
+    requires_table: Optional[str] = None
+
+
+def _add_column(connection: Connection, table_name: str, column_name: str, ddl: str) -> None:
+    existing = {column["name"] for column in inspect(connection).get_columns(table_name)}
+    if column_name not in existing:
+        connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl}"))
+
+
+def _create_index(connection: Connection, name: str, table_name: str, columns: str, unique: bool = False) -> None:
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    connection.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table_name} ({columns})"))
+
+
+def _region_border_review_columns(connection: Connection) -> None:
+    _add_column(connection, "region_borders", "source", "VARCHAR(20) NOT NULL DEFAULT 'imported'")
+    _add_column(connection, "region_borders", "status", "VARCHAR(20) NOT NULL DEFAULT 'approved'")
+    _add_column(connection, "region_borders", "normalized_name", "VARCHAR")
+    _add_column(connection, "region_borders", "created_at", "DATETIME")
+
+
+def _name_lookup_timestamps(connection: Connection) -> None:
+    _add_column(connection, "region_borders", "updated_at", "DATETIME")
+    _add_column(connection, "region_aliases", "updated_at", "DATETIME")
+
+
+def _hot_path_indexes(connection: Connection) -> None:
+    _create_index(connection, "ix_messages_conversation_timestamp", "messages", "conversation_id, timestamp")
+    _create_index(connection, "ix_conversation_regions_conversation", "conversation_regions", "conversation_id")
+    _create_index(connection, "ix_region_interests_region_conversation", "region_interests", "region_id, conversation_id")
+    _create_index(connection, "ix_region_borders_region_name", "region_borders", "region_name")
+
+
+def _property_price_index(connection: Connection) -> None:
+    _create_index(connection, "ix_properties_with_coordinates_price", "properties_with_coordinates", "price")
+
+
+def _drop_listing_price_index(connection: Connection) -> None:
+    # 0003 indexed the listings table, which no query filters by price
+    connection.execute(text("DROP INDEX IF EXISTS ix_properties_with_coordinates_price"))
+
+
+def _region_property_price_index(connection: Connection) -> None:
+    # get_properties_in_region filters and sorts region_properties by price within a region
+    _create_index(connection, "ix_region_properties_region_price", "region_properties", "region_id, price")
+
+
+def _deduplicate_regions_and_interests(connection: Connection) -> None:
+    # Keep the first row for each conversation region (its id is what clients
+    # already hold) and the latest points of interest for each interest type
+    connection.execute(text(
+        "DELETE FROM conversation_regions WHERE id NOT IN ("
+        "SELECT MIN(id) FROM conversation_regions GROUP BY conversation_id, region_id)"
+    ))
+    connection.execute(text(
+        "DELETE FROM region_interests WHERE id NOT IN ("
+        "SELECT MAX(id) FROM region_interests GROUP BY region_id, conversation_id, interest_type)"
+    ))
+    _create_index(connection, "ux_conversation_regions_conversation_region", "conversation_regions", "conversation_id, region_id", unique=True)
+    _create_index(connection, "ux_region_interests_region_conversation_type", "region_interests", "region_id, conversation_id, interest_type", unique=True)
+    # The unique indexes lead with the same columns, so these are redundant
+    connection.execute(text("DROP INDEX IF EXISTS ix_conversation_regions_conversation"))
+    connection.execute(text("DROP INDEX IF EXISTS ix_region_interests_region_conversation"))
+
+
+def _install_membership_triggers(connection: Connection, table_name: str) -> None:
+    # The change log is only filled by SQLite triggers; on other backends
+    # sync_region_properties detects changes from table signatures instead
+    if connection.dialect.name != "sqlite":
+        return
+    for number, trigger in enumerate(MEMBERSHIP_TRIGGERS[table_name]):
+        connection.execute(text(f"CREATE TRIGGER IF NOT EXISTS trg_{table_name}_membership_{number} {trigger}"))
+
+
+def _region_border_membership_triggers(connection: Connection) -> None:
+    _install_membership_triggers(connection, "region_borders")
+
+
+def _listing_membership_triggers(connection: Connection) -> None:
+    _install_membership_triggers(connection, "properties_with_coordinates")
+    # Listings imported before the triggers existed were never logged, so
+    # region_properties is rebuilt from scratch
+    connection.execute(text("INSERT INTO region_property_changes (kind, ref_id) VALUES ('rebuild', 0)"))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration("0001", "Review columns for generated region borders", _region_border_review_columns),
+    Migration("0002", "Indexes for conversation, region and interest lookups", _hot_path_indexes),
+    Migration("0003", "Price index on imported listings", _property_price_index, requires_table="properties_with_coordinates"),
+    Migration("0004", "Unique conversation regions and region interests", _deduplicate_regions_and_interests),
+    Migration("0005", "Membership change-log triggers on region borders", _region_border_membership_triggers),
+    Migration("0006", "Membership change-log triggers on listings", _listing_membership_triggers, requires_table="properties_with_coordinates"),
+    Migration("0007", "Drop the unused listings price index", _drop_listing_price_index, requires_table="properties_with_coordinates"),
+    Migration("0008", "Updated timestamps on region borders and aliases", _name_lookup_timestamps),
+    Migration("0009", "Price index on region properties", _region_property_price_index),
+]
+
+
+def run_migrations(engine: Engine) -> List[str]:
+    """
+    Apply pending migrations in order, each in its own transaction.
+    
+    Returns:
+        Versions applied by this call
+    """
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR PRIMARY KEY, description VARCHAR, applied_at DATETIME)"
+        ))
+    
+    applied = []
+    for migration in MIGRATIONS:
+        with engine.begin() as connection:
+            done = connection.execute(
+                text("SELECT 1 FROM schema_migrations WHERE version = :version"),
+                {"version": migration.version}
+            ).first()
+            if done:
+                continue
+            if migration.requires_table and not inspect(connection).has_table(migration.requires_table):
+                continue
+            
+            migration.apply(connection)
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)"),
+                {"version": migration.version, "description": migration.description, "applied_at": datetime.utcnow()}
+            )
+            print(f"Applied migration {migration.version}: {migration.description}")
+            applied.append(migration.version)
+    return applied
@@ -1,15 +1,447 @@
 import json
-import asyncio
-from typing import List, Dict, Any, Optional
-from shapely.geometry import Polygon, Point
-from database import get_db_manager, RegionBorder
-from sqlalchemy import text
+import os
+import time
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+from shapely import STRtree
+from database import get_db_manager, RegionBorder, RegionProperty, RegionPropertyChange
+from sqlalchemy import text, bindparam, func, insert
+from sqlalchemy.orm import Session
 from websocket_manager import websocket_manager
+from singleflight import single_flight
 
+PROPERTY_COLUMNS = [
+    "id", "property_id", "source", "property_link", "price", "address",
+    "bedrooms", "bathrooms", "area_sqm", "search_area", "search_query",
+    "title", "description", "images", "floor_plan_url", "coordinates",
+]
 
+# SQLite caps the number of bound parameters per statement
+ID_CHUNK_SIZE = 500
+
+
+class PropertyIndex:
+    """
+    Process-wide columnar cache of property points from properties_with_coordinates.
+    
+    Ids, longitudes, latitudes and prices are held in NumPy arrays sorted by
+    longitude, so a region query slices the candidates inside the polygon's
+    bounding box and runs a single vectorized containment check over them.
+    
+    The cache is built on first use and rebuilt when the table's signature
+    (row count and highest id) changes. The signature is checked at most once
+    per refresh interval; writers can call invalidate() to force a reload.
+    """
+    
+    def __init__(self, refresh_interval: Optional[float] = None):
+        if refresh_interval is None:
+            refresh_interval = float(os.getenv("PROPERTY_INDEX_REFRESH_SECONDS", "30"))
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._columns: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None
+        self._signature: Optional[Tuple] = None
+        self._checked_at = 0.0
+    
+    def _table_signature(self, session: Session) -> Tuple:
+        row = session.execute(text("SELECT COUNT(*), MAX(id) FROM properties_with_coordinates")).one()
+        return tuple(row)
+    
+    def _load(self, session: Session) -> None:
+        result = session.execute(text("""
+            SELECT id, price, coordinates
+            FROM properties_with_coordinates
+            WHERE coordinates IS NOT NULL AND coordinates != ''
+        """))
+        
+        ids, lons, lats, prices = [], [], [], []
+        for row in result:
+            try:
+                # Coordinates are in [longitude, latitude] format
+                prop_coords = json.loads(row.coordinates)
+            except json.JSONDecodeError:
+                # Skip properties with invalid coordinate format
+                continue
+            if len(prop_coords) >= 2:
+                ids.append(row.id)
+                lons.append(prop_coords[0])
+                lats.append(prop_coords[1])
+                prices.append(row.price)
+        
+        self.load_arrays(ids, lons, lats, prices)
+        print(f"Built property index with {len(ids)} points")
+    
+    def load_arrays(self, ids, lons, lats, prices) -> None:
+        """Replace the cached columns. Missing prices are stored as NaN."""
+        ids = np.asarray(ids, dtype=np.int64)
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        prices = np.array([np.nan if p is None else p for p in prices], dtype=np.float64)
+        
+        order = np.argsort(lons, kind="stable")
+        self._columns = (ids[order], lons[order], lats[order], prices[order])
+    
+    def ensure_fresh(self, session: Session) -> None:
+        """Build the cache, or rebuild it if the table changed since the last check."""
+        with self._lock:
+            now = time.monotonic()
+            if self._columns is not None and now - self._checked_at < self.refresh_interval:
+                return
+            
+            signature = self._table_signature(session)
+            if self._columns is None or signature != self._signature:
+                self._load(session)
+                self._signature = signature
+            self._checked_at = now
+    
+    def invalidate(self) -> None:
+        """Force a signature check on the next query."""
+        with self._lock:
+            self._checked_at = 0.0
+            self._signature = None
+    
+    def _match(self, polygon: Polygon, max_price: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            columns = self._columns
+        if columns is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        ids, lons, lats, prices = columns
+        
+        # Longitudes are sorted, so the bounding box maps to one contiguous slice
+        min_lon, min_lat, max_lon, max_lat = polygon.bounds
+        start = np.searchsorted(lons, min_lon, side="left")
+        stop = np.searchsorted(lons, max_lon, side="right")
+        
+        lon_slice = lons[start:stop]
+        lat_slice = lats[start:stop]
+        mask = (lat_slice >= min_lat) & (lat_slice <= max_lat)
+        if max_price is not None:
+            # NaN prices compare False, matching SQL's NULL semantics
+            mask &= prices[start:stop] <= max_price
+        
+        candidates = np.nonzero(mask)[0]
+        if len(candidates) > 0:
+            inside = shapely.contains_xy(polygon, lon_slice[candidates], lat_slice[candidates])
+            candidates = candidates[inside]
+        return ids[start:stop][candidates], prices[start:stop][candidates]
+    
+    def query(self, polygon: Polygon, max_price: Optional[int] = None) -> List[int]:
+        """Return ids of properties inside the polygon, optionally capped by price."""
+        ids, _ = self._match(polygon, max_price)
+        return ids.tolist()
+    
+    def members(self, polygon: Polygon) -> List[Tuple[int, Optional[float]]]:
+        """Return (id, price) pairs for every property inside the polygon."""
+        ids, prices = self._match(polygon)
+        return [
+            (int(property_id), None if np.isnan(price) else float(price))
+            for property_id, price in zip(ids, prices)
+        ]
+
+
+# Global property index instance
+property_index: Optional[PropertyIndex] = None
+
+def get_property_index() -> PropertyIndex:
+    """Get the global property index instance."""
+    global property_index
+    if property_index is None:
+        property_index = PropertyIndex()
+    return property_index
+
+
+# Serializes region_properties maintenance within the process
+_membership_lock = threading.Lock()
+
+# Set once region_properties has been fully built and is kept up to date. Until
+# then (and while a rebuild runs) get_properties_in_region tests the region
+# polygon against the property index instead
+region_properties_ready = threading.Event()
+_build_thread: Optional[threading.Thread] = None
+_build_thread_lock = threading.Lock()
+
+# Backends without the change-log triggers compare this signature of the
+# listings and borders with the one taken at the last build, and rebuild
+# periodically to catch edits that leave it unchanged
+REBUILD_INTERVAL = float(os.getenv("REGION_PROPERTIES_REBUILD_SECONDS", "3600"))
+_built_signature: Optional[Tuple] = None
+_built_at = 0.0
+
+
+def _parse_polygon(coordinates: Optional[str]) -> Optional[Polygon]:
+    """Build a valid polygon from a region_borders coordinates blob, or None."""
+    if not coordinates:
+        return None
+    try:
+        region_coords = json.loads(coordinates)
+        if not region_coords or len(region_coords) < 3:
+            return None
+        # Coordinates are in [longitude, latitude] format
+        polygon = Polygon(region_coords)
+    except Exception:
+        return None
+    return polygon if polygon.is_valid else None
+
+
+def _load_region_polygons(session: Session, region_ids: Optional[List[int]] = None) -> Dict[int, Polygon]:
+    query = session.query(RegionBorder.id, RegionBorder.coordinates)
+    if region_ids is not None:
+        query = query.filter(RegionBorder.id.in_(region_ids))
+    
+    polygons = {}
+    for region_id, coordinates in query:
+        polygon = _parse_polygon(coordinates)
+        if polygon is not None:
+            polygons[region_id] = polygon
+    return polygons
+
+
+def _insert_region_members(session: Session, region_id: int, members: List[Tuple[int, Optional[float]]]) -> None:
+    if members:
+        session.execute(insert(RegionProperty), [
+            {"region_id": region_id, "property_id": property_id, "price": price}
+            for property_id, price in members
+        ])
+
+
+def _rebuild_all_regions(session: Session, index: PropertyIndex) -> None:
+    session.query(RegionProperty).delete()
+    for region_id, polygon in _load_region_polygons(session).items():
+        _insert_region_members(session, region_id, index.members(polygon))
+
+
+def _apply_property_changes(session: Session, property_ids: List[int]) -> None:
+    """Recompute which regions contain each changed property."""
+    session.query(RegionProperty).filter(
+        RegionProperty.property_id.in_(property_ids)
+    ).delete(synchronize_session=False)
+    
+    query = text("""
+        SELECT id, price, coordinates
+        FROM properties_with_coordinates
+        WHERE id IN :ids AND coordinates IS NOT NULL AND coordinates != ''
+    """).bindparams(bindparam("ids", expanding=True))
+    
+    ids, prices, lons, lats = [], [], [], []
+    for start in range(0, len(property_ids), ID_CHUNK_SIZE):
+        for row in session.execute(query, {"ids": property_ids[start:start + ID_CHUNK_SIZE]}):
+            try:
+                prop_coords = json.loads(row.coordinates)
+            except json.JSONDecodeError:
+                continue
+            if len(prop_coords) >= 2:
+                ids.append(row.id)
+                prices.append(row.price)
+                lons.append(prop_coords[0])
+                lats.append(prop_coords[1])
+    
+    polygons = _load_region_polygons(session)
+    if not ids or not polygons:
+        return
+    
+    region_ids = list(polygons.keys())
+    tree = STRtree(list(polygons.values()))
+    point_indices, region_indices = tree.query(shapely.points(lons, lats), predicate="within")
+    session.execute(insert(RegionProperty), [
+        {"region_id": region_ids[r], "property_id": ids[p], "price": prices[p]}
+        for p, r in zip(point_indices, region_indices)
+    ])
+
+
+def _has_change_triggers() -> bool:
+    # migrations.py only installs the change-log triggers on SQLite
+    return get_db_manager().engine.dialect.name == "sqlite"
+
+
+def _source_signature(session: Session) -> Tuple:
+    """Row counts, highest ids and last border edit of the tables membership is built from."""
+    listings = session.execute(text("SELECT COUNT(*), MAX(id) FROM properties_with_coordinates")).one()
+    borders = session.query(
+        func.count(RegionBorder.id), func.max(RegionBorder.id), func.max(RegionBorder.updated_at)
+    ).one()
+    return tuple(listings) + tuple(borders)
+
+
+def build_region_properties() -> bool:
+    """
+    Build region_properties for every region border from scratch.
+    
+    Runs in a background thread (see start_region_properties_build) at
+    startup and whenever the table goes stale, so tool calls never wait for it.
+    
+    Returns:
+        Whether the table was built; False while the listings table doesn't exist
+    """
+    global _built_signature, _built_at
+    db_manager = get_db_manager()
+    index = get_property_index()
+    
+    with _membership_lock:
+        # Installs the listings triggers if the importer created the table after startup
+        if not db_manager.ensure_listings_migrated():
+            print("properties_with_coordinates does not exist yet, skipping region_properties build")
+            return False
+        
+        with db_manager.get_session() as session:
+            # Changes logged while the build runs stay in the log for the next sync
+            last_change_id = session.query(func.max(RegionPropertyChange.id)).scalar() or 0
+            signature = _source_signature(session)
+            index.invalidate()
+            index.ensure_fresh(session)
+            _rebuild_all_regions(session, index)
+            session.query(RegionPropertyChange).filter(
+                RegionPropertyChange.id <= last_change_id
+            ).delete(synchronize_session=False)
+            session.commit()
+        
+        _built_signature = signature
+        _built_at = time.monotonic()
+        region_properties_ready.set()
+    
+    print("Built region_properties for all region borders")
+    return True
+
+
+def _build_in_background() -> None:
+    try:
+        build_region_properties()
+    except Exception as e:
+        print(f"Error building region_properties: {e}")
+
+
+def start_region_properties_build() -> None:
+    """Build region_properties in a background thread unless a build is already running."""
+    global _build_thread
+    with _build_thread_lock:
+        if _build_thread is not None and _build_thread.is_alive():
+            return
+        _build_thread = threading.Thread(target=_build_in_background, name="region-properties-build", daemon=True)
+        _build_thread.start()
+
+
+def _mark_stale() -> None:
+    region_properties_ready.clear()
+    start_region_properties_build()
+
+
+def sync_region_properties() -> int:
+    """
+    Keep region_properties up to date after the initial build.
+    
+    On SQLite this drains the change log written by the triggers: changed
+    properties are re-tested against all borders and changed borders are
+    re-filled from the property index. Other backends have no triggers, so a
+    changed listings or borders signature, or REGION_PROPERTIES_REBUILD_SECONDS
+    passing since the last build, marks the table stale instead. An unbuilt or
+    stale table, or a 'rebuild' entry in the log, is rebuilt in the background.
+    
+    Returns:
+        Number of change-log entries applied
+    """
+    if not region_properties_ready.is_set():
+        start_region_properties_build()
+        return 0
+    
+    db_manager = get_db_manager()
+    index = get_property_index()
+    
+    with _membership_lock:
+        if not db_manager.ensure_listings_migrated():
+            return 0
+        
+        with db_manager.get_session() as session:
+            if not _has_change_triggers():
+                if _source_signature(session) != _built_signature or time.monotonic() - _built_at > REBUILD_INTERVAL:
+                    _mark_stale()
+                return 0
+            
+            changes = session.query(
+                RegionPropertyChange.id, RegionPropertyChange.kind, RegionPropertyChange.ref_id
+            ).all()
+            if not changes:
+                return 0
+            
+            if any(kind == "rebuild" for _, kind, _ in changes):
+                _mark_stale()
+                return 0
+            
+            property_ids = sorted({ref_id for _, kind, ref_id in changes if kind == "property"})
+            region_ids = sorted({ref_id for _, kind, ref_id in changes if kind == "region"})
+            
+            if property_ids:
+                # The triggers also catch price and coordinate edits the signature check would miss
+                index.invalidate()
+                _apply_property_changes(session, property_ids)
+            
+            if region_ids:
+                index.ensure_fresh(session)
+                session.query(RegionProperty).filter(
+                    RegionProperty.region_id.in_(region_ids)
+                ).delete(synchronize_session=False)
+                for region_id, polygon in _load_region_polygons(session, region_ids).items():
+                    _insert_region_members(session, region_id, index.members(polygon))
+            
+            print(f"Applied {len(changes)} region_properties changes "
+                  f"({len(property_ids)} properties, {len(region_ids)} regions)")
+            
+            last_change_id = max(change_id for change_id, _, _ in changes)
+            session.query(RegionPropertyChange).filter(
+                RegionPropertyChange.id <= last_change_id
+            ).delete(synchronize_session=False)
+            session.commit()
+            return len(changes)
+
+
+def _query_region_polygon(session: Session, region_id: int, max_price: Optional[int]) -> List[Dict[str, Any]]:
+    """Properties in a region straight from the property index, for when region_properties isn't built."""
+    polygons = _load_region_polygons(session, [region_id])
+    if region_id not in polygons:
+        print(f"Region with id {region_id} not found or has no valid coordinates")
+        return []
+    
+    index = get_property_index()
+    index.ensure_fresh(session)
+    property_ids = index.query(polygons[region_id], max_price)
+    
+    query = text(f"""
+        SELECT {", ".join(PROPERTY_COLUMNS)}
+        FROM properties_with_coordinates
+        WHERE id IN :ids
+    """).bindparams(bindparam("ids", expanding=True))
+    
+    properties = []
+    for start in range(0, len(property_ids), ID_CHUNK_SIZE):
+        for row in session.execute(query, {"ids": property_ids[start:start + ID_CHUNK_SIZE]}):
+            properties.append(dict(row._mapping))
+    # Same order as the region_properties query: by price, missing prices first
+    properties.sort(key=lambda prop: (prop["price"] is not None, prop["price"] or 0))
+    return properties
+
+
+def _region_members(session: Session, region_id: int, max_price: Optional[int]) -> List[Dict[str, Any]]:
+    """Properties in a region from the materialized region_properties table, cheapest first."""
+    query = f"""
+        SELECT {", ".join(f"p.{column}" for column in PROPERTY_COLUMNS)}
+        FROM region_properties rp
+        JOIN properties_with_coordinates p ON p.id = rp.property_id
+        WHERE rp.region_id = :region_id
+    """
+    params: Dict[str, Any] = {"region_id": region_id}
+    if max_price is not None:
+        query += " AND rp.price <= :max_price"
+        params["max_price"] = max_price
+    query += " ORDER BY rp.price"
+    return [dict(row._mapping) for row in session.execute(text(query), params)]
+
+
+@single_flight("get_properties_in_region", lambda region_id, conversation_id, max_price: (conversation_id, int(region_id), max_price))
 def get_properties_in_region(region_id: int, conversation_id: str, max_price: Optional[int] = None) -> List[Dict[str, Any]]:
     """
-    Get all properties that fall within the specified region area using convex hull geometry.
+    Get all properties that fall within the specified region area from the
+    materialized region_properties table, or straight from the property index
+    while that table is still being built.
     
     Args:
         region_id: ID of the region from region_borders table
@@ -25,114 +457,24 @@ def get_properties_in_region(region_id: int, conversation_id: str, max_price: Op
     try:
         db_manager = get_db_manager()
         
+        sync_region_properties()
+        if not db_manager.ensure_listings_migrated():
+            print("properties_with_coordinates does not exist yet")
+            return []
+        
         with db_manager.get_session() as session:
-            # Get region coordinates from region_borders table
-            region_border = session.query(RegionBorder).filter(
-                RegionBorder.id == region_id
-            ).first()
-            
-            if not region_border or not region_border.coordinates:
-                print(f"Region with id {region_id} not found or has no coordinates")
-                return []
-            
-            # Parse region coordinates
-            try:
-                region_coords = json.loads(region_border.coordinates)
-                if not region_coords or len(region_coords) < 3:
-                    print(f"Invalid region coordinates for region_id {region_id}")
-                    return []
-            except json.JSONDecodeError as e:
-                print(f"Error parsing region coordinates: {e}")
-                return []
-            
-            # Create shapely Polygon from region coordinates
-            # Coordinates are in [longitude, latitude] format
-            try:
-                polygon = Polygon(region_coords)
-                if not polygon.is_valid:
-                    print(f"Invalid polygon created for region_id {region_id}")
-                    return []
-            except Exception as e:
-                print(f"Error creating polygon: {e}")
-                return []
-            
-            # Get all properties from properties_with_coordinates table
-            if max_price is not None:
-                query = text("""
-                    SELECT id, property_id, source, property_link, price, address,
-                           bedrooms, bathrooms, area_sqm, search_area, search_query,
-                           title, description, images, floor_plan_url, coordinates
-                    FROM properties_with_coordinates
-                    WHERE coordinates IS NOT NULL AND coordinates != '' AND price <= :max_price
-                """)
-                result = session.execute(query, {"max_price": max_price})
+            if region_properties_ready.is_set():
+                filtered_properties = _region_members(session, region_id, max_price)
             else:
-                query = text("""
-                    SELECT id, property_id, source, property_link, price, address,
-                           bedrooms, bathrooms, area_sqm, search_area, search_query,
-                           title, description, images, floor_plan_url, coordinates
-                    FROM properties_with_coordinates
-                    WHERE coordinates IS NOT NULL AND coordinates != ''
-                """)
-                result = session.execute(query)
-            
-            properties = result.fetchall()
-            
-            filtered_properties = []
-            
-            for property_row in properties:
-                try:
-                    # Parse property coordinates
-                    prop_coords = json.loads(property_row.coordinates)
-                    
-                    # Coordinates are in [longitude, latitude] format
-                    if len(prop_coords) >= 2:
-                        point = Point(prop_coords[0], prop_coords[1])
-                        
-                        # Check if property point is within the region polygon
-                        if polygon.contains(point):
-                            # Convert row to dictionary
-                            property_dict = {
-                                'id': property_row.id,
-                                'property_id': property_row.property_id,
-                                'source': property_row.source,
-                                'property_link': property_row.property_link,
-                                'price': property_row.price,
-                                'address': property_row.address,
-                                'bedrooms': property_row.bedrooms,
-                                'bathrooms': property_row.bathrooms,
-                                'area_sqm': property_row.area_sqm,
-                                'search_area': property_row.search_area,
-                                'search_query': property_row.search_query,
-                                'title': property_row.title,
-                                'description': property_row.description,
-                                'images': property_row.images,
-                                'floor_plan_url': property_row.floor_plan_url,
-                                'coordinates': property_row.coordinates
-                            }
-                            filtered_properties.append(property_dict)
-                            
-                except json.JSONDecodeError:
-                    # Skip properties with invalid coordinate format
-                    continue
-                except Exception as e:
-                    # Skip properties that cause other errors
-                    print(f"Error processing property {property_row.id}: {e}")
-                    continue
+                # Still building in the background; don't make the user wait for it
+                filtered_properties = _query_region_polygon(session, region_id, max_price)
             
             price_info = f" under £{max_price}/month" if max_price else ""
             print(f"Found {len(filtered_properties)} properties in region {region_id}{price_info}")
             
             # Broadcast properties to websocket clients
             try:
-                # Try to get the current event loop
-                try:
-                    loop = asyncio.get_running_loop()
-                    # If we're in an event loop, create a task
-                    loop.create_task(websocket_manager.broadcast_map_update(conversation_id, filtered_properties))
-                except RuntimeError:
-                    # No running loop, safe to use asyncio.run()
-                    asyncio.run(websocket_manager.broadcast_map_update(conversation_id, filtered_properties))
+                websocket_manager.schedule_map_update(conversation_id, filtered_properties)
             except Exception as ws_error:
                 print(f"Error updating websocket with properties: {ws_error}")
             
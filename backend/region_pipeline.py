@@ -0,0 +1,160 @@
+"""
+Direct pipeline for populating a region's details on the map.
+
+Clicking a region used to start a full agent run whose only job was to call
+get_regional_interests_for_area and get_properties_in_region, followed by a
+closing text turn nobody reads. This pipeline instead extracts the user's
+interests and budget from the conversation with one small forced tool call,
+cached until the conversation gets a new message, and then runs both tools
+directly and in parallel.
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel, Field, field_validator
+from conversation_manager import format_transcript, get_conversation_manager
+from properties_tool import get_properties_in_region
+from regional_interests_tool import get_regional_interests
+from structured_output import call_tool_async, tool_definition
+
+logger = logging.getLogger(__name__)
+
+# Used when the conversation hasn't mentioned any interests yet
+DEFAULT_INTERESTS = ["cafes", "restaurants", "parks"]
+MAX_INTERESTS = 6
+
+PREFERENCES_PROMPT = """You read a conversation between a user looking for somewhere to live in London and an assistant that shows areas on a map. Record the user's preferences with the record_preferences tool.
+
+- interests: the kinds of places the user wants nearby, as short plural categories (e.g. "karaoke bars", "boxing clubs", "pizza places"), most important first. Leave it empty if the user hasn't mentioned any.
+- max_price: the user's monthly rent budget in pounds as an integer (e.g. "under £2k" is 2000), or null if no budget was given.
+- wants_properties: false only if the user explicitly said they don't care about rentals or housing, otherwise true."""
+
+
+class Preferences(BaseModel):
+    """The user's preferences as the extraction call records them."""
+    interests: List[str] = Field(description="Kinds of places the user wants nearby, most important first")
+    max_price: Optional[int] = Field(description="Monthly rent budget in pounds, or null if none was given")
+    wants_properties: bool = Field(description="False only if the user explicitly doesn't want rental listings")
+    
+    @field_validator("interests")
+    @classmethod
+    def _clean_interests(cls, interests: List[str]) -> List[str]:
+        return [interest.strip() for interest in interests if interest.strip()][:MAX_INTERESTS]
+    
+    @field_validator("max_price")
+    @classmethod
+    def _positive_price(cls, max_price: Optional[int]) -> Optional[int]:
+        return max_price if max_price and max_price > 0 else None
+
+
+# Used before the conversation has any history, or when extraction fails
+NO_PREFERENCES = Preferences(interests=[], max_price=None, wants_properties=True)
+
+PREFERENCES_TOOL = tool_definition(
+    "record_preferences",
+    "Record the user's interests and rental budget.",
+    Preferences
+)
+
+
+class RegionPipeline:
+    """Populates a region's points of interest and properties without the main agent."""
+    
+    def __init__(self, max_entries: Optional[int] = None):
+        self.conversation_manager = get_conversation_manager()
+        self.model = os.getenv("REGION_PREFERENCES_MODEL", "claude-3-5-haiku-20241022")
+        if max_entries is None:
+            max_entries = int(os.getenv("REGION_PREFERENCES_CACHE_ENTRIES", "1000"))
+        self.max_entries = max_entries
+        # conversation_id -> (message count the preferences were extracted at, preferences)
+        self._preferences: "OrderedDict[str, Tuple[int, Preferences]]" = OrderedDict()
+        self.extractions = 0
+        self.cache_hits = 0
+    
+    async def get_preferences(self, conversation_id: str) -> Preferences:
+        """
+        The user's interests, budget and whether they want rental listings.
+        
+        Extracted with a small model and reused until the conversation has a
+        new message.
+        """
+        message_count = len(await self.conversation_manager.get_conversation_history_async(conversation_id))
+        cached = self._preferences.get(conversation_id)
+        if cached is not None and cached[0] == message_count:
+            self._preferences.move_to_end(conversation_id)
+            self.cache_hits += 1
+            return cached[1]
+        
+        history = await self.conversation_manager.get_context_history_async(conversation_id)
+        if not history:
+            return NO_PREFERENCES
+        
+        try:
+            preferences = await call_tool_async(
+                conversation_id,
+                Preferences,
+                PREFERENCES_TOOL,
+                model=self.model,
+                max_tokens=300,
+                temperature=0,
+                system=PREFERENCES_PROMPT,
+                messages=[{"role": "user", "content": format_transcript(history)}]
+            )
+        except Exception as e:
+            # Not cached, so the next request tries again
+            logger.error(f"Error extracting preferences for {conversation_id}: {e}")
+            return NO_PREFERENCES
+        
+        self.extractions += 1
+        self._preferences[conversation_id] = (message_count, preferences)
+        self._preferences.move_to_end(conversation_id)
+        while len(self._preferences) > self.max_entries:
+            self._preferences.popitem(last=False)
+        logger.info(f"Extracted preferences for {conversation_id}: {preferences}")
+        return preferences
+    
+    async def populate(self, conversation_id: str, region_id: int, preferences: Preferences) -> Dict[str, Any]:
+        """
+        Run the points of interest and properties tools for a region in parallel.
+        The tools save their results and queue the map updates themselves.
+        
+        Returns:
+            Summary of what was requested and found
+        """
+        interests = preferences.interests or DEFAULT_INTERESTS
+        tasks = [asyncio.to_thread(get_regional_interests, conversation_id, region_id, f"[{', '.join(interests)}]")]
+        if preferences.wants_properties:
+            tasks.append(asyncio.to_thread(get_properties_in_region, region_id, conversation_id, preferences.max_price))
+        
+        results = await asyncio.gather(*tasks)
+        poi_result = results[0]
+        if isinstance(poi_result, str) and poi_result.startswith("Error"):
+            raise RuntimeError(poi_result)
+        
+        return {
+            "interests": interests,
+            "max_price": preferences.max_price,
+            "properties_count": len(results[1]) if len(results) > 1 else None
+        }
+    
+    def stats(self) -> Dict[str, int]:
+        """Counters for the metrics endpoint."""
+        return {
+            "cached_conversations": len(self._preferences),
+            "extractions": self.extractions,
+            "cache_hits": self.cache_hits
+        }
+
+
+# Global region pipeline instance
+region_pipeline: Optional[RegionPipeline] = None
+
+def get_region_pipeline() -> RegionPipeline:
+    """Get the global region pipeline instance."""
+    global region_pipeline
+    if region_pipeline is None:
+        region_pipeline = RegionPipeline()
+    return region_pipeline
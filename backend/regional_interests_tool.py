@@ -1,19 +1,407 @@
 import os
-import anthropic
+import re
+import time
+import threading
 import json
-import asyncio
-from typing import Optional
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from database import get_db_manager
 from shapely.geometry import Polygon, Point
 
 from websocket_manager import websocket_manager
+from llm_gateway import get_llm_gateway
+from singleflight import single_flight
+from structured_output import (
+    StructuredOutputError,
+    default_retries,
+    forced_tool_choice,
+    output_tokens,
+    structured_output_stats
+)
 
+POI_TOOL_NAME = "record_points_of_interest"
+
+
+def normalize_interest(interest: str) -> str:
+    """Normalize an interest category: "Pizza_Places" and "pizza places" share a cache key."""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", interest.lower()).split())
+
+
+def parse_user_interests(user_interests: str) -> List[str]:
+    """Split a "[karaoke bars, boxing clubs, pizza places]" string into unique interest labels."""
+    try:
+        parsed = json.loads(user_interests)
+        labels = parsed if isinstance(parsed, list) else [user_interests]
+    except (json.JSONDecodeError, TypeError):
+        labels = user_interests.strip().strip("[]").split(",")
+    
+    interests = []
+    seen = set()
+    for label in labels:
+        label = str(label).strip().strip("\"'").strip()
+        key = normalize_interest(label)
+        if key and key not in seen:
+            seen.add(key)
+            interests.append(label)
+    return interests
+
+
+class PoiCache:
+    """
+    Points of interest per (region_id, normalized interest category), shared by
+    every conversation.
+    
+    Entries live in an in-memory LRU backed by the poi_cache table, so they
+    survive restarts. Entries older than the TTL count as misses and are
+    dropped from both layers. Empty results are cached too, so a category
+    with nothing in the region is not asked for again until it expires.
+    """
+    
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        if max_entries is None:
+            max_entries = int(os.getenv("POI_CACHE_MAX_ENTRIES", "1000"))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv("POI_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # (region_id, category) -> (stored_at epoch seconds, points of interest)
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, region_id: int, interest: str) -> Optional[List[Dict[str, Any]]]:
+        """Return cached points of interest, or None on a miss."""
+        key = (region_id, normalize_interest(interest))
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, points_of_interest = entry
+                if now - stored_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return points_of_interest
+                del self._entries[key]
+                self.evictions += 1
+        
+        # Fall back to the database copy, e.g. after a restart
+        db_manager = get_db_manager()
+        db_entry = db_manager.get_poi_cache_entry(*key)
+        if db_entry is not None:
+            stored_at = (db_entry.created_at - datetime(1970, 1, 1)).total_seconds()
+            if now - stored_at < self.ttl_seconds:
+                points_of_interest = json.loads(db_entry.points_of_interest) if db_entry.points_of_interest else []
+                with self._lock:
+                    self._store(key, stored_at, points_of_interest)
+                    self.hits += 1
+                return points_of_interest
+            db_manager.delete_poi_cache_entry(*key)
+            with self._lock:
+                self.evictions += 1
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, region_id: int, interest: str, points_of_interest: List[Dict[str, Any]]) -> None:
+        """Cache points of interest in memory and in the database."""
+        key = (region_id, normalize_interest(interest))
+        get_db_manager().set_poi_cache_entry(*key, points_of_interest)
+        with self._lock:
+            self._store(key, time.time(), points_of_interest)
+    
+    def invalidate_region(self, region_id: int) -> None:
+        """Drop a region's in-memory entries, e.g. after its polygon was regenerated."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == region_id]:
+                del self._entries[key]
+    
+    def _store(self, key: Tuple[int, str], stored_at: float, points_of_interest: List[Dict[str, Any]]) -> None:
+        self._entries[key] = (stored_at, points_of_interest)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Counters for the metrics endpoint."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+# Global POI cache instance
+poi_cache: Optional[PoiCache] = None
+
+def get_poi_cache() -> PoiCache:
+    """Get the global POI cache instance."""
+    global poi_cache
+    if poi_cache is None:
+        poi_cache = PoiCache()
+    return poi_cache
+
+
+class PoiCoordinates(BaseModel):
+    latitude: float
+    longitude: float
+
+
+class PointOfInterest(BaseModel):
+    """One point of interest as the POI sub-agent records it."""
+    name: str = Field(min_length=1)
+    coordinates: PoiCoordinates
+    address: str = ""
+    rating: Optional[float] = Field(default=None, ge=0, le=5)
+    review_count: Optional[int] = Field(default=None, ge=0)
+    categories: List[str] = Field(default_factory=list)
+    emoji: str = "📍"
+
+
+# Shape of the whole answer; each POI is validated on its own as it streams
+_POI_ANSWER = TypeAdapter(Dict[str, List[Dict[str, Any]]])
+
+
+def _poi_tool(interests: List[str]) -> Dict[str, Any]:
+    """Tool whose input has one array of points of interest per requested interest."""
+    poi_schema = PointOfInterest.model_json_schema()
+    definitions = poi_schema.pop("$defs", {})
+    return {
+        "name": POI_TOOL_NAME,
+        "description": "Record the points of interest found for each of the user's interests.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                interest: {"type": "array", "items": poi_schema, "description": f"Points of interest for {interest}"}
+                for interest in interests
+            },
+            "required": interests,
+            "$defs": definitions
+        }
+    }
+
+
+class PoiStreamParser:
+    """
+    Incremental parser for the POI tool input, {"category": [{poi}, ...], ...}.
+    
+    Text is fed in chunks as the response streams. feed() returns every POI
+    object that closed within the chunk as (category, poi) pairs, so each one
+    can be used before the rest of the response arrives. A POI that isn't
+    valid JSON comes back as None; one cut off by the end of the response is
+    never returned.
+    """
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.category: Optional[str] = None
+        self._key: List[str] = []
+        self._poi: List[str] = []
+    
+    def feed(self, text: str) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        found = []
+        for char in text:
+            # Depth 1 is the top-level object, 2 a category's array, 3 a POI
+            if self.depth >= 3:
+                self._poi.append(char)
+            
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.category = json.loads('"' + "".join(self._key) + '"')
+                    continue
+                if self.depth == 1:
+                    self._key.append(char)
+                continue
+            
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    self._key = []
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 3:
+                    self._poi = [char]
+            elif char in "}]":
+                if self.depth == 3 and self.category is not None:
+                    found.append((self.category, _load_poi("".join(self._poi))))
+                self.depth -= 1
+        return found
+
+
+def _load_poi(poi_json: str) -> Optional[Dict[str, Any]]:
+    try:
+        poi = json.loads(poi_json)
+    except json.JSONDecodeError:
+        return None
+    return poi if isinstance(poi, dict) else None
+
+
+def _stream_points_of_interest(conversation_id: str, area_coordinates: str, interests: List[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Stream points of interest from the LLM's forced tool call, yielding
+    (category, poi) as each POI object closes and validates.
+    
+    Raises:
+        StructuredOutputError: After the stream ends, if the answer as a whole
+            was cut off or is missing categories
+    """
+    user_interests = f"[{', '.join(interests)}]"
+    
+    system_prompt = f"""You are a London POI expert. Find points of interest within the specified geographic boundaries based on user interests.
+
+GEOGRAPHIC AREA: {area_coordinates}
+USER INTERESTS: {user_interests}
+
+TASK: Find 3-5 relevant points of interest for each user interest within the geographic boundaries.
+
+OUTPUT FORMAT:
+Record them with the {POI_TOOL_NAME} tool, one list per user interest, using the interest names exactly as given."""
+
+    user_message = f"Find points of interest for these interests: {user_interests} within the geographic area provided."
+    
+    print(f"[DEBUG] Streaming POIs from LLM for user_interests: {user_interests}")
+    
+    tool = _poi_tool(interests)
+    parser = PoiStreamParser()
+    answer = []
+    with get_llm_gateway().stream(
+        conversation_id,
+        model="claude-3-5-sonnet-20241022",
+        max_tokens=5000,
+        temperature=0.1,
+        system=system_prompt,
+        tools=[tool],
+        tool_choice=forced_tool_choice(tool),
+        messages=[
+            {
+                "role": "user",
+                "content": user_message
+            }
+        ]
+    ) as stream:
+        for event in stream:
+            if event.type != "content_block_delta" or event.delta.type != "input_json_delta":
+                continue
+            answer.append(event.delta.partial_json)
+            for category, poi in parser.feed(event.delta.partial_json):
+                try:
+                    yield category, PointOfInterest.model_validate(poi).model_dump(exclude_none=True)
+                except ValidationError:
+                    structured_output_stats.record_invalid_item(POI_TOOL_NAME)
+        message = stream.get_final_message()
+    
+    try:
+        if message.stop_reason == "max_tokens":
+            raise ValueError("answer cut off at max_tokens")
+        categories = _POI_ANSWER.validate_json("".join(answer))
+        missing = [interest for interest in interests if interest not in categories]
+        if missing:
+            raise ValueError(f"answer is missing {missing}")
+    except ValueError as e:
+        structured_output_stats.record_failure(POI_TOOL_NAME, output_tokens(message))
+        raise StructuredOutputError(f"Invalid {POI_TOOL_NAME} answer: {e}")
+
+
+def _generate_points_of_interest(conversation_id: str, region_id: int, area_coordinates: str, polygon: Polygon, interests: List[str]) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+    """
+    Stream points of interest inside the region, pushing each one to the map
+    as it arrives. An invalid answer is retried, within the retry budget, for
+    the interests that got nothing from it.
+    
+    Returns:
+        POIs per interest, and the interests no valid answer covered
+    
+    Raises:
+        The last error if no POIs were found at all
+    """
+    requested = {normalize_interest(interest): interest for interest in interests}
+    generated: Dict[str, List[Dict[str, Any]]] = {interest: [] for interest in interests}
+    remaining = list(interests)
+    retries = default_retries()
+    structured_output_stats.record_call(POI_TOOL_NAME)
+    
+    for attempt in range(retries + 1):
+        if attempt:
+            structured_output_stats.record_retry(POI_TOOL_NAME)
+            print(f"[DEBUG] Retrying POIs for {remaining} (attempt {attempt + 1} of {retries + 1})")
+        try:
+            for category, poi in _stream_points_of_interest(conversation_id, area_coordinates, remaining):
+                interest = requested.get(normalize_interest(category))
+                if interest is None or not _in_polygon(poi, polygon):
+                    continue
+                generated[interest].append(poi)
+                try:
+                    websocket_manager.schedule_map_update(conversation_id, change={
+                        "type": "pois_streamed",
+                        "region_id": region_id,
+                        "interest_type": interest,
+                        "points_of_interest": [poi]
+                    })
+                except Exception as ws_error:
+                    print(f"Error updating websocket: {ws_error}")
+            return generated, []
+        except StructuredOutputError as e:
+            print(f"[DEBUG] {e}")
+            last_error = e
+            # Keep what already reached the map and ask again for the rest
+            remaining = [interest for interest in remaining if not generated[interest]]
+            if not remaining:
+                return generated, []
+        except Exception as e:
+            # API errors were already retried by the gateway
+            print(f"[DEBUG] Exception in LLM call: {e}")
+            last_error = e
+            break
+    else:
+        structured_output_stats.record_exhausted(POI_TOOL_NAME)
+    
+    if not any(generated.values()):
+        raise last_error
+    return generated, [interest for interest in remaining if not generated[interest]]
+
+
+def _in_polygon(poi: Dict[str, Any], polygon: Polygon) -> bool:
+    try:
+        coordinates = poi['coordinates']
+        point = Point(coordinates['longitude'], coordinates['latitude'])
+    except (KeyError, TypeError):
+        return False
+    return polygon.contains(point)
+
+
+def _regional_interests_key(conversation_id: str, region_id: int, user_interests: str) -> Tuple:
+    """Single-flight key: the same interests in any order or spelling share a call."""
+    interests = sorted({normalize_interest(interest) for interest in parse_user_interests(user_interests)})
+    return (conversation_id, int(region_id), tuple(interests))
+
+
+@single_flight("get_regional_interests_for_area", _regional_interests_key)
 def get_regional_interests(conversation_id: str, region_id: int, user_interests: str) -> str:
     """
-    Use a small LLM to find relevant points of interest within geographic regions based on user preferences. 
+    Use a small LLM to find relevant points of interest within geographic regions based on user preferences.
     Analyzes a geographic boundary and user interests, then returns the top points of interest for each category.
-
+    Categories already in the POI cache for this region are served from it; only the rest go to the LLM.
+    
     Args:
         conversation_id: The conversation ID to link POIs to
         region_id: The region ID to get coordinates for and save POIs to
@@ -37,161 +425,69 @@ def get_regional_interests(conversation_id: str, region_id: int, user_interests:
     area_coordinates = region.coordinates
     print(f"[DEBUG] Area coordinates: {area_coordinates}")
     
-    client = anthropic.Anthropic(
-        api_key=os.getenv("ANTHROPIC_API_KEY")
-    )
+    # Serve what we can from the cache
+    cache = get_poi_cache()
+    interests = parse_user_interests(user_interests)
+    filtered_poi_data = {}
+    missing_interests = []
+    for interest in interests:
+        cached = cache.get(region_id, interest)
+        if cached is None:
+            missing_interests.append(interest)
+        elif cached:
+            filtered_poi_data[interest] = cached
     
-    print(f"[DEBUG] About to create user_message")
+    print(f"[DEBUG] POI cache: {len(interests) - len(missing_interests)} hit(s), missing {missing_interests}")
     
-    system_prompt = f"""You are a London POI expert. Find points of interest within the specified geographic boundaries based on user interests.
-
-GEOGRAPHIC AREA: {area_coordinates}
-USER INTERESTS: {user_interests}
-
-TASK: Find 3-5 relevant points of interest for each user interest within the geographic boundaries.
-
-OUTPUT FORMAT:
-Return ONLY a valid JSON object with this structure. NO comments, NO additional text, NO explanations:
-{{
-  "trendy_cafes": [
-    {{
-      "name": "Cafe Name",
-      "coordinates": {{"latitude": 51.5265, "longitude": -0.0781}},
-      "address": "Full address",
-      "rating": 4.5,
-      "review_count": 123,
-      "categories": ["cafe", "coffee"],
-      "emoji": "☕",
-    }}
-  ]
-}}
-
-CRITICAL: 
-- Your response must be valid JSON
-- Use exact category names from user interests
-- Ensure all quotes are properly closed"""
+    if missing_interests:
+        # filter out pois outside of the region
+        try:
+            polygon = Polygon(json.loads(area_coordinates))
+            if not polygon.is_valid:
+                print(f"[ERROR] Invalid polygon created for region_id {region_id}")
+                return f"Error: Invalid polygon for region {region_id}"
+        except Exception as e:
+            print(f"[ERROR] Error creating polygon: {e}")
+            return f"Error: {e}"
+        
+        # Each POI goes to the map as soon as the LLM finishes writing it
+        try:
+            generated, unanswered = _generate_points_of_interest(conversation_id, region_id, area_coordinates, polygon, missing_interests)
+        except Exception as e:
+            return f"Error: {e}"
+        
+        counts = {interest: len(poi_list) for interest, poi_list in generated.items()}
+        print(f"[DEBUG] Streamed POIs: {counts}")
+        
+        # Cache every answered category, including empty ones, under the user's label
+        for interest in missing_interests:
+            poi_list = generated[interest]
+            if interest not in unanswered:
+                cache.put(region_id, interest, poi_list)
+            if poi_list:
+                filtered_poi_data[interest] = poi_list
     
-    user_message = f"Find points of interest for these interests: {user_interests} within the geographic area provided."
+    print(f"[DEBUG] filtered out filtered_poi_data: {filtered_poi_data}")
     
-    print(f"[DEBUG] System prompt created, length: {len(system_prompt)}")
-    print(f"[DEBUG] User message created, length: {len(user_message)}")
-
     try:
-        print(f"[DEBUG] Sending request to LLM with user_interests: {user_interests}")
-        response = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=5000,
-            temperature=0.1,
-            system=system_prompt,
-            messages=[
-                {
-                    "role": "user", 
-                    "content": user_message
-                },
-                {
-                    "role": "assistant",
-                    "content": "{"  # Prefill to start json response
-                }
-            ]
-        )
-        
-        print(f"[DEBUG] LLM response received, content length: {len(response.content[0].text)}")
-        poi_json = "{" + response.content[0].text.strip()
-        print(f"[DEBUG] Full POI JSON length: {len(poi_json)}")
+        # Save all interest categories in one batch
+        saved_interests = [
+            region_interest.to_dict()
+            for region_interest in db_manager.add_region_interests(region_id, conversation_id, filtered_poi_data)
+        ]
+        print(f"[DEBUG] Saved {len(saved_interests)} region interests")
         
-        # Save POIs to database
+        # Replace the streamed POIs with the stored categories
         try:
-            print(f"[DEBUG] Raw POI JSON: {poi_json[:200]}...")
-            # Clean JSON by removing comments and fixing incomplete JSON
-            import re
-
-            clean_json = poi_json
-            # clean_json = re.sub(r'//.*', '', poi_json)
-            # clean_json = re.sub(r'/\*.*?\*/', '', clean_json, flags=re.DOTALL)
-            # clean_json = re.sub(r'\s+', ' ', clean_json).strip()
-            
-            # Try to fix incomplete JSON by adding missing closing braces/brackets
-            if not clean_json.endswith('}'):
-                # Count opening vs closing braces
-                open_braces = clean_json.count('{')
-                close_braces = clean_json.count('}')
-                open_brackets = clean_json.count('[')
-                close_brackets = clean_json.count(']')
-                
-                # Add missing closing brackets and braces
-                clean_json += ']' * (open_brackets - close_brackets)
-                clean_json += '}' * (open_braces - close_braces)
-            
-            print(f"[DEBUG] Cleaned JSON: {clean_json[:200]}...")
-            poi_data = json.loads(clean_json)
-            print(f"[DEBUG] Parsed POI data keys: {list(poi_data.keys())}")
-            
-            area_coordinates = json.loads(area_coordinates)
-            
-            # filter out pois outside of 
-            if not area_coordinates or len(area_coordinates) < 3:
-                print(f"[ERROR] Invalid region coordinates for region_id {region_id}")
-                
-            try:
-                polygon = Polygon(area_coordinates)
-                if not polygon.is_valid:
-                    print(f"[ERROR] Invalid polygon created for region_id {region_id}")
-                    return poi_json
-            except Exception as e:
-                print(f"[ERROR] Error creating polygon: {e}")
-                return poi_json
-            
-            filtered_poi_data = {}
-
-            for interest_description, poi_list in poi_data.items():
-                print(f"[DEBUG] Checking interest: {interest_description}, POI count: {len(poi_list) if poi_list else 0}")
-                if poi_list:  # Only save if there are POIs
-                    filtered_poi_list = []
-
-                    for poi in poi_list:
-                        coordinates = poi['coordinates']
-                        point = Point(coordinates['longitude'], coordinates['latitude'])
-
-                        if polygon.contains(point):
-                            print(f"[DEBUG] filtered out {point}")
-                            filtered_poi_list.append(poi)
-
-                    if len(filtered_poi_list) > 0:
-                        filtered_poi_data[interest_description] = filtered_poi_list
-            
-            print(f"[DEBUG] filtered out filtered_poi_data: {filtered_poi_data}")
-
-            # Save each interest category to database
-            for interest_description, poi_list in filtered_poi_data.items():
-                print(f"[DEBUG] Processing interest: {interest_description}, POI count: {len(poi_list) if poi_list else 0}")
-                if poi_list:  # Only save if there are POIs
-                    result = db_manager.add_region_interest(
-                        region_id=region_id,
-                        conversation_id=conversation_id,
-                        interest_type=interest_description,
-                        points_of_interest=poi_list
-                    )
-                    print(f"[DEBUG] Saved region interest with ID: {result.id}")
-            
-            poi_json = json.dumps(filtered_poi_data)
-
-            # Broadcast websocket update
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    # Create task for running event loop
-                    asyncio.create_task(websocket_manager.broadcast_map_update(conversation_id))
-                else:
-                    asyncio.run(websocket_manager.broadcast_map_update(conversation_id))
-            except Exception as ws_error:
-                print(f"Error updating websocket: {ws_error}")
-                
-        except Exception as save_error:
-            print(f"Error saving POIs to database: {save_error}")
-            print(f"[DEBUG] Full JSON that failed to parse: {clean_json}")
-        
-        return poi_json
-            
-    except Exception as e:
-        print(f"[DEBUG] Exception in LLM call: {e}")
-        return f"Error: {e}"
\ No newline at end of file
+            if saved_interests:
+                websocket_manager.schedule_map_update(conversation_id, change={
+                    "type": "pois_added",
+                    "region_id": region_id,
+                    "interests": saved_interests
+                })
+        except Exception as ws_error:
+            print(f"Error updating websocket: {ws_error}")
+    except Exception as save_error:
+        print(f"Error saving POIs to database: {save_error}")
+    
+    return json.dumps(filtered_poi_data)
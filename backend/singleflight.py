@@ -0,0 +1,104 @@
+"""
+Single-flight execution for tool calls.
+
+When a call comes in while an identical one (same function, same normalized
+arguments) is still running, it waits for that execution and gets its result
+instead of running again. Nothing is cached: once the call finishes the next
+identical call runs normally.
+
+Tools run in worker threads, so waiting is done with threading primitives.
+"""
+
+import functools
+import inspect
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executions = 0
+        self.shared = 0
+    
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn unless a call with the same key is in flight, then wait for it.
+        
+        Returns:
+            fn's result, or the in-flight call's result. Its exception is
+            re-raised in every waiting caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.shared += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executions": self.executions,
+                "shared": self.shared
+            }
+
+
+# Global single-flight group shared by the tools
+tool_flights = SingleFlight()
+
+
+def single_flight(name: str, key: Callable[..., Hashable]) -> Callable:
+    """
+    Decorate a tool so concurrent identical calls share one execution.
+    
+    Args:
+        name: Tool name, part of the key so tools never share results
+        key: Called with the tool's arguments; returns their normalized form
+    """
+    def decorator(fn: Callable) -> Callable:
+        signature = inspect.signature(fn)
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                flight_key = (name, key(**bound.arguments))
+            except Exception:
+                # Arguments the key can't normalize; let the tool report them
+                return fn(*args, **kwargs)
+            return tool_flights.do(flight_key, lambda: fn(*args, **kwargs))
+        
+        return wrapper
+    return decorator
@@ -0,0 +1,177 @@
+"""
+Structured output for the LLM sub-agents.
+
+The polygon and points-of-interest sub-agents used to ask for raw JSON text
+and repair it afterwards, so a malformed answer wasted the whole call. They
+now get their output through a forced tool call whose input_schema comes from
+a pydantic model, and the input is validated against that model. An answer
+that doesn't validate is retried within an explicit per-call budget, and
+every failure is counted with the output tokens it cost.
+
+Retries here are for invalid output only; rate limits and overload are
+retried by the LLM gateway.
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional, Type, TypeVar
+from pydantic import BaseModel
+from llm_gateway import get_llm_gateway
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+class StructuredOutputError(Exception):
+    """The model's tool input didn't validate within the retry budget."""
+
+
+def default_retries() -> int:
+    """Extra attempts allowed after an invalid answer."""
+    return max(0, int(os.getenv("STRUCTURED_OUTPUT_RETRIES", "1")))
+
+
+def tool_definition(name: str, description: str, model: Type[BaseModel]) -> Dict[str, Any]:
+    """Anthropic tool definition whose input_schema is the model's JSON schema."""
+    return {"name": name, "description": description, "input_schema": model.model_json_schema()}
+
+
+def forced_tool_choice(tool: Dict[str, Any]) -> Dict[str, str]:
+    return {"type": "tool", "name": tool["name"]}
+
+
+def output_tokens(message: Any) -> int:
+    usage = getattr(message, "usage", None)
+    return getattr(usage, "output_tokens", 0) or 0
+
+
+class StructuredOutputStats:
+    """Per-tool counters for the metrics endpoint."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tools: Dict[str, Dict[str, int]] = {}
+    
+    def _counters(self, tool_name: str) -> Dict[str, int]:
+        return self._tools.setdefault(tool_name, {
+            "calls": 0,
+            "parse_failures": 0,
+            "retries": 0,
+            "exhausted": 0,
+            "invalid_items": 0,
+            "wasted_output_tokens": 0
+        })
+    
+    def record_call(self, tool_name: str) -> None:
+        with self._lock:
+            self._counters(tool_name)["calls"] += 1
+    
+    def record_failure(self, tool_name: str, wasted_tokens: int) -> None:
+        """An answer that didn't validate; its output tokens were wasted."""
+        with self._lock:
+            counters = self._counters(tool_name)
+            counters["parse_failures"] += 1
+            counters["wasted_output_tokens"] += wasted_tokens
+    
+    def record_retry(self, tool_name: str) -> None:
+        with self._lock:
+            self._counters(tool_name)["retries"] += 1
+    
+    def record_exhausted(self, tool_name: str) -> None:
+        with self._lock:
+            self._counters(tool_name)["exhausted"] += 1
+    
+    def record_invalid_item(self, tool_name: str) -> None:
+        """A single item (e.g. one POI) dropped from an otherwise usable answer."""
+        with self._lock:
+            self._counters(tool_name)["invalid_items"] += 1
+    
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {tool_name: dict(counters) for tool_name, counters in self._tools.items()}
+
+
+# Global structured output counters
+structured_output_stats = StructuredOutputStats()
+
+
+def _validated(output_model: Type[ModelT], response: Any) -> ModelT:
+    """Validate a forced tool call's input; raises ValueError when it doesn't."""
+    tool_input = next((block.input for block in response.content if block.type == "tool_use"), None)
+    if tool_input is None:
+        raise ValueError("no tool_use block in the response")
+    if response.stop_reason == "max_tokens":
+        raise ValueError("answer cut off at max_tokens")
+    # ValidationError is a ValueError
+    return output_model.model_validate(tool_input)
+
+
+def call_tool(conversation_id: str, output_model: Type[ModelT], tool: Dict[str, Any], retries: Optional[int] = None, **kwargs: Any) -> ModelT:
+    """
+    Make an LLM call that must answer through the given tool and validate
+    its input against output_model.
+    
+    Args:
+        conversation_id: Conversation the call is made for, for fair queuing
+        output_model: Pydantic model the tool input must validate against
+        tool: Tool definition, usually from tool_definition
+        retries: Extra attempts after an invalid answer (STRUCTURED_OUTPUT_RETRIES by default)
+        **kwargs: Passed to messages.create (model, max_tokens, system, messages...)
+    
+    Returns:
+        The validated model instance
+    
+    Raises:
+        StructuredOutputError: No valid answer within the retry budget
+    """
+    if retries is None:
+        retries = default_retries()
+    tool_name = tool["name"]
+    structured_output_stats.record_call(tool_name)
+    
+    last_error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            structured_output_stats.record_retry(tool_name)
+        response = get_llm_gateway().create(
+            conversation_id,
+            tools=[tool],
+            tool_choice=forced_tool_choice(tool),
+            **kwargs
+        )
+        try:
+            return _validated(output_model, response)
+        except ValueError as e:
+            last_error = e
+            structured_output_stats.record_failure(tool_name, output_tokens(response))
+            print(f"[DEBUG] Invalid {tool_name} answer (attempt {attempt + 1} of {retries + 1}): {last_error}")
+    
+    structured_output_stats.record_exhausted(tool_name)
+    raise StructuredOutputError(f"No valid {tool_name} answer after {retries + 1} attempts: {last_error}")
+
+
+async def call_tool_async(conversation_id: str, output_model: Type[ModelT], tool: Dict[str, Any], retries: Optional[int] = None, **kwargs: Any) -> ModelT:
+    """Async variant of call_tool, for callers on the event loop."""
+    if retries is None:
+        retries = default_retries()
+    tool_name = tool["name"]
+    structured_output_stats.record_call(tool_name)
+    
+    last_error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            structured_output_stats.record_retry(tool_name)
+        response = await get_llm_gateway().create_async(
+            conversation_id,
+            tools=[tool],
+            tool_choice=forced_tool_choice(tool),
+            **kwargs
+        )
+        try:
+            return _validated(output_model, response)
+        except ValueError as e:
+            last_error = e
+            structured_output_stats.record_failure(tool_name, output_tokens(response))
+            print(f"[DEBUG] Invalid {tool_name} answer (attempt {attempt + 1} of {retries + 1}): {last_error}")
+    
+    structured_output_stats.record_exhausted(tool_name)
+    raise StructuredOutputError(f"No valid {tool_name} answer after {retries + 1} attempts: {last_error}")
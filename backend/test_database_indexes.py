@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Index test for the hot database queries.
+
+Captures the SQL that the DatabaseManager methods actually run and checks
+with EXPLAIN QUERY PLAN that each one is answered from an index rather than
+a table scan. Also checks that migrations add the indexes to a database
+created before they existed.
+
+Usage:
+    uv run python test_database_indexes.py
+"""
+
+import os
+import tempfile
+from typing import Callable, List, Tuple
+from sqlalchemy import create_engine, event, text
+import properties_tool
+from database import DatabaseManager, RegionBorder
+from migrations import MIGRATIONS
+
+HOT_INDEXES = [
+    "ix_messages_conversation_timestamp",
+    "ux_conversation_regions_conversation_region",
+    "ux_region_interests_region_conversation_type",
+    "ix_region_borders_region_name",
+    "ix_region_properties_region_price",
+]
+
+
+def make_db() -> Tuple[DatabaseManager, str]:
+    """Create a temporary database with a listings table, as the importer would."""
+    db_path = os.path.join(tempfile.mkdtemp(), "indexes.db")
+    with create_engine(f"sqlite:///{db_path}").begin() as connection:
+        columns = ", ".join(f"{column} TEXT" for column in properties_tool.PROPERTY_COLUMNS if column not in ("id", "price"))
+        connection.execute(text(
+            f"CREATE TABLE properties_with_coordinates (id INTEGER PRIMARY KEY, price REAL, {columns})"
+        ))
+    
+    db_manager = DatabaseManager(f"sqlite:///{db_path}")
+    with db_manager.get_session() as session:
+        session.add(RegionBorder(region_name="Shoreditch", borough_name="Hackney", coordinates="[]"))
+        session.commit()
+    return db_manager, db_path
+
+
+def capture_selects(db_manager: DatabaseManager, fn: Callable[[], object]) -> List[Tuple[str, tuple]]:
+    """Run fn and return the SELECT statements it executed with their parameters."""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+    
+    event.listen(db_manager.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn()
+    finally:
+        event.remove(db_manager.engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def query_plan(db_manager: DatabaseManager, statement: str, parameters: tuple) -> str:
+    with db_manager.engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    return " | ".join(row[-1] for row in rows)
+
+
+def test_hot_queries_use_indexes():
+    db_manager, _ = make_db()
+    conversation = db_manager.create_conversation("Show me Shoreditch")
+    
+    hot_queries = {
+        "get_messages": (lambda: db_manager.get_messages(conversation.id), "ix_messages_conversation_timestamp"),
+        "get_conversation_regions": (lambda: db_manager.get_conversation_regions(conversation.id), "ux_conversation_regions_conversation_region"),
+        "get_region_interests": (lambda: db_manager.get_region_interests(1, conversation.id), "ux_region_interests_region_conversation_type"),
+        "add_conversation_region by name": (lambda: db_manager.add_conversation_region(conversation.id, "Shoreditch"), "ix_region_borders_region_name"),
+        "get_conversation_map_snapshot": (lambda: db_manager.get_conversation_map_snapshot(conversation.id), "ux_conversation_regions_conversation_region"),
+    }
+    
+    for name, (fn, index_name) in hot_queries.items():
+        statements = capture_selects(db_manager, fn)
+        assert statements, f"{name} ran no SELECT"
+        plan = query_plan(db_manager, *statements[0])
+        assert index_name in plan, f"{name} does not use {index_name}: {plan}"
+        print(f"✅ {name}: {plan}")
+    
+    # The tools use the global managers, so point them at this database while the query runs
+    original_db_manager = properties_tool.get_db_manager
+    original_update = properties_tool.websocket_manager.schedule_map_update
+    properties_tool.get_db_manager = lambda: db_manager
+    properties_tool.websocket_manager.schedule_map_update = lambda conversation_id, properties=None, change=None: None
+    try:
+        assert properties_tool.build_region_properties()
+        statements = capture_selects(db_manager, lambda: properties_tool.get_properties_in_region(1, conversation.id, 2000))
+    finally:
+        properties_tool.get_db_manager = original_db_manager
+        properties_tool.websocket_manager.schedule_map_update = original_update
+        # The build and the property index were for this database, not the global one
+        properties_tool.region_properties_ready.clear()
+        properties_tool.get_property_index().invalidate()
+    
+    lookup = next((statement for statement in statements if "FROM region_properties" in statement[0]), None)
+    assert lookup, "get_properties_in_region did not query region_properties"
+    plan = query_plan(db_manager, *lookup)
+    assert "ix_region_properties_region_price" in plan and "TEMP B-TREE" not in plan, f"price filter does not use its index: {plan}"
+    print(f"✅ get_properties_in_region price filter: {plan}")
+
+
+def test_migrations_index_existing_database():
+    db_manager, db_path = make_db()
+    
+    # Turn it back into a database from before the indexes existed
+    with db_manager.engine.begin() as connection:
+        for index_name in HOT_INDEXES:
+            connection.execute(text(f"DROP INDEX {index_name}"))
+        connection.execute(text("DELETE FROM schema_migrations WHERE version != '0001'"))
+    db_manager.engine.dispose()
+    
+    db_manager = DatabaseManager(f"sqlite:///{db_path}")
+    with db_manager.engine.connect() as connection:
+        indexes = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        versions = [row[0] for row in connection.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+    
+    missing = [index_name for index_name in HOT_INDEXES if index_name not in indexes]
+    assert not missing, f"migrations did not create {missing}"
+    assert "ix_properties_with_coordinates_price" not in indexes, "0007 did not drop the listings price index"
+    assert versions == [migration.version for migration in MIGRATIONS], f"recorded versions {versions}"
+    print(f"✅ Migrations recreated {len(HOT_INDEXES)} indexes on an existing database")
+
+
+def main() -> None:
+    """Main test function."""
+    print("Database Index Test")
+    print("=" * 60)
+    
+    test_hot_queries_use_indexes()
+    test_migrations_index_existing_database()
+    
+    print("=" * 60)
+    print("Testing complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Test for the shared LLM gateway.
+
+Replaces the gateway's Anthropic clients with fakes and checks that calls
+respect the per-model limit, that a conversation arriving behind a busy one
+is served in turn instead of after its whole backlog, and that 429/529
+responses are retried.
+
+Usage:
+    uv run python test_llm_gateway.py
+"""
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from typing import List
+import anthropic
+import httpx
+from llm_gateway import LLMGateway
+
+MODEL = "test-model"
+
+
+def status_error(status_code: int) -> anthropic.APIStatusError:
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    response = httpx.Response(status_code, request=request)
+    return anthropic.APIStatusError(f"status {status_code}", response=response, body=None)
+
+
+class FakeMessages:
+    """Records which conversation each call belonged to and how many ran at once."""
+    
+    def __init__(self, delay: float = 0.02, failures: List[int] = None):
+        self.delay = delay
+        self.failures = list(failures or [])
+        self.calls: List[str] = []
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+    
+    def create(self, **kwargs):
+        with self._lock:
+            if self.failures:
+                raise status_error(self.failures.pop(0))
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+            self.calls.append(kwargs["metadata"]["conversation"])
+        return SimpleNamespace(content=[])
+
+
+class FakeAsyncMessages:
+    def __init__(self, messages: FakeMessages):
+        self.messages = messages
+    
+    async def create(self, **kwargs):
+        return await asyncio.to_thread(self.messages.create, **kwargs)
+
+
+def make_gateway(limit: int, messages: FakeMessages) -> LLMGateway:
+    gateway = LLMGateway()
+    gateway.model_concurrency[MODEL] = limit
+    gateway.retry_base = 0.01
+    gateway.client = SimpleNamespace(messages=messages)
+    gateway.async_client = SimpleNamespace(messages=FakeAsyncMessages(messages))
+    return gateway
+
+
+def call(gateway: LLMGateway, conversation_id: str) -> None:
+    gateway.create(conversation_id, model=MODEL, metadata={"conversation": conversation_id})
+
+
+def test_limit_respected():
+    messages = FakeMessages()
+    gateway = make_gateway(3, messages)
+    
+    threads = [threading.Thread(target=call, args=(gateway, f"conversation-{n}")) for n in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    stats = gateway.stats()["models"][MODEL]
+    assert messages.peak <= 3, f"{messages.peak} calls ran at once with a limit of 3"
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0, stats
+    assert stats["waited"] > 0, "no call had to wait"
+    print(f"✅ 12 calls, peak concurrency {messages.peak}/3, avg wait {stats['avg_wait_ms']}ms")
+
+
+def test_fair_queuing():
+    messages = FakeMessages()
+    gateway = make_gateway(1, messages)
+    
+    # A busy conversation queues 8 calls, then a second one asks for 2
+    busy = [threading.Thread(target=call, args=(gateway, "busy")) for _ in range(8)]
+    for thread in busy:
+        thread.start()
+        time.sleep(0.001)
+    quiet = [threading.Thread(target=call, args=(gateway, "quiet")) for _ in range(2)]
+    for thread in quiet:
+        thread.start()
+    for thread in busy + quiet:
+        thread.join()
+    
+    last_quiet = max(n for n, conversation_id in enumerate(messages.calls) if conversation_id == "quiet")
+    assert last_quiet < 6, f"quiet conversation finished at position {last_quiet}: {messages.calls}"
+    print(f"✅ Quiet conversation served in turn: {messages.calls}")
+
+
+def test_sync_and_async_share_limit():
+    messages = FakeMessages()
+    gateway = make_gateway(2, messages)
+    
+    async def run():
+        threads = [threading.Thread(target=call, args=(gateway, f"thread-{n}")) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        await asyncio.gather(*(
+            gateway.create_async(f"async-{n}", model=MODEL, metadata={"conversation": f"async-{n}"})
+            for n in range(4)
+        ))
+        for thread in threads:
+            thread.join()
+    
+    asyncio.run(run())
+    assert len(messages.calls) == 8, messages.calls
+    assert messages.peak <= 2, f"{messages.peak} calls ran at once with a limit of 2"
+    print(f"✅ Threads and the event loop shared the limit, peak {messages.peak}/2")
+
+
+def test_retries_rate_limits():
+    messages = FakeMessages(failures=[429, 529])
+    gateway = make_gateway(1, messages)
+    
+    call(gateway, "retried")
+    assert messages.calls == ["retried"], messages.calls
+    assert gateway.retries == 2, f"{gateway.retries} retries"
+    
+    messages.failures = [400]
+    try:
+        call(gateway, "bad request")
+        assert False, "400 was not raised"
+    except anthropic.APIStatusError as e:
+        assert e.status_code == 400
+    assert gateway.retries == 2, "400 was retried"
+    assert gateway.stats()["models"][MODEL]["in_flight"] == 0, "failed call kept its slot"
+    print("✅ 429 and 529 retried, 400 raised immediately")
+
+
+def main() -> None:
+    """Main test function."""
+    print("LLM Gateway Test")
+    print("=" * 60)
+    
+    test_limit_respected()
+    test_fair_queuing()
+    test_sync_and_async_share_limit()
+    test_retries_rate_limits()
+    
+    print("=" * 60)
+    print("Testing complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Test script for the conversation map snapshot loader.
+
+Builds a throwaway SQLite database with several regions and interest
+categories, then checks that get_conversation_map_snapshot returns the same
+data as the per-region to_dict() calls while issuing a single query.
+
+Usage:
+    uv run python test_map_snapshot.py
+"""
+
+import asyncio
+import os
+import tempfile
+from typing import List, Tuple
+from sqlalchemy import event
+from database import AsyncDatabaseManager, DatabaseManager, RegionBorder
+
+REGION_COUNT = 10
+INTERESTS_PER_REGION = 3
+
+
+def make_db() -> Tuple[DatabaseManager, str]:
+    """Create a temporary database with one conversation's regions and POIs."""
+    db_path = os.path.join(tempfile.mkdtemp(), "snapshot.db")
+    db_manager = DatabaseManager(f"sqlite:///{db_path}")
+    
+    with db_manager.get_session() as session:
+        for i in range(REGION_COUNT + 1):
+            session.add(RegionBorder(
+                region_name=f"Region {i}",
+                borough_name="Test",
+                coordinates=f"[[-0.1, 51.5], [-0.1, 51.6], [-0.0, 51.6], [-0.0, 51.{5 + i % 3}]]"
+            ))
+        session.commit()
+    
+    conversation = db_manager.create_conversation("Show me some areas")
+    other = db_manager.create_conversation("Another conversation")
+    
+    for region_id in range(1, REGION_COUNT + 1):
+        db_manager.add_conversation_region(conversation.id, f"Region {region_id}", region_id=region_id)
+        # Leave the last region without any points of interest
+        if region_id == REGION_COUNT:
+            continue
+        for n in range(INTERESTS_PER_REGION):
+            db_manager.add_region_interest(region_id, conversation.id, f"interest {n}", [
+                {"name": f"Place {region_id}.{n}", "coordinates": {"latitude": 51.55, "longitude": -0.05}}
+            ])
+    
+    # Interests from another conversation in the same region must not leak in
+    db_manager.add_conversation_region(other.id, "Region 1", region_id=1)
+    db_manager.add_region_interest(1, other.id, "other interest", [])
+    
+    return db_manager, conversation.id
+
+
+def count_queries(db_manager: DatabaseManager, fn) -> Tuple[object, int]:
+    """Run fn and return (result, number of SQL statements executed)."""
+    statements: List[str] = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(db_manager.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = fn()
+    finally:
+        event.remove(db_manager.engine, "before_cursor_execute", before_cursor_execute)
+    return result, len(statements)
+
+
+def load_per_region(db_manager: DatabaseManager, conversation_id: str) -> list:
+    """The previous loader: one query for regions plus one per region."""
+    regions_data = []
+    for region in db_manager.get_conversation_regions(conversation_id):
+        region_dict = region.to_dict()
+        region_dict['points_of_interest'] = [
+            interest.to_dict() for interest in db_manager.get_region_interests(region.region_id, conversation_id)
+        ]
+        regions_data.append(region_dict)
+    return regions_data
+
+
+def test_snapshot_matches_per_region_loader():
+    db_manager, conversation_id = make_db()
+    
+    expected = load_per_region(db_manager, conversation_id)
+    snapshot = db_manager.get_conversation_map_snapshot(conversation_id)
+    
+    assert snapshot == expected, "snapshot differs from per-region loader"
+    assert len(snapshot) == REGION_COUNT
+    assert snapshot[-1]["points_of_interest"] == []
+    print(f"✅ Snapshot matches per-region loader ({len(snapshot)} regions)")
+
+
+def test_snapshot_uses_one_query():
+    db_manager, conversation_id = make_db()
+    
+    _, old_queries = count_queries(db_manager, lambda: load_per_region(db_manager, conversation_id))
+    snapshot, new_queries = count_queries(db_manager, lambda: db_manager.get_conversation_map_snapshot(conversation_id))
+    
+    assert new_queries == 1, f"expected 1 query, got {new_queries}"
+    assert old_queries == REGION_COUNT + 1
+    print(f"✅ Snapshot used {new_queries} query (per-region loader used {old_queries})")
+
+
+def test_async_snapshot_matches_sync():
+    db_manager, conversation_id = make_db()
+    async_db_manager = AsyncDatabaseManager(str(db_manager.engine.url))
+    
+    async def load() -> Tuple[list, int]:
+        statements: List[str] = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(async_db_manager.engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            snapshot = await async_db_manager.get_conversation_map_snapshot(conversation_id)
+        finally:
+            event.remove(async_db_manager.engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+            await async_db_manager.engine.dispose()
+        return snapshot, len(statements)
+    
+    snapshot, queries = asyncio.run(load())
+    
+    assert snapshot == db_manager.get_conversation_map_snapshot(conversation_id), "async snapshot differs from sync"
+    assert queries == 1, f"expected 1 query, got {queries}"
+    print("✅ Async snapshot matches sync snapshot with 1 query")
+
+
+def test_empty_conversation():
+    db_manager, _ = make_db()
+    snapshot, queries = count_queries(db_manager, lambda: db_manager.get_conversation_map_snapshot("missing"))
+    
+    assert snapshot == []
+    assert queries == 1
+    print("✅ Unknown conversation gives an empty snapshot")
+
+
+def main() -> None:
+    """Main test function."""
+    print("Map Snapshot Loader Test")
+    print("=" * 60)
+    
+    test_snapshot_matches_per_region_loader()
+    test_snapshot_uses_one_query()
+    test_async_snapshot_matches_sync()
+    test_empty_conversation()
+    
+    print("=" * 60)
+    print("Testing complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Test for streaming POI generation.
+
+Checks that PoiStreamParser returns the same POIs however the tool input is
+split into chunks, that get_regional_interests validates each POI and pushes
+the ones inside the region to the map while the answer is still streaming,
+stores everything in one batch, and retries the interests that got nothing
+when an answer is cut off.
+
+Usage:
+    uv run python test_poi_streaming.py
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import List
+
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "poi_streaming.db")
+
+import regional_interests_tool
+from database import RegionBorder, get_db_manager
+from regional_interests_tool import POI_TOOL_NAME, PoiStreamParser
+from structured_output import structured_output_stats
+
+REGION_COORDINATES = [[-0.1, 51.5], [-0.1, 51.6], [0.0, 51.6], [0.0, 51.5], [-0.1, 51.5]]
+
+# Quotes and braces inside strings, one POI without coordinates and one outside the region
+ANSWER = """{
+  "pizza places": [
+    {"name": "Pizza \\"Pilgrims\\"", "coordinates": {"latitude": 51.52, "longitude": -0.07}, "address": "Dean St {Soho}", "emoji": "🍕"},
+    {"name": "Yard Sale", "coordinates": {"latitude": 51.55, "longitude": -0.06}, "emoji": "🍕"},
+    {"name": "Nowhere Pizza", "address": "Unknown"}
+  ],
+  "boxing clubs": [
+    {"name": "Far Away Gym", "coordinates": {"latitude": 51.40, "longitude": -0.30}},
+    {"name": "Repton Boxing Club", "coordinates": {"latitude": 51.53, "longitude": -0.07}}
+  ]
+}"""
+
+
+class FakeStream:
+    """Yields a tool input as input_json_delta events in small chunks."""
+    
+    def __init__(self, answer: str, stop_reason: str, finished: List[float]):
+        self.answer = answer
+        self.final = SimpleNamespace(stop_reason=stop_reason, usage=SimpleNamespace(output_tokens=len(answer) // 4))
+        self.finished = finished
+    
+    def __iter__(self):
+        for start in range(0, len(self.answer), 40):
+            time.sleep(0.01)
+            delta = SimpleNamespace(type="input_json_delta", partial_json=self.answer[start:start + 40])
+            yield SimpleNamespace(type="content_block_delta", delta=delta)
+        self.finished.append(time.perf_counter())
+    
+    def get_final_message(self):
+        return self.final
+
+
+class FakeGateway:
+    """Answers each stream call with the next canned tool input."""
+    
+    def __init__(self, answers: List[tuple]):
+        self.answers = list(answers)
+        self.requests = []
+        self.finished = []
+    
+    @contextlib.contextmanager
+    def stream(self, conversation_id, **kwargs):
+        self.requests.append(kwargs)
+        answer, stop_reason = self.answers.pop(0)
+        yield FakeStream(answer, stop_reason, self.finished)
+
+
+@contextlib.contextmanager
+def fakes(answers: List[tuple]):
+    """Swap in the fake gateway and record map updates, restoring both afterwards."""
+    gateway = FakeGateway(answers)
+    updates = []
+    original_gateway = regional_interests_tool.get_llm_gateway
+    original_update = regional_interests_tool.websocket_manager.schedule_map_update
+    regional_interests_tool.get_llm_gateway = lambda: gateway
+    regional_interests_tool.websocket_manager.schedule_map_update = (
+        lambda conversation_id, properties=None, change=None: updates.append((time.perf_counter(), change))
+    )
+    try:
+        yield gateway, updates
+    finally:
+        regional_interests_tool.get_llm_gateway = original_gateway
+        regional_interests_tool.websocket_manager.schedule_map_update = original_update
+
+
+def make_conversation(message: str) -> tuple:
+    db_manager = get_db_manager()
+    with db_manager.get_session() as session:
+        region = RegionBorder(region_name="Shoreditch", borough_name="Hackney", coordinates=json.dumps(REGION_COORDINATES))
+        session.add(region)
+        session.commit()
+        region_id = region.id
+    conversation_id = db_manager.create_conversation(message).id
+    db_manager.add_conversation_region(conversation_id, "Shoreditch", region_id=region_id)
+    return conversation_id, region_id
+
+
+def poi_counters() -> dict:
+    counters = {"invalid_items": 0, "parse_failures": 0, "retries": 0, "wasted_output_tokens": 0}
+    counters.update(structured_output_stats.stats().get(POI_TOOL_NAME, {}))
+    return counters
+
+
+def parse_in_chunks(text: str, size: int) -> List[tuple]:
+    parser = PoiStreamParser()
+    found = []
+    for start in range(0, len(text), size):
+        found.extend(parser.feed(text[start:start + size]))
+    return found
+
+
+def test_parser_chunking():
+    expected = parse_in_chunks(ANSWER, len(ANSWER))
+    assert [(category, poi["name"]) for category, poi in expected] == [
+        ("pizza places", 'Pizza "Pilgrims"'),
+        ("pizza places", "Yard Sale"),
+        ("pizza places", "Nowhere Pizza"),
+        ("boxing clubs", "Far Away Gym"),
+        ("boxing clubs", "Repton Boxing Club"),
+    ], expected
+    
+    for size in (1, 3, 7, 64):
+        assert parse_in_chunks(ANSWER, size) == expected, f"chunks of {size} parsed differently"
+    print(f"✅ {len(expected)} POIs parsed identically from chunks of 1, 3, 7 and 64 characters")
+    
+    truncated = ANSWER[:ANSWER.index("Repton") + 20]
+    names = [poi["name"] for _, poi in parse_in_chunks(truncated, 5)]
+    assert names[-1] == "Far Away Gym", names
+    print("✅ POI cut off by the end of the answer skipped")
+
+
+def test_pois_pushed_while_streaming():
+    conversation_id, region_id = make_conversation("Pizza and boxing please")
+    invalid_before = poi_counters()["invalid_items"]
+    
+    batch_calls = []
+    db_manager = get_db_manager()
+    add_region_interests = db_manager.add_region_interests
+    db_manager.add_region_interests = lambda *args: batch_calls.append(args) or add_region_interests(*args)
+    try:
+        with fakes([(ANSWER, "tool_use")]) as (gateway, updates):
+            result = json.loads(regional_interests_tool.get_regional_interests(conversation_id, region_id, "[pizza places, boxing clubs]"))
+    finally:
+        db_manager.add_region_interests = add_region_interests
+    
+    request = gateway.requests[0]
+    assert request["tool_choice"] == {"type": "tool", "name": POI_TOOL_NAME}, request["tool_choice"]
+    assert request["tools"][0]["input_schema"]["required"] == ["pizza places", "boxing clubs"]
+    
+    streamed = [change for _, change in updates if change["type"] == "pois_streamed"]
+    streamed_names = [change["points_of_interest"][0]["name"] for change in streamed]
+    assert streamed_names == ['Pizza "Pilgrims"', "Yard Sale", "Repton Boxing Club"], streamed_names
+    assert updates[0][0] < gateway.finished[0], "first POI was not pushed before the stream ended"
+    assert poi_counters()["invalid_items"] == invalid_before + 1
+    print(f"✅ {len(streamed)} POIs pushed while streaming, the invalid one and the one outside the region dropped")
+    
+    assert len(batch_calls) == 1, f"{len(batch_calls)} batch writes"
+    final = updates[-1][1]
+    assert final["type"] == "pois_added" and len(final["interests"]) == 2, final
+    assert {interest: len(pois) for interest, pois in result.items()} == {"pizza places": 2, "boxing clubs": 1}, result
+    print("✅ Stored in one batch and replaced on the map by the saved categories")
+
+
+def test_cut_off_answer_retried_for_missing_interests():
+    conversation_id, region_id = make_conversation("Karaoke and climbing")
+    cut_off = '{"karaoke bars": [{"name": "Lucky Voice", "coordinates": {"latitude": 51.52, "longitude": -0.08}}], "climbing walls": [{"name": "Cl'
+    retry = '{"climbing walls": [{"name": "The Castle", "coordinates": {"latitude": 51.56, "longitude": -0.09}}]}'
+    before = poi_counters()
+    
+    with fakes([(cut_off, "max_tokens"), (retry, "tool_use")]) as (gateway, _):
+        result = json.loads(regional_interests_tool.get_regional_interests(conversation_id, region_id, "[karaoke bars, climbing walls]"))
+    
+    asked_for = [request["tools"][0]["input_schema"]["required"] for request in gateway.requests]
+    assert asked_for == [["karaoke bars", "climbing walls"], ["climbing walls"]], asked_for
+    assert {interest: [poi["name"] for poi in pois] for interest, pois in result.items()} == {
+        "karaoke bars": ["Lucky Voice"], "climbing walls": ["The Castle"]
+    }, result
+    
+    after = poi_counters()
+    assert after["parse_failures"] == before["parse_failures"] + 1
+    assert after["retries"] == before["retries"] + 1
+    assert after["wasted_output_tokens"] == before["wasted_output_tokens"] + len(cut_off) // 4
+    print(f"✅ Cut-off answer counted ({len(cut_off) // 4} wasted tokens) and retried for the missing interest only")
+    
+    cache = regional_interests_tool.get_poi_cache()
+    assert [poi["name"] for poi in cache.get(region_id, "karaoke bars")] == ["Lucky Voice"]
+    assert [poi["name"] for poi in cache.get(region_id, "climbing walls")] == ["The Castle"]
+    print("✅ Interests answered by the cut-off answer and by the retry are both cached")
+
+
+def main() -> None:
+    """Main test function."""
+    print("POI Streaming Test")
+    print("=" * 60)
+    
+    test_parser_chunking()
+    test_pois_pushed_while_streaming()
+    test_cut_off_answer_retried_for_missing_interests()
+    
+    print("=" * 60)
+    print("Testing complete!")
+
+
+if __name__ == "__main__":
+    main()
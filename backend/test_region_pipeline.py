@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Test for the direct region pipeline.
+
+Replaces the LLM gateway and the two tools with fakes and checks that the
+preferences are extracted once per conversation state, that the budget and
+interests reach the tools, that both tools run at the same time, and that
+properties are skipped when the user doesn't want them.
+
+Usage:
+    uv run python test_region_pipeline.py
+"""
+
+import asyncio
+import contextlib
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "pipeline.db")
+
+import region_pipeline
+import structured_output
+from conversation_manager import get_conversation_manager
+
+
+class FakeGateway:
+    """Answers the preferences call with a fixed tool input."""
+    
+    def __init__(self, tool_input: Dict):
+        self.tool_input = tool_input
+        self.calls = 0
+    
+    async def create_async(self, conversation_id: str, **kwargs):
+        assert kwargs["tool_choice"] == {"type": "tool", "name": "record_preferences"}
+        self.calls += 1
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="tool_use", input=self.tool_input)],
+            stop_reason="tool_use",
+            usage=SimpleNamespace(output_tokens=20)
+        )
+
+
+class FakeTools:
+    """Records tool calls and how many ran at once."""
+    
+    def __init__(self):
+        self.calls: List[tuple] = []
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+    
+    def _run(self, call: tuple, result):
+        with self._lock:
+            self.calls.append(call)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.1)
+        with self._lock:
+            self.running -= 1
+        return result
+    
+    def get_regional_interests(self, conversation_id, region_id, user_interests):
+        return self._run(("interests", region_id, user_interests), "{}")
+    
+    def get_properties_in_region(self, region_id, conversation_id, max_price=None):
+        return self._run(("properties", region_id, max_price), [{"id": 1}, {"id": 2}])
+
+
+@contextlib.contextmanager
+def fakes(tool_input: Dict):
+    """Swap in the fake gateway and tools, restoring the real ones afterwards."""
+    gateway = FakeGateway(tool_input)
+    tools = FakeTools()
+    originals = (structured_output.get_llm_gateway, region_pipeline.get_regional_interests, region_pipeline.get_properties_in_region)
+    structured_output.get_llm_gateway = lambda: gateway
+    region_pipeline.get_regional_interests = tools.get_regional_interests
+    region_pipeline.get_properties_in_region = tools.get_properties_in_region
+    try:
+        yield gateway, tools
+    finally:
+        structured_output.get_llm_gateway, region_pipeline.get_regional_interests, region_pipeline.get_properties_in_region = originals
+
+
+def test_preferences_drive_both_tools():
+    manager = get_conversation_manager()
+    conversation_id = manager.create_conversation("Somewhere with pizza places and boxing clubs, under £1800 a month")
+    pipeline = region_pipeline.RegionPipeline()
+    
+    async def run():
+        preferences = await pipeline.get_preferences(conversation_id)
+        result = await pipeline.populate(conversation_id, 7, preferences)
+        # No new message, so the extraction is reused
+        await pipeline.get_preferences(conversation_id)
+        return result
+    
+    with fakes({"interests": ["pizza places", "boxing clubs"], "max_price": 1800, "wants_properties": True}) as (gateway, tools):
+        result = asyncio.run(run())
+        assert gateway.calls == 1, f"preferences extracted {gateway.calls} times"
+        assert ("interests", 7, "[pizza places, boxing clubs]") in tools.calls, tools.calls
+        assert ("properties", 7, 1800) in tools.calls, tools.calls
+        assert tools.peak == 2, "tools did not run in parallel"
+        assert result["properties_count"] == 2, result
+        print(f"✅ One extraction, both tools ran in parallel: {tools.calls}")
+        
+        manager.add_user_message(conversation_id, "Actually I can do £2000")
+        asyncio.run(pipeline.get_preferences(conversation_id))
+        assert gateway.calls == 2, "a new message did not refresh the preferences"
+        print("✅ New message refreshed the preferences")
+
+
+def test_properties_skipped_when_not_wanted():
+    conversation_id = get_conversation_manager().create_conversation("Just show me what's around, I'm not renting")
+    pipeline = region_pipeline.RegionPipeline()
+    
+    async def run():
+        preferences = await pipeline.get_preferences(conversation_id)
+        return await pipeline.populate(conversation_id, 3, preferences)
+    
+    with fakes({"interests": [], "max_price": None, "wants_properties": False}) as (_, tools):
+        result = asyncio.run(run())
+    assert [call[0] for call in tools.calls] == ["interests"], tools.calls
+    assert result["interests"] == region_pipeline.DEFAULT_INTERESTS, result
+    print(f"✅ Properties skipped, default interests used: {result['interests']}")
+
+
+def main() -> None:
+    """Main test function."""
+    print("Region Pipeline Test")
+    print("=" * 60)
+    
+    test_preferences_drive_both_tools()
+    test_properties_skipped_when_not_wanted()
+    
+    print("=" * 60)
+    print("Testing complete!")
+
+
+if __name__ == "__main__":
+    main()
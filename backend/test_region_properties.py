@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Test for the region_properties membership table.
+
+Starts without a listings table, imports one after startup the way the
+listings importer does, and checks that a lookup answers from the region
+polygon without waiting for the membership build, which installs the
+change-log triggers and runs once in the background. Then inserts, updates and
+deletes listings and checks that each sync applies just those changes, that an
+empty membership table is not rebuilt, that fractional prices survive, and
+that a backend without triggers rebuilds when the listings change.
+
+Usage:
+    uv run python test_region_properties.py
+"""
+
+import json
+import os
+import tempfile
+from typing import Dict, Optional
+
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "region_properties.db")
+
+import properties_tool
+from database import RegionBorder, RegionProperty, RegionPropertyChange, get_db_manager
+from sqlalchemy import text
+
+SHOREDITCH = [[-0.1, 51.5], [-0.1, 51.6], [0.0, 51.6], [0.0, 51.5], [-0.1, 51.5]]
+INSIDE = [-0.05, 51.55]
+OUTSIDE = [-0.3, 51.4]
+
+
+def execute(statement: str, **params) -> None:
+    with get_db_manager().engine.begin() as connection:
+        connection.execute(text(statement), params)
+
+
+def membership(region_id: int) -> Dict[int, Optional[float]]:
+    with get_db_manager().get_session() as session:
+        rows = session.query(RegionProperty.property_id, RegionProperty.price).filter(RegionProperty.region_id == region_id)
+        return {property_id: price for property_id, price in rows}
+
+
+def pending_changes() -> int:
+    with get_db_manager().get_session() as session:
+        return session.query(RegionPropertyChange).count()
+
+
+def test_membership_follows_listings():
+    db_manager = get_db_manager()
+    with db_manager.get_session() as session:
+        region = RegionBorder(region_name="Shoreditch", borough_name="Hackney", coordinates=json.dumps(SHOREDITCH))
+        session.add(region)
+        session.commit()
+        region_id = region.id
+    
+    # No listings table yet: nothing to build
+    assert properties_tool.build_region_properties() is False
+    
+    # The importer creates the table after startup
+    columns = ", ".join(f"{column} TEXT" for column in properties_tool.PROPERTY_COLUMNS if column not in ("id", "price"))
+    execute(f"CREATE TABLE properties_with_coordinates (id INTEGER PRIMARY KEY, price REAL, {columns})")
+    execute("INSERT INTO properties_with_coordinates (id, price, coordinates) VALUES (1, 1500.5, :c)", c=json.dumps(INSIDE))
+    execute("INSERT INTO properties_with_coordinates (id, price, coordinates) VALUES (2, 2000, :c)", c=json.dumps(OUTSIDE))
+    
+    rebuilds = []
+    original_rebuild = properties_tool._rebuild_all_regions
+    original_update = properties_tool.websocket_manager.schedule_map_update
+    properties_tool._rebuild_all_regions = lambda session, index: rebuilds.append(1) or original_rebuild(session, index)
+    properties_tool.websocket_manager.schedule_map_update = lambda conversation_id, properties=None, change=None: None
+    try:
+        # Holding the membership lock keeps the background build from finishing
+        conversation_id = get_db_manager().create_conversation("Flats in Shoreditch").id
+        with properties_tool._membership_lock:
+            found = properties_tool.get_properties_in_region(region_id, conversation_id)
+            assert not properties_tool.region_properties_ready.is_set()
+        assert [prop["id"] for prop in found] == [1], found
+        print("✅ Lookup answered from the region polygon while the build was pending")
+        
+        assert properties_tool.region_properties_ready.wait(10), "background build did not finish"
+        assert membership(region_id) == {1: 1500.5}, membership(region_id)
+        assert pending_changes() == 0
+        print(f"✅ Triggers installed and membership built in the background: {membership(region_id)}")
+        
+        # Insert, update into the region, and delete after the initial build
+        execute("INSERT INTO properties_with_coordinates (id, price, coordinates) VALUES (3, 1800, :c)", c=json.dumps(INSIDE))
+        execute("UPDATE properties_with_coordinates SET coordinates = :c, price = 1999.99 WHERE id = 2", c=json.dumps(INSIDE))
+        assert pending_changes() == 2, "triggers did not log the insert and update"
+        assert properties_tool.sync_region_properties() == 2
+        assert membership(region_id) == {1: 1500.5, 2: 1999.99, 3: 1800}, membership(region_id)
+        print(f"✅ Insert and update applied incrementally: {membership(region_id)}")
+        
+        execute("DELETE FROM properties_with_coordinates WHERE id IN (1, 2, 3)")
+        assert properties_tool.sync_region_properties() == 3
+        assert membership(region_id) == {}
+        print("✅ Deletes applied, region now empty")
+        
+        # An empty membership table is a valid state, not a reason to rebuild
+        assert properties_tool.sync_region_properties() == 0
+        assert len(rebuilds) == 1, f"membership rebuilt {len(rebuilds)} times"
+        print("✅ Built once; an empty membership table is not rebuilt")
+        
+        # Without triggers (non-SQLite backends) a changed listings signature schedules a rebuild
+        assert properties_tool.build_region_properties()
+        original_triggers = properties_tool._has_change_triggers
+        properties_tool._has_change_triggers = lambda: False
+        try:
+            assert properties_tool.sync_region_properties() == 0
+            assert properties_tool.region_properties_ready.is_set() and len(rebuilds) == 2, "unchanged tables were rebuilt"
+            execute("INSERT INTO properties_with_coordinates (id, price, coordinates) VALUES (4, 1750, :c)", c=json.dumps(INSIDE))
+            properties_tool.sync_region_properties()
+            assert properties_tool.region_properties_ready.wait(10), "rebuild did not finish"
+            assert membership(region_id) == {4: 1750}, membership(region_id)
+            assert len(rebuilds) == 3
+            print("✅ Without triggers a new listing triggered a background rebuild")
+        finally:
+            properties_tool._has_change_triggers = original_triggers
+    finally:
+        properties_tool._rebuild_all_regions = original_rebuild
+        properties_tool.websocket_manager.schedule_map_update = original_update
+
+
+def main() -> None:
+    """Main test function."""
+    print("Region Properties Test")
+    print("=" * 60)
+    
+    test_membership_follows_listings()
+    
+    print("=" * 60)
+    print("Testing complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,10 @@
 Socket.IO client for testing real-time map updates.
 
 Usage:
-    python test_socket_client.py
+    python test_socket_client.py CONVERSATION_ID
 
-This client connects to the Socket.IO server and listens for map update events.
+This client connects to the Socket.IO server, subscribes to one conversation
+and listens for its map update events.
 Run this alongside the backend server to see real-time map updates when the agent
 processes area recommendations.
 """
@@ -15,6 +16,11 @@ import time
 import sys
 
 def main():
+    if len(sys.argv) < 2:
+        print("Usage: python test_socket_client.py CONVERSATION_ID")
+        sys.exit(1)
+    conversation_id = sys.argv[1]
+    
     # Create Socket.IO client
     sio = socketio.SimpleClient()
 
@@ -22,6 +28,8 @@ def main():
         print("🔌 Connecting to Socket.IO server at http://localhost:8000/map...")
         sio.connect('http://localhost:8000', socketio_path='/map')
         print("✅ Connected successfully!")
+        sio.emit('subscribe', {'conversation_id': conversation_id})
+        print(f"📡 Subscribed to conversation {conversation_id}")
         print("👂 Listening for map updates... (Press Ctrl+C to quit)")
         print("-" * 50)
         
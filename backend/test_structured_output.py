@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Test for schema-constrained sub-agent output.
+
+Replaces the LLM gateway with a fake that answers the forced
+record_area_polygon call and checks that an invalid polygon is retried,
+counted with its wasted tokens and never stored, that a call that stays
+invalid gives up after its retry budget, and that an evicted border is
+regenerated under its old id.
+
+Usage:
+    uv run python test_structured_output.py
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from typing import Dict, List
+
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "structured_output.db")
+os.environ["STRUCTURED_OUTPUT_RETRIES"] = "1"
+
+import coordinates_tool
+import structured_output
+from database import ConversationRegion, RegionBorder, get_db_manager
+from regional_interests_tool import get_poi_cache
+from structured_output import structured_output_stats
+
+TOOL_NAME = coordinates_tool.AREA_POLYGON_TOOL["name"]
+PARIS = [[2.29, 48.85], [2.30, 48.86], [2.31, 48.85]]
+HACKNEY_WICK = [[-0.03, 51.54], [-0.02, 51.55], [-0.01, 51.54], [-0.03, 51.54]]
+
+
+class FakeGateway:
+    """Answers each create call with the next canned tool input."""
+    
+    def __init__(self, answers: List[Dict]):
+        self.answers = list(answers)
+        self.requests = []
+    
+    def create(self, conversation_id, **kwargs):
+        self.requests.append(kwargs)
+        tool_input = self.answers.pop(0)
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="tool_use", input=tool_input)],
+            stop_reason="tool_use",
+            usage=SimpleNamespace(output_tokens=100)
+        )
+
+
+@contextlib.contextmanager
+def fake_gateway(answers: List[Dict]):
+    """Swap in the fake gateway and drop map updates, restoring both afterwards."""
+    gateway = FakeGateway(answers)
+    original_gateway = structured_output.get_llm_gateway
+    original_update = coordinates_tool.websocket_manager.schedule_map_update
+    structured_output.get_llm_gateway = lambda: gateway
+    coordinates_tool.websocket_manager.schedule_map_update = lambda conversation_id, properties=None, change=None: None
+    try:
+        yield gateway
+    finally:
+        structured_output.get_llm_gateway = original_gateway
+        coordinates_tool.websocket_manager.schedule_map_update = original_update
+
+
+def polygon_counters() -> Dict[str, int]:
+    counters = {"parse_failures": 0, "retries": 0, "exhausted": 0, "wasted_output_tokens": 0}
+    counters.update(structured_output_stats.stats().get(TOOL_NAME, {}))
+    return counters
+
+
+def stored_borders(area_name: str) -> int:
+    with get_db_manager().get_session() as session:
+        return session.query(RegionBorder).filter(RegionBorder.region_name == area_name).count()
+
+
+def test_invalid_polygon_retried():
+    conversation_id = get_db_manager().create_conversation("Hackney Wick?").id
+    before = polygon_counters()
+    
+    with fake_gateway([{"coordinates": PARIS}, {"coordinates": HACKNEY_WICK}]) as gateway:
+        result = json.loads(coordinates_tool.get_area_coordinates("Hackney Wick", conversation_id))
+    
+    assert len(gateway.requests) == 2, f"{len(gateway.requests)} LLM calls"
+    assert gateway.requests[0]["tool_choice"] == {"type": "tool", "name": TOOL_NAME}
+    assert result["coordinates"] == HACKNEY_WICK, result
+    assert stored_borders("Hackney Wick") == 1
+    
+    after = polygon_counters()
+    assert after["parse_failures"] == before["parse_failures"] + 1, after
+    assert after["retries"] == before["retries"] + 1, after
+    assert after["wasted_output_tokens"] == before["wasted_output_tokens"] + 100, after
+    print(f"✅ Polygon outside London retried and counted: {after}")
+
+
+def test_retry_budget_exhausted():
+    conversation_id = get_db_manager().create_conversation("Somewhere odd").id
+    exhausted_before = polygon_counters()["exhausted"]
+    
+    with fake_gateway([{"coordinates": PARIS}, {"coordinates": [[-0.03, 51.54]]}, {"coordinates": HACKNEY_WICK}]) as gateway:
+        result = coordinates_tool.get_area_coordinates("Atlantis", conversation_id)
+    
+    assert result.startswith("Error"), result
+    assert len(gateway.requests) == 2, f"{len(gateway.requests)} LLM calls with a budget of one retry"
+    assert stored_borders("Atlantis") == 0
+    assert polygon_counters()["exhausted"] == exhausted_before + 1
+    print("✅ Gave up after the retry budget without storing anything")
+
+
+def test_evicted_border_regenerated_in_place():
+    db_manager = get_db_manager()
+    conversation_id = db_manager.create_conversation("Dalston?").id
+    dalston = [[-0.08, 51.54], [-0.07, 51.55], [-0.06, 51.54], [-0.08, 51.54]]
+    
+    with fake_gateway([{"coordinates": HACKNEY_WICK}]):
+        coordinates_tool.get_area_coordinates("Dalston", conversation_id)
+    with db_manager.get_session() as session:
+        region_id = session.query(RegionBorder.id).filter(RegionBorder.region_name == "Dalston").scalar()
+    get_poi_cache().put(region_id, "cafes", [{"name": "Old polygon cafe"}])
+    
+    assert db_manager.evict_generated_region_borders([region_id]) == 1
+    coordinates_tool.get_area_name_index().invalidate()
+    assert coordinates_tool.get_area_quick("Dalston", None) is None, "evicted border still served"
+    
+    with fake_gateway([{"coordinates": dalston}]) as gateway:
+        result = json.loads(coordinates_tool.get_area_coordinates("Dalston", conversation_id))
+    assert len(gateway.requests) == 1 and result["coordinates"] == dalston, result
+    assert stored_borders("Dalston") == 1, "regenerated border got a new row"
+    with db_manager.get_session() as session:
+        border = session.query(RegionBorder).filter(RegionBorder.region_name == "Dalston").one()
+        assert border.id == region_id and json.loads(border.coordinates) == dalston
+        assert session.query(ConversationRegion).filter(ConversationRegion.conversation_id == conversation_id).count() == 1
+    assert get_poi_cache().get(region_id, "cafes") is None, "POIs for the old polygon still cached"
+    print(f"✅ Evicted border regenerated as region {region_id}, conversation region kept, old POIs dropped")
+
+
+def main() -> None:
+    """Main test function."""
+    print("Structured Output Test")
+    print("=" * 60)
+    
+    test_invalid_polygon_retried()
+    test_retry_budget_exhausted()
+    test_evicted_border_regenerated_in_place()
+    
+    print("=" * 60)
+    print("Testing complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test for single-flight tool calls and duplicate-free region writes.
+
+Fires identical get_regional_interests calls at the same time, with the POI
+LLM call replaced by a slow fake, and checks that the LLM runs once, every
+caller gets the same result and the region's interests are stored once.
+Also checks that adding a region a conversation already has returns the
+existing row.
+
+Usage:
+    uv run python test_tool_singleflight.py
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "singleflight.db")
+
+import regional_interests_tool
+from database import RegionBorder, RegionInterest, get_db_manager
+from singleflight import tool_flights
+
+CALLERS = 8
+REGION_COORDINATES = [[-0.1, 51.5], [-0.1, 51.6], [0.0, 51.6], [0.0, 51.5], [-0.1, 51.5]]
+
+
+def make_conversation() -> tuple:
+    db_manager = get_db_manager()
+    with db_manager.get_session() as session:
+        region = RegionBorder(region_name="Shoreditch", borough_name="Hackney", coordinates=json.dumps(REGION_COORDINATES))
+        session.add(region)
+        session.commit()
+        region_id = region.id
+    conversation = db_manager.create_conversation("Show me Shoreditch")
+    db_manager.add_conversation_region(conversation.id, "Shoreditch", region_id=region_id)
+    return conversation.id, region_id
+
+
+def test_identical_calls_share_one_execution():
+    conversation_id, region_id = make_conversation()
+    llm_calls = []
+    
+    def fake_stream(conversation_id, area_coordinates, interests):
+        llm_calls.append(interests)
+        time.sleep(0.2)
+        poi = {"name": "Pizza Pilgrims", "coordinates": {"latitude": 51.55, "longitude": -0.05}}
+        for interest in interests:
+            yield interest, poi
+    
+    # The same interests, spelled and ordered differently, from several callers
+    spellings = ["[pizza places, cafes]", "[Cafes, Pizza_Places]"]
+    results = [None] * CALLERS
+    shared_before = tool_flights.stats()["shared"]
+    
+    def call(n: int) -> None:
+        results[n] = regional_interests_tool.get_regional_interests(conversation_id, region_id, spellings[n % 2])
+    
+    original_stream = regional_interests_tool._stream_points_of_interest
+    original_update = regional_interests_tool.websocket_manager.schedule_map_update
+    regional_interests_tool._stream_points_of_interest = fake_stream
+    regional_interests_tool.websocket_manager.schedule_map_update = lambda conversation_id, properties=None, change=None: None
+    try:
+        threads = [threading.Thread(target=call, args=(n,)) for n in range(CALLERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert len(llm_calls) == 1, f"LLM called {len(llm_calls)} times"
+        assert len(set(results)) == 1, f"callers got different results: {set(results)}"
+        assert tool_flights.stats()["shared"] - shared_before >= CALLERS - 1, tool_flights.stats()
+        print(f"✅ {CALLERS} concurrent calls ran the POI generation once")
+        
+        # A later call is served from the POI cache and must not add rows either
+        regional_interests_tool.get_regional_interests(conversation_id, region_id, spellings[0])
+    finally:
+        regional_interests_tool._stream_points_of_interest = original_stream
+        regional_interests_tool.websocket_manager.schedule_map_update = original_update
+    
+    with get_db_manager().get_session() as session:
+        rows = session.query(RegionInterest).filter(RegionInterest.conversation_id == conversation_id).count()
+    assert rows == 2, f"expected one row per interest, got {rows}"
+    print(f"✅ Interests stored once ({rows} rows) after {CALLERS + 1} calls")
+
+
+def test_existing_region_not_duplicated():
+    db_manager = get_db_manager()
+    conversation = db_manager.create_conversation("Shoreditch again")
+    
+    _, region_id = make_conversation()
+    first = db_manager.add_conversation_region(conversation.id, "Shoreditch", region_id=region_id)
+    second = db_manager.add_conversation_region(conversation.id, "Shoreditch", region_id=region_id)
+    
+    assert first.id == second.id, f"region added twice: {first.id}, {second.id}"
+    assert len(db_manager.get_conversation_regions(conversation.id)) == 1
+    print("✅ Adding a region twice returns the existing row")
+
+
+def main() -> None:
+    """Main test function."""
+    print("Tool Single-Flight Test")
+    print("=" * 60)
+    
+    test_identical_calls_share_one_execution()
+    test_existing_region_not_duplicated()
+    
+    print("=" * 60)
+    print("Testing complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 import socketio
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
+import os
 import json
+import asyncio
+import contextlib
 import logging
 import time
-from database import get_db_manager
+from database import get_async_db_manager
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,12 +25,38 @@ class WebSocketManager:
             ping_timeout=60,
         )
         
-        # Track connected clients
+        # Track connected clients and the conversation rooms they joined
         self.connected_clients: Dict[str, Dict] = {}
+        self.subscribers: Dict[str, Set[str]] = {}
         
         # Current map state
         self.current_map_state: List[Dict] = []
         
+        # Coalescing of map updates: requests for the same conversation within
+        # the window (or until the agent step flushes) become a single emit
+        self.update_window = float(os.getenv("MAP_UPDATE_WINDOW_MS", "150")) / 1000
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending_updates: Dict[str, Dict[str, Any]] = {}
+        # Flushes started by the window timer; held here so they aren't collected mid-emit
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self.update_requests = 0
+        self.update_emits = 0
+        self.saved_emits = 0
+        self.delta_emits = 0
+        self.snapshot_emits = 0
+        
+        # Per-conversation map version, bumped by every snapshot or delta, and the
+        # last properties list so snapshots can include it. The lock keeps a
+        # snapshot's version matching the data it loaded; all three are dropped
+        # when a conversation's last subscriber leaves. Each lock is stored with
+        # the number of tasks holding or waiting on it, and is only dropped once
+        # that reaches zero so a late caller never gets a second lock
+        self.map_versions: Dict[str, int] = {}
+        self.last_properties: Dict[str, List[Dict]] = {}
+        self._map_locks: Dict[str, List[Any]] = {}
+        # (sid, conversation_id) pairs with a resync snapshot on its way
+        self._resyncing: Set[Tuple[str, str]] = set()
+        
         # Register event handlers
         self._register_handlers()
     
@@ -40,7 +69,8 @@ class WebSocketManager:
             logger.info(f"Client connected: {sid}")
             self.connected_clients[sid] = {
                 "connected_at": time.time(),
-                "session_id": sid
+                "session_id": sid,
+                "conversations": set()
             }
             
             # Send current map state to newly connected client
@@ -54,8 +84,55 @@ class WebSocketManager:
         async def disconnect(sid):
             """Handle client disconnection."""
             logger.info(f"Client disconnected: {sid}")
-            if sid in self.connected_clients:
-                del self.connected_clients[sid]
+            client = self.connected_clients.pop(sid, None)
+            if client:
+                for conversation_id in client["conversations"]:
+                    self._remove_subscriber(conversation_id, sid)
+        
+        @self.sio.on('subscribe')
+        async def subscribe(sid, data):
+            """Join a conversation's room and send its current map."""
+            conversation_id = (data or {}).get('conversation_id')
+            client = self.connected_clients.get(sid)
+            if not conversation_id or client is None:
+                return
+            
+            await self.sio.enter_room(sid, conversation_id)
+            client["conversations"].add(conversation_id)
+            self.subscribers.setdefault(conversation_id, set()).add(sid)
+            logger.info(f"Client {sid} subscribed to conversation {conversation_id}")
+            
+            await self._send_snapshot(sid, conversation_id)
+        
+        @self.sio.on('resync')
+        async def resync(sid, data):
+            """Send a full snapshot to a client that missed a map_delta version."""
+            conversation_id = (data or {}).get('conversation_id')
+            client = self.connected_clients.get(sid)
+            if not conversation_id or client is None or conversation_id not in client["conversations"]:
+                return
+            
+            # Every delta after a gap fails the version check; one snapshot covers them all
+            if (sid, conversation_id) in self._resyncing:
+                return
+            logger.info(f"Client {sid} requested resync of conversation {conversation_id}")
+            self._resyncing.add((sid, conversation_id))
+            try:
+                await self._send_snapshot(sid, conversation_id)
+            finally:
+                self._resyncing.discard((sid, conversation_id))
+        
+        @self.sio.on('unsubscribe')
+        async def unsubscribe(sid, data):
+            """Leave a conversation's room."""
+            conversation_id = (data or {}).get('conversation_id')
+            client = self.connected_clients.get(sid)
+            if not conversation_id or client is None:
+                return
+            
+            await self.sio.leave_room(sid, conversation_id)
+            client["conversations"].discard(conversation_id)
+            self._remove_subscriber(conversation_id, sid)
         
         @self.sio.on('get_map_state')
         async def get_map_state(sid):
@@ -65,79 +142,311 @@ class WebSocketManager:
                 'areas': self.current_map_state
             }, room=sid)
     
+    def _remove_subscriber(self, conversation_id: str, sid: str) -> None:
+        sids = self.subscribers.get(conversation_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self.subscribers[conversation_id]
+                # Nobody holds this map anymore; the next subscriber gets a fresh snapshot
+                self.map_versions.pop(conversation_id, None)
+                self.last_properties.pop(conversation_id, None)
+                entry = self._map_locks.get(conversation_id)
+                if entry is not None and entry[1] == 0:
+                    del self._map_locks[conversation_id]
+    
+    @contextlib.asynccontextmanager
+    async def _map_lock(self, conversation_id: str):
+        """Hold a conversation's map lock, dropping it afterwards if nobody needs it."""
+        entry = self._map_locks.setdefault(conversation_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and conversation_id not in self.subscribers:
+                self._map_locks.pop(conversation_id, None)
+    
+    def _next_version(self, conversation_id: str) -> Tuple[int, int]:
+        """Bump a conversation's map version and return (base_version, version)."""
+        base_version = self.map_versions.get(conversation_id, 0)
+        self.map_versions[conversation_id] = base_version + 1
+        return base_version, base_version + 1
+    
+    async def _send_snapshot(self, sid: str, conversation_id: str) -> None:
+        # Under the map lock no version can be bumped while the regions load,
+        # so the snapshot's version covers exactly the data in it
+        async with self._map_lock(conversation_id):
+            update_payload = await self._build_map_payload(
+                conversation_id,
+                self.last_properties.get(conversation_id),
+                self.map_versions.get(conversation_id, 0)
+            )
+            await self.sio.emit('map_state', update_payload, room=sid)
+        self.snapshot_emits += 1
+    
+    async def _build_map_payload(self, conversation_id: str, properties: Optional[List[Dict]], version: int) -> Dict:
+        """Load all regions and points of interest for a conversation into a map_state snapshot."""
+        # Regions with their points of interest, loaded in one query
+        regions_data = await get_async_db_manager().get_conversation_map_snapshot(conversation_id)
+        
+        # Prepare update payload
+        update_payload = {
+            'type': 'map_data',
+            'conversation_id': conversation_id,
+            'regions': regions_data,
+            'version': version,
+            'timestamp': time.time()
+        }
+        
+        # Add properties if provided
+        if properties is not None:
+            update_payload['properties'] = properties
+        
+        return update_payload
+    
     async def broadcast_map_update(self, conversation_id: str, properties: Optional[List[Dict]] = None) -> Dict:
         """
-        Broadcast map update with all regions for a conversation to all connected clients.
+        Broadcast a full map_state snapshot of a conversation to the clients subscribed to it.
         
         Args:
             conversation_id: The conversation ID to get regions for
-            properties: Optional list of property dictionaries to include in the update
+            properties: Optional list of property dictionaries; defaults to the last list sent
             
         Returns:
             Dict with operation result and current state info
         """
         try:
-            # Get all regions for this conversation from database
-            db_manager = get_db_manager()
-            regions = db_manager.get_conversation_regions(conversation_id)
-            
-            # Convert regions to dict format and include points of interest
-            regions_data = []
-            if regions:
-                for region in regions:
-                    region_dict = region.to_dict()
-                    
-                    # Get points of interest for this region and conversation
-                    region_interests = db_manager.get_region_interests(region.region_id, conversation_id)
-                    
-                    # Add POIs to region data
-                    region_dict['points_of_interest'] = []
-                    for interest in region_interests:
-                        interest_dict = interest.to_dict()
-                        region_dict['points_of_interest'].append(interest_dict)
-                    
-                    regions_data.append(region_dict)
-            
-            # Prepare update payload
-            update_payload = {
-                'type': 'map_data',
-                'conversation_id': conversation_id,
-                'regions': regions_data,
-                'timestamp': time.time()
+            async with self._map_lock(conversation_id):
+                if properties is not None:
+                    self.last_properties[conversation_id] = properties
+                else:
+                    properties = self.last_properties.get(conversation_id)
+                _, version = self._next_version(conversation_id)
+                
+                subscriber_count = len(self.subscribers.get(conversation_id, ()))
+                if not subscriber_count:
+                    # Nobody is watching this conversation, so skip loading the map
+                    logger.info(f"No subscribers for conversation {conversation_id}, skipping map update")
+                    return {
+                        'success': True,
+                        'conversation_id': conversation_id,
+                        'regions_count': 0,
+                        'properties_count': len(properties) if properties else 0,
+                        'subscribers': 0,
+                        'version': version,
+                        'connected_clients': len(self.connected_clients)
+                    }
+                
+                update_payload = await self._build_map_payload(conversation_id, properties, version)
+                regions_count = len(update_payload['regions'])
+                
+                # Emit only to the conversation's room
+                await self.sio.emit('map_state', update_payload, room=conversation_id)
+                self.snapshot_emits += 1
+                properties_info = f" and {len(properties)} properties" if properties else ""
+                logger.info(f"Broadcasted map data for conversation {conversation_id} with {regions_count} regions{properties_info} to {subscriber_count} subscribers")
+                
+                return {
+                    'success': True,
+                    'conversation_id': conversation_id,
+                    'regions_count': regions_count,
+                    'properties_count': len(properties) if properties else 0,
+                    'subscribers': subscriber_count,
+                    'version': version,
+                    'connected_clients': len(self.connected_clients)
+                }
+                
+        except Exception as e:
+            logger.error(f"Error broadcasting map update: {e}")
+            return {
+                'success': False,
+                'error': str(e),
+                'connected_clients': len(self.connected_clients)
             }
+    
+    async def emit_map_delta(self, conversation_id: str, changes: List[Dict]) -> Dict:
+        """
+        Emit only what changed in a conversation's map as one map_delta event.
+        
+        Clients apply the changes when base_version matches the version they
+        hold and otherwise emit 'resync' for a full snapshot.
+        
+        Args:
+            conversation_id: The conversation the changes belong to
+            changes: region_added, pois_added and properties_replaced changes
             
-            # Add properties if provided
-            if properties is not None:
-                update_payload['properties'] = properties
-            
-            # Broadcast to all connected clients
-            if self.connected_clients:
-                await self.sio.emit('map_state', update_payload)
-                properties_info = f" and {len(properties)} properties" if properties else ""
-                logger.info(f"Broadcasted map data for conversation {conversation_id} with {len(regions_data)} regions{properties_info} to {len(self.connected_clients)} clients")
-            else:
-                logger.warning("No connected clients to broadcast map update")
+        Returns:
+            Dict with operation result and the new version
+        """
+        try:
+            async with self._map_lock(conversation_id):
+                for change in changes:
+                    if change['type'] == 'properties_replaced':
+                        self.last_properties[conversation_id] = change['properties']
+                base_version, version = self._next_version(conversation_id)
+                
+                subscriber_count = len(self.subscribers.get(conversation_id, ()))
+                if subscriber_count:
+                    await self.sio.emit('map_delta', {
+                        'type': 'map_delta',
+                        'conversation_id': conversation_id,
+                        'base_version': base_version,
+                        'version': version,
+                        'changes': changes,
+                        'timestamp': time.time()
+                    }, room=conversation_id)
+                    self.delta_emits += 1
+                    logger.info(f"Sent map delta v{base_version}->v{version} for conversation {conversation_id} with {len(changes)} changes to {subscriber_count} subscribers")
             
             return {
                 'success': True,
                 'conversation_id': conversation_id,
-                'regions_count': len(regions_data),
-                'properties_count': len(properties) if properties else 0,
+                'changes_count': len(changes),
+                'subscribers': subscriber_count,
+                'version': version,
                 'connected_clients': len(self.connected_clients)
             }
             
         except Exception as e:
-            logger.error(f"Error broadcasting map update: {e}")
+            logger.error(f"Error sending map delta: {e}")
             return {
                 'success': False,
                 'error': str(e),
                 'connected_clients': len(self.connected_clients)
             }
     
+    async def emit_job_progress(self, conversation_id: str, job: Dict) -> None:
+        """
+        Send a background job's state to the conversation's subscribers.
+        
+        Args:
+            conversation_id: The conversation the job belongs to
+            job: The job's to_dict() payload
+        """
+        if not self.subscribers.get(conversation_id):
+            return
+        try:
+            await self.sio.emit('job_progress', {
+                'type': 'job_progress',
+                **job,
+                'timestamp': time.time()
+            }, room=conversation_id)
+        except Exception as e:
+            logger.error(f"Error sending job progress: {e}")
+    
+    async def _emit_update(self, conversation_id: str, properties: Optional[List[Dict]], changes: List[Dict], full: bool) -> Dict:
+        if properties is not None:
+            changes = changes + [{'type': 'properties_replaced', 'properties': properties}]
+        if full or not changes:
+            # Callers that did not describe their change get a full snapshot
+            return await self.broadcast_map_update(conversation_id, properties)
+        return await self.emit_map_delta(conversation_id, changes)
+    
+    def attach_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Set the server event loop that coalesced updates are emitted from."""
+        self.loop = loop
+    
+    def schedule_map_update(self, conversation_id: str, properties: Optional[List[Dict]] = None, change: Optional[Dict] = None) -> None:
+        """
+        Queue a map update for a conversation. Safe to call from tool threads.
+        
+        Requests for the same conversation are merged until the window closes
+        or flush_map_updates is called; the latest properties list wins. Without
+        an attached server loop (e.g. CLI scripts) the update is sent immediately.
+        
+        Args:
+            conversation_id: The conversation whose map changed
+            properties: New property list, sent as a properties_replaced change
+            change: What changed, e.g. {"type": "region_added", "region": {...}} or
+                {"type": "pois_added", "region_id": 1, "interests": [...]}. Requests
+                with neither properties nor a change are sent as a full snapshot.
+        """
+        full = properties is None and change is None
+        changes = [change] if change is not None else []
+        
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            asyncio.run(self._emit_update(conversation_id, properties, changes, full))
+            return
+        
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        
+        if running_loop is loop:
+            self._queue_map_update(conversation_id, properties, changes, full)
+        else:
+            loop.call_soon_threadsafe(self._queue_map_update, conversation_id, properties, changes, full)
+    
+    def _queue_map_update(self, conversation_id: str, properties: Optional[List[Dict]], changes: List[Dict], full: bool) -> None:
+        # Runs on the server loop
+        self.update_requests += 1
+        pending = self._pending_updates.get(conversation_id)
+        if pending is not None:
+            pending["requests"] += 1
+            pending["changes"].extend(changes)
+            pending["full"] = pending["full"] or full
+            if properties is not None:
+                pending["properties"] = properties
+            return
+        
+        self._pending_updates[conversation_id] = {
+            "requests": 1,
+            "properties": properties,
+            "changes": list(changes),
+            "full": full,
+            "timer": self.loop.call_later(
+                self.update_window,
+                self._start_flush, conversation_id
+            )
+        }
+    
+    def _start_flush(self, conversation_id: str) -> None:
+        task = self.loop.create_task(self.flush_map_updates(conversation_id))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_done)
+    
+    def _flush_done(self, task: asyncio.Task) -> None:
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Map update flush failed: {task.exception()!r}")
+    
+    async def flush_map_updates(self, conversation_id: str) -> Optional[Dict]:
+        """
+        Emit the pending coalesced update for a conversation, if any.
+        
+        Returns:
+            The broadcast result, or None when nothing was pending
+        """
+        pending = self._pending_updates.pop(conversation_id, None)
+        if pending is None:
+            return None
+        
+        pending["timer"].cancel()
+        self.update_emits += 1
+        self.saved_emits += pending["requests"] - 1
+        return await self._emit_update(conversation_id, pending["properties"], pending["changes"], pending["full"])
+    
+    def get_update_stats(self) -> Dict:
+        """Counters for coalesced map updates."""
+        return {
+            "window_ms": self.update_window * 1000,
+            "requests": self.update_requests,
+            "emits": self.update_emits,
+            "saved_emits": self.saved_emits,
+            "delta_emits": self.delta_emits,
+            "snapshot_emits": self.snapshot_emits,
+            "pending_conversations": len(self._pending_updates)
+        }
+    
     def get_current_state(self) -> Dict:
         """Get current map state information."""
         return {
             'connected_clients': len(self.connected_clients),
+            'subscribed_conversations': len(self.subscribers),
             'current_areas': len(self.current_map_state),
             'areas': [area['area_name'] for area in self.current_map_state]
         }
@@ -14,6 +14,7 @@ import {
   RegionPointOfInterest,
   RegionProperty,
   SettlrEvents,
+  SettlrMapRegion,
 } from "@/types/socket";
 import { triggerGlobalFetch, triggerRegionFetch } from "@/utils/regionApi";
 import { getOrCreateSessionId } from "@/utils/sessionUtils";
@@ -174,8 +175,14 @@ export default function MapPage() {
   // Store color mappings for polygons by area_name
   const polygonColorsRef = useRef<Map<string, string>>(new Map());
 
+  // Version of the map state last applied from the socket
+  const mapVersionRef = useRef<number>(0);
+  // Set while a requested resync snapshot hasn't arrived yet
+  const resyncPendingRef = useRef<boolean>(false);
+
   const {
     status: socketStatus,
+    emit,
     on,
     off,
     isConnected,
@@ -194,26 +201,45 @@ export default function MapPage() {
   });
 
   useEffect(() => {
+    const toPolygon = (region: SettlrMapRegion): PolygonWithMeta => {
+      const regionName = region.region_name;
+      // Get existing color or generate new one
+      let color = polygonColorsRef.current.get(regionName);
+      if (!color) {
+        color = generateRandomColor();
+        polygonColorsRef.current.set(regionName, color);
+      }
+
+      return {
+        id: region.region_id,
+        coordinates: region.coordinates,
+        region_name: regionName,
+        color: color,
+        points_of_interest: region.points_of_interest,
+      };
+    };
+
+    const onMapDataArrived = () => {
+      // Clear loading/error states when new data arrives
+      setIsLoadingRegionDetails(false);
+      setRegionFetchError(null);
+
+      // Stop first response loading animation when socket data arrives
+      if (isFirstChatResponseLoading) {
+        stopFirstResponseLoadingAnimation();
+      }
+
+      // Stop region loading animation when new data arrives
+      stopRegionLoadingAnimation();
+    };
+
     const handleMapUpdate: SettlrEvents["map_state"] = (data) => {
       console.log("Received map state update:", data);
-      const polygonsWithColors = data.regions
-        .map((region) => {
-          const regionName = region.region_name;
-          // Get existing color or generate new one
-          let color = polygonColorsRef.current.get(regionName);
-          if (!color) {
-            color = generateRandomColor();
-            polygonColorsRef.current.set(regionName, color);
-          }
+      mapVersionRef.current = data.version ?? 0;
+      resyncPendingRef.current = false;
 
-          return {
-            id: region.region_id,
-            coordinates: region.coordinates,
-            region_name: regionName,
-            color: color,
-            points_of_interest: region.points_of_interest,
-          };
-        })
+      const polygonsWithColors = data.regions
+        .map(toPolygon)
         .filter((reg) => reg.id !== null);
 
       setMapPolygons(polygonsWithColors);
@@ -225,27 +251,132 @@ export default function MapPage() {
         setMapProperties([]);
       }
 
-      // Clear loading/error states when new data arrives
-      setIsLoadingRegionDetails(false);
-      setRegionFetchError(null);
+      onMapDataArrived();
+    };
 
-      // Stop first response loading animation when socket data arrives
-      if (isFirstChatResponseLoading) {
-        stopFirstResponseLoadingAnimation();
+    const handleMapDelta: SettlrEvents["map_delta"] = (data) => {
+      if (data.base_version !== mapVersionRef.current) {
+        // Missed an update, ask for a full snapshot instead; deltas that
+        // arrive before the snapshot don't trigger another request
+        if (!resyncPendingRef.current) {
+          console.log(
+            `Map version gap (have ${mapVersionRef.current}, delta from ${data.base_version}), resyncing`
+          );
+          resyncPendingRef.current = true;
+          emit("resync", { conversation_id: sessionId });
+        }
+        return;
       }
+      console.log("Received map delta:", data);
+      mapVersionRef.current = data.version;
 
-      // Stop region loading animation when new data arrives
-      stopRegionLoadingAnimation();
+      data.changes.forEach((change) => {
+        if (change.type === "region_added") {
+          if (change.region.region_id === null) {
+            return;
+          }
+          const polygon = toPolygon(change.region);
+          setMapPolygons((polygons) => [
+            ...polygons.filter((p) => p.id !== polygon.id),
+            polygon,
+          ]);
+        } else if (change.type === "pois_streamed") {
+          // Shown while the rest of the response streams in, replaced by
+          // the saved group when pois_added arrives
+          setMapPolygons((polygons) =>
+            polygons.map((p) => {
+              if (p.id !== change.region_id) {
+                return p;
+              }
+              const group = p.points_of_interest.find(
+                (i) => i.interest_type === change.interest_type
+              );
+              return {
+                ...p,
+                points_of_interest: group
+                  ? p.points_of_interest.map((i) =>
+                      i === group
+                        ? {
+                            ...i,
+                            points_of_interest: [
+                              ...i.points_of_interest,
+                              ...change.points_of_interest,
+                            ],
+                          }
+                        : i
+                    )
+                  : [
+                      ...p.points_of_interest,
+                      {
+                        id: -1 - p.points_of_interest.length,
+                        interest_type: change.interest_type,
+                        points_of_interest: change.points_of_interest,
+                      },
+                    ],
+              };
+            })
+          );
+        } else if (change.type === "pois_added") {
+          const addedIds = new Set(change.interests.map((i) => i.id));
+          const addedTypes = new Set(
+            change.interests.map((i) => i.interest_type)
+          );
+          setMapPolygons((polygons) =>
+            polygons.map((p) =>
+              p.id === change.region_id
+                ? {
+                    ...p,
+                    points_of_interest: [
+                      ...p.points_of_interest.filter(
+                        (i) =>
+                          !addedIds.has(i.id) &&
+                          !addedTypes.has(i.interest_type)
+                      ),
+                      ...change.interests,
+                    ],
+                  }
+                : p
+            )
+          );
+        } else if (change.type === "properties_replaced") {
+          setMapProperties(change.properties);
+        }
+      });
+
+      onMapDataArrived();
+    };
+
+    const handleJobProgress: SettlrEvents["job_progress"] = (data) => {
+      console.log("Received job progress:", data);
+      // Region details are fetched in the background; successful jobs end
+      // with a map update, failed ones only with this event
+      if (data.status === "failed") {
+        setRegionFetchError(data.error ?? "Failed to fetch region details");
+        setIsLoadingRegionDetails(false);
+        stopRegionLoadingAnimation();
+      }
     };
 
     if (isConnected) {
       on("map_state", handleMapUpdate);
+      on("map_delta", handleMapDelta);
+      on("job_progress", handleJobProgress);
     }
 
     return () => {
       off("map_state", handleMapUpdate);
+      off("map_delta", handleMapDelta);
+      off("job_progress", handleJobProgress);
     };
-  }, [isConnected, on, off]);
+  }, [isConnected, on, off, emit, sessionId]);
+
+  // Only receive map updates for this conversation
+  useEffect(() => {
+    if (isConnected) {
+      resyncPendingRef.current = false;
+      emit("subscribe", { conversation_id: sessionId });
+    }
+  }, [isConnected, emit, sessionId]);
 
   useEffect(() => {
     const initMap = async () => {
@@ -3,7 +3,7 @@ import {
   SocketHookReturn,
   SocketStatus,
 } from "@/types/socket";
-import { useEffect, useRef, useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
 import { io, Socket } from "socket.io-client";
 
 export function useSocket(options: SocketHookOptions): SocketHookReturn {
@@ -66,22 +66,23 @@ export function useSocket(options: SocketHookOptions): SocketHookReturn {
     }
   };
 
-  const emit = (event: string, data?: unknown) => {
+  // Stable identities so effects can list them as dependencies
+  const emit = useCallback((event: string, data?: unknown) => {
     if (socketRef.current?.connected) {
       console.log("Emitting event:", event, data);
       socketRef.current.emit(event, data);
     } else {
       console.warn("Socket not connected. Cannot emit:", event);
     }
-  };
+  }, []);
 
-  const on: SocketHookReturn["on"] = (event, handler) => {
+  const on = useCallback<SocketHookReturn["on"]>((event, handler) => {
     if (socketRef.current) {
       socketRef.current.on<"map_update">(event, handler);
     }
-  };
+  }, []);
 
-  const off: SocketHookReturn["off"] = (event, handler) => {
+  const off = useCallback<SocketHookReturn["off"]>((event, handler) => {
     if (socketRef.current) {
       if (handler) {
         socketRef.current.off<"map_update">(event, handler);
@@ -89,7 +90,7 @@ export function useSocket(options: SocketHookOptions): SocketHookReturn {
         socketRef.current.off(event);
       }
     }
-  };
+  }, []);
 
   useEffect(() => {
     if (autoConnect) {
@@ -50,20 +50,53 @@ export type RegionPointOfInterest = {
     categories: string[];
   }[];
 };
+export type SettlrMapRegion = {
+  conversation_id: string;
+  region_id: number;
+  coordinates: Polygon;
+  region_name: string;
+  created_at: string;
+  points_of_interest: RegionPointOfInterest[];
+};
 type SettlrMapStateData = {
   conversation_id: string;
   properties?: RegionProperty[];
-  regions: {
-    conversation_id: string;
-    region_id: number;
-    coordinates: Polygon;
-    region_name: string;
-    created_at: string;
-    points_of_interest: RegionPointOfInterest[];
-  }[];
+  regions: SettlrMapRegion[];
+  version: number;
+};
+export type SettlrMapChange =
+  | { type: "region_added"; region: SettlrMapRegion }
+  | {
+      type: "pois_added";
+      region_id: number;
+      interests: RegionPointOfInterest[];
+    }
+  | {
+      type: "pois_streamed";
+      region_id: number;
+      interest_type: string;
+      points_of_interest: RegionPointOfInterest["points_of_interest"];
+    }
+  | { type: "properties_replaced"; properties: RegionProperty[] };
+type SettlrMapDeltaData = {
+  conversation_id: string;
+  base_version: number;
+  version: number;
+  changes: SettlrMapChange[];
+};
+export type SettlrJobProgressData = {
+  job_id: string;
+  kind: string;
+  conversation_id: string;
+  region_id?: number;
+  status: "queued" | "running" | "done" | "failed";
+  step: string | null;
+  error: string | null;
 };
 export type SettlrEvents = {
   map_state: (data: SettlrMapStateData) => void;
+  map_delta: (data: SettlrMapDeltaData) => void;
+  job_progress: (data: SettlrJobProgressData) => void;
 };
 
 export interface SocketHookReturn {